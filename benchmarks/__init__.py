@@ -0,0 +1,7 @@
+""""benchmarks
+    --Timings and peak memory of the TFIM kernels over system sizes and
+        dimensions, written as JSON and compared against a baseline
+    --kernels: python -m benchmarks kernels; the lanczos and chi_ii
+        pipelines end to end: python -m benchmarks.pipelines
+    --Run from the repository root, with --help for the options
+"""
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+""""__main__.py
+    --Command line entry of the benchmarks: python -m benchmarks kernels
+        -o results.json --baseline baseline.json
+    --the baseline defaults to the stored reference/<suite>.json (N <= 16
+        for the kernels), regenerated with python -m benchmarks kernels
+        --sizes 8 12 16 -o benchmarks/reference/kernels.json
+    --exits with status 1 when a result regresses past the thresholds
+"""
+
+import argparse
+import os
+import sys
+from benchmarks import harness
+from benchmarks import kernels  # noqa: F401 (registers the kernel benchmarks)
+
+###############################################################################
+def main():
+
+    # Parse command line arguements
+    ###################################
+    parser = argparse.ArgumentParser(description="Timings and peak memory of the TFIM kernels")
+    parser.add_argument('suite', choices=sorted(harness.BENCHMARKS), help='Benchmark suite')
+    parser.add_argument('--only', nargs='+', default=None, help='Benchmark names to run')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 12, 16, 20, 24], help='Numbers of spins')
+    parser.add_argument('--dims', type=int, nargs='+', default=[1, 2], help='Lattice dimensions')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per measurement')
+    parser.add_argument('--no-limit', action='store_true', help='Ignore the max_N of each benchmark')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks of the suite and exit')
+    parser.add_argument('-o', default=None, help='JSON results filename')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against (default: the stored reference)')
+    parser.add_argument('--no-baseline', action='store_true', help='Skip the comparison')
+    parser.add_argument('--time-threshold', type=float, default=1.3, help='Allowed time ratio to the baseline')
+    parser.add_argument('--memory-threshold', type=float, default=1.3, help='Allowed peak memory ratio to the baseline')
+    args = parser.parse_args()
+    ###################################
+
+    if args.list:
+        for name, bench in harness.BENCHMARKS[args.suite].items():
+            print('{:<24} max_N={} dims={}'.format(name, bench.max_N, bench.dims))
+        return 0
+
+    results = harness.run_suite(args.suite, args.only, args.sizes, args.dims, args.repeat, not args.no_limit)
+    if args.o is not None:
+        harness.write_results(results, args.o)
+
+    # a suite without a stored reference is only compared against --baseline
+    baseline = args.baseline if args.baseline is not None else harness.reference(args.suite)
+    if not args.no_baseline and (args.baseline is not None or os.path.exists(baseline)):
+        regressions = harness.compare(results, harness.load_results(baseline),
+                                      args.time_threshold, args.memory_threshold)
+        print('compared against {}: {} regressions'.format(baseline, len(regressions)))
+        for result in regressions:
+            print('REGRESSION {name} N={N} D={D}: time x{time_ratio:.2f}, memory x{memory_ratio:.2f}'.format(**result))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+""""harness.py
+    --Registry, measurement and JSON results of the benchmarks
+    --a benchmark is a setup(L) returning the callable to time, so the
+        instance (couplings, basis, vectors) is built outside the timing
+    --time is the best of repeat measurements without tracing, each
+        looping fast kernels for at least min_time seconds; peak_memory is
+        the tracemalloc peak of one more run
+    --Requires: numpy
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import time
+import tracemalloc
+import numpy as np
+
+###############################################################################
+class Benchmark:
+    """A registered setup(L) -> callable, run for N <= max_N and dims"""
+
+    def __init__(self, name, setup, max_N=None, dims=(1, 2)):
+        self.name = name
+        self.setup = setup
+        self.max_N = max_N
+        self.dims = dims
+
+# Registered benchmarks by suite and name
+BENCHMARKS = {}
+
+def benchmark(suite, name, max_N=None, dims=(1, 2)):
+    """Decorator registering setup(L) as benchmark name of suite"""
+    def register(setup):
+        BENCHMARKS.setdefault(suite, {})[name] = Benchmark(name, setup, max_N, dims)
+        return setup
+    return register
+
+def lattice_shape(N, D):
+    """Returns L of N sites in D dimensions, the squarest [height, width]
+        with both sides at least 2 for D = 2, or None"""
+    if D == 1:
+        return [N]
+    heights = [h for h in range(2, int(np.sqrt(N)) + 1) if N % h == 0]
+    return [heights[-1], N // heights[-1]] if heights else None
+
+###############################################################################
+# Measurement
+
+def measure(run, repeat=3, min_time=0.05):
+    """Returns the best time per call, all times and the peak traced memory
+        of run()"""
+    start = time.perf_counter()
+    run()
+    first = time.perf_counter() - start
+    loops = max(1, int(np.ceil(min_time/max(first, 1e-9))))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        times.append((time.perf_counter() - start)/loops)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': min(times), 'times': times, 'loops': loops, 'peak_memory': peak}
+
+def run_suite(suite, names=None, sizes=(8, 12, 16, 20, 24), dims=(1, 2), repeat=3, limit=True, log=print):
+    """Runs the benchmarks of suite over sizes and dims and returns the
+        results as a list of dicts; limit skips N above each max_N"""
+    results = []
+    for name, bench in BENCHMARKS[suite].items():
+        if names and name not in names:
+            continue
+        for D in dims:
+            if D not in bench.dims:
+                continue
+            for N in sizes:
+                L = lattice_shape(N, D)
+                if L is None or (limit and bench.max_N is not None and N > bench.max_N):
+                    continue
+                # progress bars of the kernels go to stderr
+                with contextlib.redirect_stderr(io.StringIO()):
+                    run = bench.setup(L)
+                    result = measure(run, repeat)
+                result.update(suite=suite, name=name, N=N, D=D, L=L)
+                results.append(result)
+                if log is not None:
+                    log('{:<24} N={:<3} D={} {:>10.4f}s {:>10.1f} MiB'.format(
+                        name, N, D, result['time'], result['peak_memory']/2**20))
+    return results
+
+###############################################################################
+# Results and baselines
+
+# Directory of the stored baselines, reference/<suite>.json
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference')
+
+def reference(suite):
+    """Returns the filename of the stored baseline of suite"""
+    return os.path.join(REFERENCE, suite + '.json')
+
+def metadata():
+    import scipy
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'system': platform.system(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def write_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump({'metadata': metadata(), 'results': results}, f, indent=1)
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)['results']
+
+def key(result):
+    return result['suite'], result['name'], result['N'], result['D']
+
+def compare(results, baseline, time_threshold=1.3, memory_threshold=1.3):
+    """Returns the results slower or using more memory than the baseline
+        by more than the thresholds (ratios), with the ratios found"""
+    reference = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get(key(result))
+        if base is None:
+            continue
+        time_ratio = result['time']/base['time'] if base['time'] > 0 else 1.
+        memory_ratio = result['peak_memory']/base['peak_memory'] if base['peak_memory'] > 0 else 1.
+        if time_ratio > time_threshold or memory_ratio > memory_threshold:
+            regressions.append(dict(result, time_ratio=time_ratio, memory_ratio=memory_ratio))
+    return regressions
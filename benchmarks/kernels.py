@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+""""kernels.py
+    --Kernel benchmarks: matrix element builders, perturbative blocks, the
+        Schmidt decomposition and eigsh configurations
+    --1D sizes use SK couplings (tfim.Jij_instance), 2D sizes +-J nearest
+        neighbor couplings (tfim_perturbation.Jij_2D_NN), all with seed 0
+    --max_N keeps the pure Python loops (one pass per basis state) to
+        sizes that finish in seconds
+    --Requires: tfim.py, tfim_perturbation.py, tfim_matrices.py,
+        tfim_classical.py, tfim_rdm.py, numpy, scipy
+"""
+
+import tfim
+import tfim_perturbation
+import tfim_matrices
+import tfim_classical
+import tfim_rdm
+import numpy as np
+from scipy.sparse import linalg as spla
+from benchmarks.harness import benchmark
+
+###############################################################################
+def instance(L):
+    """Returns the lattice, basis and N x N couplings of L"""
+    lattice = tfim.Lattice(L, True)
+    basis = tfim.IsingBasis(lattice)
+    N = lattice.N
+    if len(L) == 1:
+        Jij = tfim_classical.full_coupling(tfim.Jij_instance(N, 1.0, 'bimodal', 0, False), N)
+    else:
+        Jij = tfim_perturbation.Jij_2D_NN(0, N, True, L[1], L[0], lattice)[1]
+    return lattice, basis, Jij
+
+def ground_states(L, Jij):
+    # Classical ground manifold, by branch and bound for SK and transfer
+    # matrix on 2D strips, neither building the 2^N energy table
+    if len(L) == 1:
+        return tfim_classical.branch_and_bound(Jij, L[0])[1].astype(np.int64)
+    return tfim_classical.transfer_matrix(Jij, L)[2].astype(np.int64)
+
+def hamiltonian(L, h_x=1.0):
+    """Returns the sparse H = -JZZ - h_x \sum_i \sigma^x_i and the classical
+        ground states of L"""
+    lattice, basis, Jij = instance(L)
+    Energies = tfim_classical.energy_table([Jij], lattice.N)[0]
+    H = (tfim_perturbation.H_0_exact_csr(Energies) - h_x*tfim_perturbation.V_exact_csr(basis, lattice)).tocsr()
+    return H, ground_states(L, Jij)
+
+###############################################################################
+# Matrix element builders
+
+@benchmark('kernels', 'build_Mx', max_N=16)
+def build_Mx(L):
+    lattice, basis, _ = instance(L)
+    return lambda: tfim.build_Mx(lattice, basis)
+
+@benchmark('kernels', 'JZZ_SK_ME', max_N=16, dims=(1,))
+def JZZ_SK_ME(L):
+    N = L[0]
+    basis = tfim.IsingBasis(tfim.Lattice(L, True))
+    Jij = tfim.Jij_instance(N, 1.0, 'bimodal', 0, False)
+    return lambda: tfim.JZZ_SK_ME(basis, Jij)
+
+@benchmark('kernels', 'z_correlations_NN_ME', max_N=16)
+def z_correlations_NN_ME(L):
+    lattice, basis, _ = instance(L)
+    J = np.random.RandomState(0).choice([-1., 1.], size=L)
+    return lambda: tfim.z_correlations_NN_ME(lattice, basis, J)
+
+@benchmark('kernels', 'energy_table', max_N=24)
+def energy_table(L):
+    lattice, _, Jij = instance(L)
+    return lambda: tfim_classical.energy_table([Jij], lattice.N)
+
+###############################################################################
+# Perturbative blocks
+
+@benchmark('kernels', 'PVQ_1', max_N=24)
+def PVQ_1(L):
+    lattice, basis, Jij = instance(L)
+    N = lattice.N
+    GS_indices = ground_states(L, Jij)
+    ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    return lambda: tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+
+###############################################################################
+# Schmidt decomposition
+
+@benchmark('kernels', 'rdm_svd', max_N=16)
+def rdm_svd(L):
+    lattice, basis, _ = instance(L)
+    N = lattice.N
+    v = np.random.RandomState(0).randn(basis.M)
+    v /= np.linalg.norm(v)
+    A, B = list(range(N//2)), list(range(N//2, N))
+    return lambda: tfim_rdm.svd(basis, A, B, v)
+
+###############################################################################
+# eigsh configurations for the lowest states of H
+
+@benchmark('kernels', 'eigsh_k1', max_N=20)
+def eigsh_k1(L):
+    H, _ = hamiltonian(L)
+    return lambda: spla.eigsh(H, k=1, which='SA')
+
+@benchmark('kernels', 'eigsh_k1_v0', max_N=20)
+def eigsh_k1_v0(L):
+    # started from the classical ground states, as in tfim_lanczos
+    H, GS_indices = hamiltonian(L)
+    v0 = np.zeros(H.shape[0])
+    v0[GS_indices] = 1.
+    return lambda: spla.eigsh(H, k=1, which='SA', v0=v0)
+
+@benchmark('kernels', 'eigsh_k2_v0', max_N=20)
+def eigsh_k2_v0(L):
+    H, GS_indices = hamiltonian(L)
+    v0 = np.zeros(H.shape[0])
+    v0[GS_indices] = 1.
+    return lambda: spla.eigsh(H, k=2, which='SA', v0=v0, maxiter=400)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+""""pipelines.py
+    --End to end benchmark of the disorder average pipelines
+        tfim_lanczos.lanczos (energies, V, eigsh sweep with S_SG and EE, chi) and
+        tfim_lanczos.chi_ii on fixed seeds
+    --every seed runs in a spawned worker with tfim_profile on, which times
+        the stages of the pipeline; the eigsh matvecs, iterations and
+        failures come from the tfim_solver telemetry and the peak RSS is
+        that of the workers
+    --tables: sizes (N at one worker), hgrid (h grid length), strong (fixed
+        seeds over workers) and weak (seeds proportional to workers)
+    --check runs the cases of the stored reference and compares the
+        results to tolerance, so a faster pipeline cannot change the physics
+    --Run from the repository root: python -m benchmarks.pipelines --help
+    --Requires: tfim_lanczos.py, tfim_parallel.py, tfim_profile.py,
+        tfim_solver.py, numpy
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import tfim_lanczos
+import tfim_parallel
+import tfim_profile
+import tfim_solver
+from benchmarks import harness
+
+# Stored reference results of the check table
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference', 'pipelines.json')
+
+# Names of the returned arrays, in the order of the returned tuple (N and
+# h_x_range first)
+OUTPUTS = {'lanczos': ('E_0', 'E_1', 'd2E_0', 'chi', 'S_SG', 'EE'),
+           'chi_ii': ('chi_ii',)}
+
+# Profiled stages of each pipeline, in order
+STAGES = {'lanczos': ('energies', 'ground_states', 'operators', 'solve', 'observables', 'susceptibility'),
+          'chi_ii': ('energies', 'ground_states', 'operators', 'susceptibility')}
+
+###############################################################################
+# Instrumentation of one run
+
+class _Run:
+    # Picklable run of one seed of a pipeline, returning its record
+    def __init__(self, pipeline, L, h_x_range, PBC=True, h_z=0.001, maxiter=400):
+        self.pipeline = pipeline
+        self.L = L
+        self.h_x_range = np.asarray(h_x_range)
+        self.PBC = PBC
+        self.h_z = h_z
+        self.maxiter = maxiter
+
+    def __call__(self, seed):
+        function = getattr(tfim_lanczos, self.pipeline)
+        tfim_profile.PROFILER.enable()
+        start = time.perf_counter()
+        # the pipelines print their time per seed
+        with tfim_profile.PROFILER.capture() as profile, tfim_solver.TELEMETRY.capture() as solver, \
+                open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = function(self.L, seed, self.h_x_range, self.PBC, self.h_z, self.maxiter)
+        elapsed = time.perf_counter() - start
+        stages = {stage: profile['stages'].get(stage, {'time': 0.})['time'] for stage in STAGES[self.pipeline]}
+        solves = tfim_solver.TELEMETRY.summary(solver)
+        outputs = {name: np.asarray(value).tolist() for name, value in zip(OUTPUTS[self.pipeline], result[2:])}
+        return {'seed': seed, 'pid': os.getpid(), 'time': elapsed, 'stages': stages, 'matvecs': solves['matvecs'],
+                'solves': solves['calls'], 'solve_time': sum(record['time'] for record in solver),
+                'iterations': solves['iterations'], 'failures': solves['failures'],
+                'peak_rss': tfim_profile.peak_rss() or None, 'outputs': outputs}
+
+def _ready(_):
+    return os.getpid()
+
+###############################################################################
+# Cases and tables
+
+def parse_L(text):
+    """Returns the lattice L = [L_0, L_1] from 'L_0xL_1'"""
+    return [int(side) for side in text.lower().split('x')]
+
+def h_grid(points):
+    return np.linspace(0.5, 3.0, points)
+
+def run_case(pipeline, L, seeds, h_x_range, workers=1, threads=None, PBC=True, h_z=0.001, maxiter=400):
+    """Runs pipeline on seeds with workers spawned processes and returns
+        the wall time, the summed stage times, matvecs and solves, the
+        largest worker RSS and the record of every seed"""
+    N = L[0]*L[1]
+    workers, threads = tfim_parallel.resolve(N, len(seeds), workers, threads)
+    run = _Run(pipeline, L, h_x_range, PBC, h_z, maxiter)
+    with tfim_parallel.pool(workers, threads) as p:
+        # the clock starts once the workers have imported the modules
+        p.map(_ready, range(workers), chunksize=1)
+        start = time.perf_counter()
+        records = p.map(run, seeds, chunksize=1)
+        wall = time.perf_counter() - start
+    stages = {stage: sum(record['stages'][stage] for record in records) for stage in STAGES[pipeline]}
+    rss = [record['peak_rss'] for record in records if record['peak_rss'] is not None]
+    return {'pipeline': pipeline, 'L': list(L), 'N': N, 'n_h': len(h_x_range), 'seeds': list(seeds),
+            'workers': workers, 'threads': threads, 'wall': wall, 'stages': stages,
+            'matvecs': sum(record['matvecs'] for record in records),
+            'solves': sum(record['solves'] for record in records),
+            'solve_time': sum(record['solve_time'] for record in records),
+            'failures': sum(record['failures'] for record in records),
+            'peak_rss': max(rss) if rss else None, 'records': records}
+
+def sizes_table(pipeline, sizes, seeds, points, log=None):
+    """Cases over the lattice sizes at one worker"""
+    return _table('sizes', [(pipeline, L, seeds, h_grid(points), 1) for L in sizes], log)
+
+def hgrid_table(pipeline, L, seeds, point_list, log=None):
+    """Cases over the h grid lengths at one worker"""
+    return _table('hgrid', [(pipeline, L, seeds, h_grid(points), 1) for points in point_list], log)
+
+def strong_table(pipeline, L, seeds, points, worker_list, log=None):
+    """Cases over the workers with the seeds fixed"""
+    return _table('strong', [(pipeline, L, seeds, h_grid(points), workers) for workers in worker_list], log)
+
+def weak_table(pipeline, L, seeds_per_worker, points, worker_list, log=None):
+    """Cases over the workers with seeds_per_worker seeds for each"""
+    return _table('weak', [(pipeline, L, list(range(1, seeds_per_worker*workers + 1)), h_grid(points), workers)
+                           for workers in worker_list], log)
+
+def _table(table, cases, log):
+    results = []
+    for pipeline, L, seeds, h_x_range, workers in cases:
+        result = run_case(pipeline, L, seeds, h_x_range, workers)
+        result['table'] = table
+        results.append(result)
+        if log is not None:
+            log(format_row(result))
+    # speedup and efficiency against the first (fewest workers) case
+    if table in ('strong', 'weak') and results:
+        base = results[0]
+        for result in results:
+            speedup = base['wall']/result['wall']
+            if table == 'weak':
+                speedup *= len(result['seeds'])/len(base['seeds'])
+            result['speedup'] = speedup
+            result['efficiency'] = speedup*base['workers']/result['workers']
+    return results
+
+###############################################################################
+# Report
+
+def _round(x, digits=3):
+    # Significant digits, so reports of equal runs diff equal
+    return float('{:.{}g}'.format(x, digits))
+
+def format_row(result):
+    stages = ' '.join('{}={:.3g}'.format(stage, t) for stage, t in result['stages'].items())
+    rss = '-' if result['peak_rss'] is None else '{:.0f}MiB'.format(result['peak_rss']/2**20)
+    return '{:<7} {:<8} L={:<7} n_h={:<3} seeds={:<3} workers={:<2} wall={:<8.3g} matvecs={:<7} rss={:<7} {}'.format(
+        result['table'], result['pipeline'], 'x'.join(map(str, result['L'])), result['n_h'], len(result['seeds']),
+        result['workers'], result['wall'], result['matvecs'], rss, stages)
+
+def report(results):
+    """Returns the compact report: one line per case, times to three
+        significant digits, and the counts (matvecs, solves) exact"""
+    lines = []
+    for result in results:
+        line = format_row(result)
+        if 'speedup' in result:
+            line += ' speedup={:.3g} efficiency={:.3g}'.format(result['speedup'], result['efficiency'])
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+def summary(results):
+    """Returns the results without the per seed outputs, rounded for JSON"""
+    summarized = []
+    for result in results:
+        result = {k: v for k, v in result.items() if k != 'records'}
+        result['stages'] = {stage: _round(t) for stage, t in result['stages'].items()}
+        for k in ('wall', 'solve_time', 'speedup', 'efficiency'):
+            if k in result:
+                result[k] = _round(result[k])
+        summarized.append(result)
+    return summarized
+
+###############################################################################
+# Reference
+
+# Cases of the reference check: small enough to run in seconds
+CHECK_CASES = [{'pipeline': pipeline, 'L': L, 'seeds': [1, 2], 'h_x_range': h_grid(4).tolist(),
+                'PBC': True, 'h_z': 0.001, 'maxiter': 400}
+               for pipeline in ('lanczos', 'chi_ii') for L in ([2, 3], [3, 3])]
+
+def run_check_cases(cases=CHECK_CASES):
+    """Runs the reference cases at one worker and returns them with the
+        outputs of every seed"""
+    checked = []
+    for case in cases:
+        result = run_case(case['pipeline'], case['L'], case['seeds'], np.array(case['h_x_range']), 1, 1,
+                          case['PBC'], case['h_z'], case['maxiter'])
+        checked.append(dict(case, outputs={str(record['seed']): record['outputs'] for record in result['records']}))
+    return checked
+
+def write_reference(cases, filename=REFERENCE):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump({'metadata': harness.metadata(), 'cases': cases}, f, indent=1)
+
+def load_reference(filename=REFERENCE):
+    with open(filename) as f:
+        return json.load(f)['cases']
+
+def check(cases, reference, rtol=1e-4, atol=1e-6):
+    """Returns (pipeline, L, seed, output, largest difference) for every
+        output differing from the reference beyond the tolerances"""
+    failures = []
+    for case, base in zip(cases, reference):
+        for seed, outputs in base['outputs'].items():
+            for name, expected in outputs.items():
+                found = np.array(case['outputs'][seed][name])
+                expected = np.array(expected)
+                if found.shape != expected.shape or not np.allclose(found, expected, rtol=rtol, atol=atol):
+                    difference = np.max(np.abs(found - expected)) if found.shape == expected.shape else np.inf
+                    failures.append((case['pipeline'], case['L'], seed, name, difference))
+    return failures
+
+###############################################################################
+def main():
+
+    # Parse command line arguements
+    ###################################
+    parser = argparse.ArgumentParser(description="Scaling of the lanczos and chi_ii disorder average pipelines")
+    parser.add_argument('--tables', nargs='+', default=['check', 'sizes', 'hgrid', 'strong', 'weak'],
+                        choices=['check', 'sizes', 'hgrid', 'strong', 'weak'], help='Tables to produce')
+    parser.add_argument('--pipelines', nargs='+', default=['lanczos', 'chi_ii'], choices=sorted(OUTPUTS),
+                        help='Pipelines to benchmark')
+    parser.add_argument('--sizes', nargs='+', default=['2x2', '2x3', '3x3', '3x4'], help='Lattices L_0xL_1')
+    parser.add_argument('--seeds', type=int, default=2, help='Seeds 1..seeds of the sizes, hgrid and strong tables')
+    parser.add_argument('--points', type=int, default=4, help='h grid length of the sizes and scaling tables')
+    parser.add_argument('--hgrid', type=int, nargs='+', default=[3, 6, 12], help='h grid lengths of the hgrid table')
+    parser.add_argument('--scaling-size', default='3x3', help='Lattice of the hgrid, strong and weak tables')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Workers of the scaling tables')
+    parser.add_argument('--seeds-per-worker', type=int, default=1, help='Seeds per worker of the weak table')
+    parser.add_argument('-o', default=None, help='JSON results filename')
+    parser.add_argument('--report', default=None, help='Text report filename')
+    parser.add_argument('--reference', default=REFERENCE, help='Reference results of the check table')
+    parser.add_argument('--write-reference', action='store_true', help='Store the check results as the reference')
+    parser.add_argument('--rtol', type=float, default=1e-4, help='Relative tolerance of the check')
+    parser.add_argument('--atol', type=float, default=1e-6, help='Absolute tolerance of the check')
+    args = parser.parse_args()
+    ###################################
+
+    status = 0
+    if 'check' in args.tables:
+        cases = run_check_cases()
+        if args.write_reference:
+            write_reference(cases, args.reference)
+            print('reference written to', args.reference)
+        else:
+            failures = check(cases, load_reference(args.reference), args.rtol, args.atol)
+            for pipeline, L, seed, name, difference in failures:
+                print('MISMATCH {} L={} seed={} {}: max difference {:.3g}'.format(pipeline, L, seed, name, difference))
+            print('check: {} mismatches'.format(len(failures)))
+            status = 1 if failures else 0
+
+    sizes = [parse_L(L) for L in args.sizes]
+    L = parse_L(args.scaling_size)
+    seeds = list(range(1, args.seeds + 1))
+    # progress to stderr, the report to stdout
+    def log(line):
+        print(line, file=sys.stderr)
+    results = []
+    for pipeline in args.pipelines:
+        if 'sizes' in args.tables:
+            results += sizes_table(pipeline, sizes, seeds, args.points, log)
+        if 'hgrid' in args.tables:
+            results += hgrid_table(pipeline, L, seeds, args.hgrid, log)
+        if 'strong' in args.tables:
+            results += strong_table(pipeline, L, seeds, args.points, args.workers, log)
+        if 'weak' in args.tables:
+            results += weak_table(pipeline, L, args.seeds_per_worker, args.points, args.workers, log)
+
+    if results:
+        print(report(results), end='')
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            f.write(report(results))
+    if args.o is not None:
+        with open(args.o, 'w') as f:
+            json.dump({'metadata': harness.metadata(), 'results': summary(results)}, f, indent=1)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,14 @@
-from multiprocessing import Pool
+from tfim_campaign import Campaign
 import time
 import numpy as np
-import random
-from tfim_lanczos import chi_ii
+from tfim_lanczos import chi_ii, lanczos_cost
 import os
+import argparse
+import tfim_parallel
+import tfim_profile
 
 num_iter = 100
-seed_range = [random.randrange(1, 1e3, 1) for i in range(num_iter)]
+seed_range = range(1, num_iter + 1)
 # h_x_range = np.array([10.])
 h_x_range = np.concatenate((np.linspace(0.1, 4., 50), np.linspace(4.5, 10, 5)))
 PBC = True
@@ -19,9 +21,22 @@ def chi_ii_single_var(seed):
     return chi_ii(L, seed, h_x_range, PBC, h_z, maxiter)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Disorder averaged local susceptibilities')
+    tfim_parallel.add_arguments(parser)
+    tfim_profile.add_arguments(parser)
+    args = parser.parse_args()
+    # stages of every seed to the campaign directory/profile.json
+    tfim_profile.from_arguments(args)
     init = time.time()
-    p = Pool()
-    result_all = p.map(chi_ii_single_var, seed_range, chunksize=10)
+    # each seed is saved as it completes, so an interrupted campaign resumes with the remaining seeds
+    output = "chi_ii_prob"
+    campaign = Campaign(os.path.join(output, 'seeds_{size}'.format(size=L)), seed_range)
+    # hardest seeds (largest ground state degeneracy) first, one seed per dispatch
+    # processes x BLAS threads from the system size, unless overridden by --workers/--threads
+    workers, threads = tfim_parallel.resolve(N, len(campaign.pending()), args.workers, args.threads)
+    campaign.run(chi_ii_single_var, cost=lanczos_cost(L, campaign.pending(), PBC), processes=workers, threads=threads)
+    campaign.report()
+    result_all = campaign.results()
     print('multiprocessing_time: ', time.time() - init)
     chi_ii_arr = np.zeros((len(h_x_range), N, num_iter))
     for i, seed in enumerate(seed_range):
@@ -35,7 +50,6 @@ if __name__ == '__main__':
     print(len(np.argwhere(chi_ii_arr == 0.)))
     # output files
     # check to see whether the output file already exists
-    output = "chi_ii_prob"
     if os.path.isdir(output):
         os.chdir(output)
     else:
@@ -1,15 +1,16 @@
-import tfim_lanczos
-import random
 import time
 import tfim_perturbation
 import numpy as np
-from scipy import sparse
-from scipy.sparse import linalg as spla
 import os
-from multiprocessing import Pool
+import argparse
+import tfim_parallel
+import tfim_profile
+import tfim_solver
+import tfim_system
+from tfim_campaign import Campaign
 
 num_iter = 100
-seed_list = [random.randrange(1, 1e3, 1) for i in range(num_iter)]
+seed_list = range(1, num_iter + 1)
 init = 0.1
 final = 4.
 num_steps = 50
@@ -20,24 +21,6 @@ maxiter = 400
 
 N = 10
 
-def Ising_energies(Jij):
-
-    Ising_energy_arr = np.zeros(2 ** N)
-    for index in range(2 ** N):
-        state_1 = tfim_lanczos.state(index, N)
-        # modify state from 0 and 1 base to -1, 1 base
-        for i in range(N):
-            if state_1[i] == 0:
-                state_1[i] -= 1
-        Ising_energy = 0
-        for i in range(N):
-            for j in range(i + 1, N, 1):
-                bond_energy = Jij[i, j] * state_1[i] * state_1[j]
-                Ising_energy += bond_energy
-        Ising_energy_arr[index] = Ising_energy
-
-    return Ising_energy_arr
-
 def chi_ii_irregular(N, seed, h_x_range, h_z, maxiter):
 
     if N == 8:
@@ -46,39 +29,38 @@ def chi_ii_irregular(N, seed, h_x_range, h_z, maxiter):
         Jij_func = tfim_perturbation.ten_tile
 
     Jij, N = Jij_func(seed, p=0.5)
+    # energies, ground states and operators of the seed, each built once on first use
+    system = tfim_system.TFIMSystem(Jij, N)
 
-    Ising_energy_arr = Ising_energies(Jij)
-    GS_energy, GS_indices = tfim_perturbation.GS(Ising_energy_arr)
+    with tfim_profile.stage('energies'):
+        # built on first use, inside the stage that times it
+        system.energies
+    with tfim_profile.stage('ground_states'):
+        GS_energy, GS_indices = system.ground_manifold
 
-    # initialize Lanczos vector
-    v0 = np.zeros(2 ** N)
-    for i in GS_indices:
-        v0[i] = 1
+        # initialize Lanczos vector
+        v0 = system.v0
 
     # Calculate exact eigenvalues and eigenstates for range(h_x)
-    V_exc_csr = tfim_lanczos.V_exact_csr(N)
-    H_0_exc_csr = tfim_lanczos.H_0_exact_csr(Ising_energy_arr)
+    with tfim_profile.stage('operators'):
+        # built on first use, inside the stage that times them
+        system.V
+        system.H_0
 
     susceptibility_time = time.time()
-    chi_aa_matrix = np.zeros((len(h_x_range), N))
-    for i, h_x in enumerate(h_x_range):
-        for a in range(N):
-            sigma_z = np.zeros(2 ** N)
-            for ket in range(2 ** N):
-                state_1 = tfim_lanczos.state(ket, N)
-                if state_1[a] == 1:
-                    sigma_z[ket] += 1
-                else:
-                    sigma_z[ket] -= 1
-            exc_eigenvalue = spla.eigsh(H_0_exc_csr - V_exc_csr.multiply(h_x), k=1, which='SA', v0=v0,
-                           maxiter=maxiter,
-                           return_eigenvectors=False)[0]
-            longitudinal_energy = \
-                spla.eigsh(H_0_exc_csr - V_exc_csr.multiply(h_x) - h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0,
-                           maxiter=maxiter,
-                           return_eigenvectors=False)[0]
-            chi_aa = 2. * (exc_eigenvalue - longitudinal_energy) / (h_z ** 2)
-            chi_aa_matrix[i, a] += chi_aa
+    with tfim_profile.stage('susceptibility'):
+        chi_aa_matrix = np.zeros((len(h_x_range), N))
+        for i, h_x in enumerate(h_x_range):
+            for a in range(N):
+                exc_eigenvalue = tfim_solver.eigsh(system.hamiltonian(h_x), k=1, which='SA', v0=v0,
+                               maxiter=maxiter,
+                               return_eigenvectors=False, stage='chi_ii_0', h_x=h_x, a=a)[0]
+                longitudinal_energy = \
+                    tfim_solver.eigsh(system.hamiltonian(h_x) - h_z * system.longitudinal(a), k=1, which='SA', v0=v0,
+                               maxiter=maxiter,
+                               return_eigenvectors=False, stage='chi_ii', h_x=h_x, a=a)[0]
+                chi_aa = 2. * (exc_eigenvalue - longitudinal_energy) / (h_z ** 2)
+                chi_aa_matrix[i, a] += chi_aa
 
     print("----{num_sec}s seconds ---- used for susceptibility for seed {seed}".format(
         num_sec=time.time() - susceptibility_time, seed=seed))
@@ -88,9 +70,20 @@ def chi_ii_irregular_single_var(seed):
     return chi_ii_irregular(N, seed, h_x_range, h_z, maxiter)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Disorder averaged local susceptibilities on irregular tiles')
+    tfim_parallel.add_arguments(parser)
+    tfim_profile.add_arguments(parser)
+    args = parser.parse_args()
+    # stages of every seed to the campaign directory/profile.json
+    tfim_profile.from_arguments(args)
     init = time.time()
-    p = Pool()
-    result_all = p.map(chi_ii_irregular_single_var, seed_list, chunksize=10)
+    # each seed is saved as it completes, so an interrupted campaign resumes with the remaining seeds
+    output = "chi_ii_prob"
+    campaign = Campaign(os.path.join(output, 'seeds_irregular_{size}'.format(size=N)), seed_list)
+    # processes x BLAS threads from the system size, unless overridden by --workers/--threads
+    workers, threads = tfim_parallel.resolve(N, len(campaign.pending()), args.workers, args.threads)
+    campaign.run(chi_ii_irregular_single_var, processes=workers, threads=threads)
+    result_all = campaign.results()
     print('multiprocessing_time: ', time.time() - init)
     chi_ii_arr = np.zeros((len(h_x_range), N, num_iter))
     for i, seed in enumerate(seed_list):
@@ -104,7 +97,6 @@ if __name__ == '__main__':
     print(len(np.argwhere(chi_ii_arr == 0.)))
     # output files
     # check to see whether the output file already exists
-    output = "chi_ii_prob"
     if os.path.isdir(output):
         os.chdir(output)
     else:
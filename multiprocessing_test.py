@@ -1,12 +1,14 @@
-from multiprocessing import Pool
+from tfim_campaign import Campaign
 import time
 import numpy as np
-import random
-from tfim_lanczos import lanczos
+from tfim_lanczos import lanczos, lanczos_cost
 import os
+import argparse
+import tfim_parallel
+import tfim_profile
 
 num_iter = 100
-seed_range = [random.randrange(1, 1e3, 1) for i in range(num_iter)]
+seed_range = range(1, num_iter + 1)
 h_x_range = np.concatenate((np.linspace(0.1, 4., 50), np.linspace(4.5, 10, 5)))
 PBC = True
 h_z = 0.001
@@ -17,48 +19,24 @@ def lanczos_single_var(seed):
     return lanczos(L, seed, h_x_range, PBC, h_z, maxiter)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Disorder averaged Lanczos campaign')
+    tfim_parallel.add_arguments(parser)
+    tfim_profile.add_arguments(parser)
+    args = parser.parse_args()
+    # stages of every seed to the campaign directory/profile.json
+    tfim_profile.from_arguments(args)
     init = time.time()
-    p = Pool()
 
-    exc_eigenvalues_all = np.zeros((len(seed_range), len(h_x_range)))
-    first_excited__exc_energies_all = np.zeros((len(seed_range), len(h_x_range)))
-    second_derivative_exc_eigenvalues_all = np.zeros((len(seed_range), len(h_x_range)))
-    chi_arr_all = np.zeros((len(seed_range), len(h_x_range)))
-    S_SG_arr_all = np.zeros((len(seed_range), len(h_x_range)))
-    EE_arr_all = np.zeros((len(seed_range), len(h_x_range)))
-
-    result_all = p.map(lanczos_single_var, seed_range, chunksize=10)
+    # each seed is saved as it completes, so an interrupted campaign resumes with the remaining seeds
+    output = "multiprocessing_test_output"
+    campaign = Campaign(os.path.join(output, 'seeds_{size}'.format(size=L)), seed_range)
+    # hardest seeds (largest ground state degeneracy) first, one seed per dispatch
+    # processes x BLAS threads from the system size, unless overridden by --workers/--threads
+    workers, threads = tfim_parallel.resolve(L[0] * L[1], len(campaign.pending()), args.workers, args.threads)
+    campaign.run(lanczos_single_var, cost=lanczos_cost(L, campaign.pending(), PBC), processes=workers, threads=threads)
+    campaign.report()
     print('multiprocessing_time: ', time.time() - init)
 
     # N, h_x_range, exc_eigenvalues, first_excited__exc_energies, second_derivative_exc_eigenvalues, chi_arr, S_SG_arr, entropy_arr
-
-    for i, seed in enumerate(seed_range):
-        N, h_x_range, exc_eigenvalues, first_excited__exc_energies, second_derivative_exc_eigenvalues, chi_arr, S_SG_arr, entropy_arr = result_all[i]
-        exc_eigenvalues_all[i] = exc_eigenvalues
-        first_excited__exc_energies_all[i] = first_excited__exc_energies
-        second_derivative_exc_eigenvalues_all[i] = second_derivative_exc_eigenvalues
-        chi_arr_all[i] = chi_arr
-        S_SG_arr_all[i] = S_SG_arr
-        EE_arr_all[i] = entropy_arr
-
-    # output files
-    # check to see whether the output file already exists
-    output = "multiprocessing_test_output"
-    if os.path.isdir(output):
-        os.chdir(output)
-    else:
-        os.mkdir(output)
-        os.chdir(output)
-
-    if os.path.exists('data_all_{size}.npy'.format(size=L)):
-        os.remove('data_all_{size}.npy'.format(size=L))
-
-    with open('data_all_{size}.npy'.format(size=L), 'wb') as f:
-        # save comprehensive data
-        np.save(f, exc_eigenvalues_all)
-        np.save(f, first_excited__exc_energies_all)
-        np.save(f, chi_arr_all)
-        np.save(f, S_SG_arr_all)
-        np.save(f, EE_arr_all)
-
-    os.chdir('../')
+    # save comprehensive data: exc_eigenvalues, first_excited__exc_energies, chi_arr, S_SG_arr, entropy_arr
+    campaign.write(os.path.join(output, 'data_all_{size}.npy'.format(size=L)), [2, 3, 5, 6, 7])
@@ -0,0 +1,23 @@
+import numpy as np
+import tfim_lanczos
+from tfim_campaign import Campaign
+
+def unreachable(seed):
+    raise AssertionError('seed {} was already completed'.format(seed))
+
+def test_lanczos_cost_no_seeds():
+    assert tfim_lanczos.lanczos_cost([3, 3], [], True) == {}
+
+def test_resume_completed_campaign(tmp_path):
+    # a campaign that stopped after its last seed only rebuilds the merged output
+    campaign = Campaign(str(tmp_path / 'seeds'), [1, 2])
+    for seed in campaign.seeds:
+        campaign.save(seed, (seed, np.full(3, seed)))
+    assert campaign.pending() == []
+    cost = tfim_lanczos.lanczos_cost([3, 3], campaign.pending(), True)
+    assert campaign.run(unreachable, cost=cost, processes=1) == 0
+    campaign.report()
+    filename = str(tmp_path / 'data_all.npy')
+    campaign.write(filename, [1])
+    with open(filename, 'rb') as f:
+        assert np.array_equal(np.load(f), [[1, 1, 1], [2, 2, 2]])
@@ -0,0 +1,26 @@
+import numpy as np
+from scipy.linalg import eigh
+import tfim
+import tfim_perturbation
+
+def test_exc_GS_eigensystem_dense():
+    # degenerate 3x4 instance (g = 70) on which lobpcg stalls or misses a
+    # state crossing in from above without the checks
+    lattice = tfim.Lattice([3, 4], True)
+    basis = tfim.IsingBasis(lattice)
+    # couplings in the shifted format of tfim.JZZ_SK_ME
+    Jij = tfim_perturbation.Jij_2D_NN(5, lattice.N, True, 3, 4, lattice)[0]
+    Energies = -tfim.JZZ_SK_ME(basis, Jij)
+    GS_energy, GS_indices = tfim_perturbation.GS(Energies)
+    g = len(GS_indices)
+    h_x_range = np.linspace(0, 1.2, 7)
+
+    exc_eigenvalues, exc_GS_eigenstates = tfim_perturbation.exc_GS_eigensystem(basis, h_x_range, lattice, Energies,
+                                                                                GS_indices)
+    V = tfim_perturbation.V_exact_csr(basis, lattice).toarray()
+    for j, h_x in enumerate(h_x_range):
+        E, v = eigh(np.diag(Energies) - h_x*V, subset_by_index=[0, g - 1])
+        assert np.allclose(exc_eigenvalues[:, j], E[:g], atol=1e-8)
+        # the ground manifold components agree up to rotations within degenerate levels
+        P = v[GS_indices, :g]
+        assert np.allclose(exc_GS_eigenstates[j] @ exc_GS_eigenstates[j].T, P @ P.T, atol=1e-6)
@@ -359,11 +359,11 @@ def entropy_plot(GS_indices, h_x_range, perturb_entropy_arr, seed, num_component
 
 def energy_denominator_check(basis, Jij, GS_indices, GS_energy, N):
 
-    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
+    # EG_11 denotes the diagonal of 1/(E_0-QH_0Q) on Q1
     ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
-    EGM_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 1)
+    EG_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1)
 
-    test = np.argwhere(EGM_11 == np.inf).T[0]
+    test = np.flatnonzero(EG_11 == np.inf)
 
     return len(test)
 
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+""""tfim_campaign.py
+    --Resumable disorder-average campaigns over Jij seeds: the result of
+        every seed is written atomically to its own file as soon as it
+        completes, so an interrupted campaign restarts with the pending
+        seeds only
+    --results are tuples of arrays and scalars, as returned by
+        tfim_lanczos.lanczos; they are merged at the end into consecutive
+        np.save arrays stacked over the seeds
+    --seeds can be dispatched longest first from a cost estimate, one at
+        a time, and the busy time of every worker is recorded
+    --with tfim_profile on, the stages of every seed are collected from
+        the workers and written to directory/profile.json
+    --the eigsh telemetry of every seed (tfim_solver) is written next to
+        its result as directory/seed_{seed}_solver.dat
+    --Requires: tfim_parallel.py, tfim_profile.py, tfim_solver.py, numpy
+"""
+
+import tfim_parallel
+import tfim_profile
+import tfim_solver
+import numpy as np
+import os
+import time
+
+###############################################################################
+def campaign_seeds(seeds, count=None):
+    """Returns distinct integer seeds from a range or list, or count seeds
+        drawn from a np.random.SeedSequence, valid for np.random.seed"""
+    if isinstance(seeds, np.random.SeedSequence):
+        drawn = []
+        while len(drawn) < count:
+            for child in seeds.spawn(count - len(drawn)):
+                seed = int(child.generate_state(1, dtype=np.uint32)[0])
+                if seed not in drawn:
+                    drawn.append(seed)
+        return drawn
+    seeds = [int(seed) for seed in seeds]
+    if len(set(seeds)) != len(seeds):
+        raise ValueError('campaign seeds must be distinct')
+    return seeds
+
+class _Seeded:
+    # Picklable wrapper returning the seed, the result, the worker, its busy
+    # time, the profile of the seed (empty with profiling off) and its eigsh
+    # telemetry
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, seed):
+        start = time.time()
+        with tfim_profile.PROFILER.capture() as profile, tfim_solver.TELEMETRY.capture() as solver:
+            result = self.function(seed)
+        return seed, result, os.getpid(), time.time() - start, profile, solver
+
+class Campaign:
+    """A set of seeds whose results are stored as directory/seed_{seed}.npz
+
+        --run(function) evaluates function(seed) for the pending seeds on a
+            process pool and saves each result as it arrives
+        --results() loads every result in seed order and write() merges
+            them into one np.save file"""
+
+    def __init__(self, directory, seeds, count=None):
+        self.directory = directory
+        self.seeds = campaign_seeds(seeds, count)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, seed):
+        return os.path.join(self.directory, 'seed_{}.npz'.format(seed))
+
+    def completed(self):
+        return [seed for seed in self.seeds if os.path.exists(self.path(seed))]
+
+    def pending(self):
+        return [seed for seed in self.seeds if not os.path.exists(self.path(seed))]
+
+    def solver_path(self, seed):
+        return os.path.join(self.directory, 'seed_{}_solver.dat'.format(seed))
+
+    def save(self, seed, result, solver=None):
+        """Writes the result of seed through a temporary file, so a file
+            seed_{seed}.npz is always complete; the eigsh records of the
+            seed are written before it"""
+        if solver:
+            tfim_solver.TELEMETRY.write(self.solver_path(seed), solver, header='seed = {}'.format(seed))
+        if not isinstance(result, tuple):
+            result = (result,)
+        temporary = self.path(seed) + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, *result)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path(seed))
+
+    def load(self, seed):
+        with np.load(self.path(seed)) as data:
+            return tuple(data['arr_{}'.format(i)] for i in range(len(data.files)))
+
+    def run(self, function, processes=None, cost=None, threads=None):
+        """Evaluates function(seed) for every pending seed and returns the
+            number of seeds computed; processes=1 runs in this process
+
+            --each worker is limited to threads BLAS/OpenMP threads (see
+                tfim_parallel.resolve), by default cores // processes; with
+                processes=1 this needs threadpoolctl
+
+            --cost maps each seed to an estimated cost, e.g.
+                tfim_lanczos.lanczos_cost; seeds are then dispatched longest
+                first so that the last seeds to finish are short ones
+            --busy times per worker and the wall time are kept in
+                self.busy and self.wall for utilization()"""
+        pending = self.pending()
+        if cost is not None:
+            pending.sort(key=lambda seed: cost[seed], reverse=True)
+        self.busy = {}
+        self.processes = 1 if processes == 1 else (processes or os.cpu_count())
+        if threads is None:
+            threads = max(1, (os.cpu_count() or 1)//self.processes)
+        profiles = {}
+        start = time.time()
+        if processes == 1:
+            with tfim_parallel.thread_limits(threads):
+                for seed in pending:
+                    seed, result, worker, elapsed, profiles[seed], solver = _Seeded(function)(seed)
+                    self.save(seed, result, solver)
+                    self.busy[worker] = self.busy.get(worker, 0.) + elapsed
+        else:
+            with tfim_parallel.pool(self.processes, threads) as p:
+                for seed, result, worker, elapsed, profiles[seed], solver in p.imap_unordered(
+                        _Seeded(function), pending, chunksize=1):
+                    self.save(seed, result, solver)
+                    self.busy[worker] = self.busy.get(worker, 0.) + elapsed
+        self.wall = time.time() - start
+        if tfim_profile.enabled():
+            self.write_profile(profiles)
+        return len(pending)
+
+    def write_profile(self, profiles):
+        """Writes the stages of the seeds of the last run, summed and per
+            seed, to directory/profile.json"""
+        total = tfim_profile.Profiler()
+        for seed, profile in profiles.items():
+            for call in profile['calls']:
+                call['seed'] = seed
+            total.merge(profile)
+        return total.write(os.path.join(self.directory, 'profile.json'),
+                           {'directory': self.directory, 'processes': self.processes, 'wall': self.wall},
+                           seeds={str(seed): profile['stages'] for seed, profile in profiles.items()})
+
+    def utilization(self):
+        """Returns the fraction of the last run's wall time each worker was
+            busy, and the ratio of total work / processes to the wall time"""
+        if self.wall <= 0:
+            return {}, 1.
+        fractions = {worker: busy/self.wall for worker, busy in self.busy.items()}
+        return fractions, sum(self.busy.values())/self.processes/self.wall
+
+    def report(self):
+        fractions, efficiency = self.utilization()
+        for worker, fraction in sorted(fractions.items()):
+            print('worker {}: {:.1%} busy'.format(worker, fraction))
+        print('wall time {:.1f}s, total work / {} processes at {:.1%} of it'.format(self.wall, self.processes,
+                                                                                  efficiency))
+
+    def results(self):
+        """Returns the results of every seed in seed order"""
+        missing = self.pending()
+        if missing:
+            raise RuntimeError('{} seeds are not completed, e.g. seed {}'.format(len(missing), missing[0]))
+        return [self.load(seed) for seed in self.seeds]
+
+    def stack(self, position):
+        """Returns entry position of every result stacked over the seeds"""
+        return np.array([result[position] for result in self.results()])
+
+    def write(self, filename, positions):
+        """Saves the stacked entries at positions with consecutive np.save
+            calls to filename, replacing it atomically"""
+        results = self.results()
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as f:
+            for position in positions:
+                np.save(f, np.array([result[position] for result in results]))
+        os.replace(temporary, filename)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+""""tfim_classical.py
+    --Classical ground manifolds of Ising couplings without building one
+        2^N energy array per instance in Python: batched scans, branch and
+        bound, and a column transfer matrix for 2D strips
+    --energies of all states use the convention of -tfim.JZZ_SK_ME,
+        E = -\sum_{i<j} J_ij s_i s_j with s = basis.spin_state(index)
+    --Requires: tfim_matrices.py, numpy
+"""
+
+import tfim_matrices
+import numpy as np
+import time
+
+# Memory of the bond products of one chunk of states in ground_states
+CHUNK_BYTES = 2**26
+
+###############################################################################
+def spin_table(N, start, stop):
+    """Returns basis.spin_state(index) for start <= index < stop as rows"""
+    indices = np.arange(start, stop, dtype=np.uint64)
+    bits = (indices[:, np.newaxis] & tfim_matrices.flip_masks(N)[np.newaxis, :]) != 0
+    return 2.*bits - 1.
+
+def bond_weights(Jij_array, N):
+    """Returns the (n_bonds, K) couplings J_ij, i < j, of K instances in the
+        shifted Jij format or as N x N matrices, and the (i, j) bonds they
+        belong to"""
+    bonds = np.triu_indices(N, 1)
+    weights = np.array([full_coupling(Jij, N)[bonds] for Jij in Jij_array]).T
+    return weights, bonds
+
+def energy_table(Jij_array, N, chunk=2**14):
+    """Returns the K x 2^N table of classical energies of K instances, as
+        one GEMM of the bond products s_i s_j against the couplings"""
+    weights, bonds = bond_weights(Jij_array, N)
+    table = np.zeros((len(Jij_array), 2**N))
+    for start in range(0, 2**N, chunk):
+        stop = min(start + chunk, 2**N)
+        S = spin_table(N, start, stop)
+        table[:, start:stop] = -(S[:, bonds[0]]*S[:, bonds[1]] @ weights).T
+    return table
+
+def ground_states(Jij_array, N, chunk=None, tol=1e-9):
+    """Returns the ground energies and ground state indices of K instances
+
+        --states are streamed in chunks so the K x 2^N table is never
+            stored; chunk defaults to the number of states whose bond
+            products and energies fit in CHUNK_BYTES
+        --indices_array is a list of sorted index arrays, as returned by
+            np.nonzero(Energies == GS_energy)[0] for each instance"""
+    K = len(Jij_array)
+    if K == 0:
+        return np.zeros(0), []
+    weights, bonds = bond_weights(Jij_array, N)
+    if chunk is None:
+        # two gathers of the bonds, their product and the K energies per state
+        row = 8*(3*len(bonds[0]) + K + N)
+        chunk = int(min(2**N, max(1, CHUNK_BYTES//row)))
+
+    GS_energies = np.full(K, np.inf)
+    found = [[] for _ in range(K)]
+    for start in range(0, 2**N, chunk):
+        stop = min(start + chunk, 2**N)
+        S = spin_table(N, start, stop)
+        energies = -(S[:, bonds[0]]*S[:, bonds[1]] @ weights)
+
+        # restart the instances whose minimum dropped, then keep every state
+        # within tol of the running minimum
+        lowest = energies.min(axis=0)
+        lower = lowest < GS_energies - tol
+        for k in np.flatnonzero(lower):
+            found[k] = []
+        GS_energies = np.minimum(lowest, GS_energies)
+        instances, states = np.nonzero((energies <= GS_energies + tol).T)
+        kept = energies[states, instances]
+        bounds = np.searchsorted(instances, np.arange(K + 1))
+        for k in np.flatnonzero(np.diff(bounds)):
+            found[k].append((states[bounds[k]:bounds[k+1]] + start, kept[bounds[k]:bounds[k+1]]))
+
+    indices_array = []
+    for k in range(K):
+        states = np.concatenate([states for states, _ in found[k]])
+        energies = np.concatenate([energies for _, energies in found[k]])
+        indices_array.append(states[energies <= GS_energies[k] + tol])
+    return GS_energies, indices_array
+
+###############################################################################
+# Exact ground manifold by branch and bound
+
+def full_coupling(Jij, N):
+    """Returns the symmetric N x N couplings of Jij, given either in the
+        shifted Jij format or already as an N x N matrix"""
+    Jij = np.asarray(Jij, dtype=float)
+    if Jij.shape == (N, N):
+        return Jij
+    return tfim_matrices.coupling_matrix(Jij, N)
+
+def assignment_order(J):
+    # Starts from the most strongly coupled site and then always takes the
+    # site most strongly coupled to those already assigned
+    strength = np.abs(J)
+    order = [int(np.argmax(strength.sum(axis=1)))]
+    link = strength[order[0]].copy()
+    link[order[0]] = -np.inf
+    for _ in range(len(J) - 1):
+        site = int(np.argmax(link))
+        order.append(site)
+        link += strength[site]
+        link[order] = -np.inf
+    return np.array(order)
+
+def descent(J, s):
+    # Single spin flip descent to a local minimum, E = -1/2 s^T J s
+    h = J @ s
+    while True:
+        gain = s*h
+        i = int(np.argmin(gain))
+        if gain[i] >= 0:
+            return s, -0.5*s @ h
+        s[i] = -s[i]
+        h += 2.*s[i]*J[:, i]
+
+def branch_and_bound(Jij, N, max_states=None, time_limit=None, tol=1e-9, starts=20, seed=0):
+    """Returns GS_energy, GS_indices and whether the search was complete
+
+        --spins are assigned depth first; a partial assignment with energy
+            E_fixed and local fields h_j on the free spins is pruned once
+            E_fixed - \sum_free |h_j| - \sum_{free bonds} |J_ij|
+            exceeds the best energy found, which is seeded by descent from
+            a few random states
+        --the first spin is fixed to +1 and the spin inversions are added at
+            the end, so the couplings must have no field
+        --max_states caps the number of stored ground states and time_limit
+            (seconds) the search; the result is then flagged incomplete
+        --GS_indices is a sorted uint64 array in the bit order of basis.state"""
+    J = full_coupling(Jij, N)
+    order = assignment_order(J)
+    Jo = J[np.ix_(order, order)]
+    bits = [1 << (N - 1 - int(site)) for site in order]
+
+    # free[m] = \sum |J_ij| over bonds among the spins m, m+1, ... of order
+    free = np.zeros(N + 1)
+    for m in range(N - 1, -1, -1):
+        free[m] = free[m + 1] + np.abs(Jo[m, m+1:]).sum()
+
+    rng = np.random.RandomState(seed)
+    best = min(descent(J, rng.choice([-1., 1.], size=N))[1] for _ in range(max(starts, 1)))
+    found = []
+    complete = True
+    deadline = None if time_limit is None else time.time() + time_limit
+
+    # stack of (depth, energy, fields, index); the first spin is fixed to +1
+    stack = [(1, 0., Jo[0].copy(), bits[0])]
+    while stack:
+        if deadline is not None and time.time() > deadline:
+            complete = False
+            break
+        m, E, h, index = stack.pop()
+        if m == N:
+            if E < best - tol:
+                best, found = E, []
+            if E <= best + tol:
+                if max_states is None or 2*len(found) < max_states:
+                    found.append(index)
+                else:
+                    complete = False
+            continue
+        # try the spin aligned with its field last so it is popped first
+        for s in ((-1., 1.) if h[m] >= 0 else (1., -1.)):
+            E_child = E - s*h[m]
+            h_child = h + s*Jo[m]
+            bound = E_child - np.abs(h_child[m+1:]).sum() - free[m+1]
+            if bound <= best + tol:
+                stack.append((m + 1, E_child, h_child, index | bits[m] if s > 0 else index))
+
+    mask = (1 << N) - 1
+    GS_indices = np.array(sorted(found + [index ^ mask for index in found]), dtype=np.uint64)
+    return best, GS_indices, complete
+
+###############################################################################
+# Exact ground manifold of 2D strips by a column transfer matrix
+
+def column_sites(L):
+    """Returns the sites of each column of an L = [height, width] lattice,
+        site = row*width + column as in tfim.Lattice"""
+    height, width = L
+    return [np.arange(height)*width + column for column in range(width)]
+
+def transfer_matrix(Jij, L, max_states=None, tol=1e-9):
+    """Returns GS_energy, the degeneracy and GS_indices of nearest neighbor
+        couplings on an L = [height, width] lattice
+
+        --columns of 2^height states are added one at a time, keeping the
+            lowest energy ending in each column state and the number of
+            configurations reaching it, in O(width 4^height) per first column
+        --bonds between the first and last columns (PBC) are closed by
+            fixing the first column; bonds between columns further apart
+            raise ValueError
+        --GS_indices holds at most max_states of the degenerate states as a
+            sorted uint64 array in the bit order of basis.state"""
+    height, width = L
+    N = height*width
+    J = full_coupling(Jij, N)
+    columns = column_sites(L)
+    for c1 in range(width):
+        for c2 in range(c1 + 2, width):
+            if np.any(J[np.ix_(columns[c1], columns[c2])]) and not (c1 == 0 and c2 == width - 1):
+                raise ValueError('columns %d and %d are coupled' % (c1, c2))
+    wrap = width > 2 and np.any(J[np.ix_(columns[-1], columns[0])])
+
+    S = spin_table(height, 0, 2**height)
+    intra = [-0.5*np.einsum('si,ij,sj->s', S, J[np.ix_(sites, sites)], S) for sites in columns]
+    bonds = [None] + [-S @ J[np.ix_(columns[c-1], columns[c])] @ S.T for c in range(1, width)]
+    closing = -S @ J[np.ix_(columns[-1], columns[0])] @ S.T if wrap else np.zeros((2**height, 2**height))
+    column_bits = [np.array([sum(1 << (N - 1 - int(site)) for site, spin in zip(sites, row) if spin > 0)
+                             for row in S], dtype=object) for sites in columns]
+
+    # one pass per first column state when the strip is closed, else a
+    # single pass starting from every first column state
+    firsts = [np.array([a]) for a in range(2**height)] if wrap else [np.arange(2**height)]
+    passes = []
+    for first in firsts:
+        energy = np.full(2**height, np.inf)
+        energy[first] = intra[0][first]
+        count = np.zeros(2**height, dtype=np.int64)
+        count[first] = 1
+        history = [energy]
+        for c in range(1, width):
+            total = energy[:, np.newaxis] + bonds[c]
+            lowest = total.min(axis=0)
+            count = ((total <= lowest + tol)*count[:, np.newaxis]).sum(axis=0)
+            energy = lowest + intra[c]
+            history.append(energy)
+        final = energy + (closing[:, first[0]] if wrap else 0.)
+        passes.append((history, final, count))
+
+    GS_energy = min(final.min() for _, final, _ in passes)
+    degeneracy = int(sum(count[final <= GS_energy + tol].sum() for _, final, count in passes))
+
+    # backtrack through the columns from every optimal last column state
+    found = []
+    for history, final, _ in passes:
+        stack = [(width - 1, int(s), column_bits[-1][s]) for s in np.flatnonzero(final <= GS_energy + tol)]
+        while stack and (max_states is None or len(found) < max_states):
+            c, s, index = stack.pop()
+            if c == 0:
+                found.append(index)
+                continue
+            previous = history[c-1] + bonds[c][:, s] + intra[c][s] <= history[c][s] + tol
+            stack.extend((c - 1, int(p), index | column_bits[c-1][p]) for p in np.flatnonzero(previous))
+    return GS_energy, degeneracy, np.array(sorted(found), dtype=np.uint64)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+""""tfim_compare.py
+    --Comparison of perturbative and exact eigensystems over a range of h_x,
+        with every quantity computed over the whole h_x grid at once
+    --eigenvalues are stored as (g, len(h_x_range)) and eigenstates as
+        (len(h_x_range), components, states), as in tfim_perturbation
+    --Requires: numpy, scipy
+"""
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+###############################################################################
+# Degenerate levels
+
+def level_groups(eigenvalues, tol=1e-12):
+    """Returns the positions of each degenerate level of sorted eigenvalues,
+        consecutive values closer than tol sharing a level"""
+    eigenvalues = np.asarray(eigenvalues)
+    return np.split(np.arange(len(eigenvalues)), np.flatnonzero(np.abs(np.diff(eigenvalues)) > tol) + 1)
+
+def level_labels(eigenvalues, tol=1e-12):
+    """Returns the (g, n_h) level number of each of the (g, n_h) eigenvalues,
+        counting the degenerate levels from the bottom at each h_x"""
+    steps = np.abs(np.diff(eigenvalues, axis=0)) > tol
+    return np.concatenate([np.zeros((1,) + steps.shape[1:], dtype=int), np.cumsum(steps, axis=0)])
+
+###############################################################################
+# Ground manifold components and probabilities
+
+def ground_components(GS_indices, exc_eigenstates, normalize=False):
+    """Returns the components on the ground manifold of the lowest
+        len(GS_indices) exact eigenstates, optionally renormalized"""
+    components = np.asarray(exc_eigenstates)[:, GS_indices, :len(GS_indices)]
+    if normalize:
+        components = components/np.linalg.norm(components, axis=1, keepdims=True)
+    return components
+
+def probabilities(eigenstates):
+    """Returns |c|^2 of every component of the normalized eigenstates"""
+    weights = np.abs(eigenstates)**2
+    return weights/weights.sum(axis=-2, keepdims=True)
+
+def ground_probabilities(GS_indices, exc_eigenstates):
+    """Returns the (g, g, n_h) probability of each of the lowest g exact
+        eigenstates to be found in each classical ground state"""
+    g = len(GS_indices)
+    return probabilities(np.asarray(exc_eigenstates)[:, :, :g])[:, GS_indices, :].transpose(2, 1, 0)
+
+def excited_probability(ground_probabilities):
+    """Returns the (g, n_h) probability of each eigenstate to be found
+        outside the ground manifold"""
+    return 1 - ground_probabilities.sum(axis=1)
+
+###############################################################################
+# Fidelities
+
+def overlaps(exc_eigenstates, app_eigenstates):
+    """Returns the (n_h, exc states, app states) squared overlaps"""
+    return np.abs(np.einsum('hck,hcj->hkj', np.conj(exc_eigenstates), app_eigenstates))**2
+
+def subspace_fidelity(exc_GS_eigenstates, exc_eigenvalues, app_eigenstates, app_eigenvalues, tol=1e-12):
+    """Returns the (g, n_h) fidelity of each approximate eigenstate with the
+        exact level of the same rank, \sum_{k in level} |<exc_k|app_j>|^2,
+        which is the overlap with the projector onto that degenerate level"""
+    same_level = level_labels(exc_eigenvalues, tol).T[:, :, np.newaxis] == \
+        level_labels(app_eigenvalues, tol).T[:, np.newaxis, :]
+    return (overlaps(exc_GS_eigenstates, app_eigenstates)*same_level).sum(axis=1).T
+
+###############################################################################
+# Tracking eigenstates across the h_x grid
+
+def track_eigenstates(eigenstates, eigenvalues=None, tol=1e-10):
+    """Returns the eigenstates, eigenvalues and (n_h, g) order relabeled so
+        that each state continues the state of the same label at the
+        previous h_x, eigenstates[h][:, k] coming from column order[h, k]
+
+        --consecutive steps are matched by the assignment maximizing the
+            total squared overlap of the g x g overlap matrix
+        --given the eigenvalues, each degenerate level is first rotated onto
+            the previous states assigned to it (orthogonal Procrustes), so
+            its arbitrary basis follows the previous step
+        --phases are fixed so that overlaps with the previous step are real
+            and positive"""
+    eigenstates = np.array(eigenstates)
+    n_h, _, g = eigenstates.shape
+    order = np.tile(np.arange(g), (n_h, 1))
+    tracked_eigenvalues = None if eigenvalues is None else np.array(eigenvalues)
+    for h in range(1, n_h):
+        previous, current = eigenstates[h-1], eigenstates[h]
+        if eigenvalues is not None:
+            _, columns = linear_sum_assignment(np.abs(previous.conj().T @ current)**2, maximize=True)
+            for level in level_groups(eigenvalues[:, h], tol):
+                if len(level) > 1:
+                    labels = np.flatnonzero(np.isin(columns, level))
+                    U, _, Vh = np.linalg.svd(current[:, level].conj().T @ previous[:, labels])
+                    current[:, level] = current[:, level] @ (U @ Vh)
+
+        _, columns = linear_sum_assignment(np.abs(previous.conj().T @ current)**2, maximize=True)
+        current = current[:, columns]
+        phase = np.einsum('ck,ck->k', previous.conj(), current)
+        phase = np.where(np.abs(phase) > 0, phase/np.maximum(np.abs(phase), np.finfo(float).tiny), 1)
+        eigenstates[h] = current*np.conj(phase)
+        order[h] = columns
+        if eigenvalues is not None:
+            tracked_eigenvalues[:, h] = eigenvalues[columns, h]
+    return eigenstates, tracked_eigenvalues, order
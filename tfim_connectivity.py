@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+""""tfim_connectivity.py
+    --Connectivity of the classical ground manifold order by order: two
+        ground states are coupled at order k of perturbation theory once
+        their Hamming distance is at most k
+    --Requires: tfim_hamming.py, numpy
+"""
+
+import tfim_hamming
+import numpy as np
+
+###############################################################################
+class UnionFind:
+    """Disjoint sets of 0..n-1 with path halving and union by size"""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1]*n
+        self.components = n
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return False
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        self.components -= 1
+        return True
+
+    def roots(self):
+        return np.array([self.find(x) for x in range(len(self.parent))], dtype=int)
+
+class GroundConnectivity:
+    """Components of the ground manifold for every perturbation order
+
+        --all pairwise distances popcount(x ^ y) are computed once and the
+            edges are merged in order of distance, so a single pass gives
+            the components at each order
+        --connecting_order is the first order with one component
+        --z2_order is the first order where the manifold is connected up to
+            spin inversion: one component, or two that are each other's
+            spin inversion"""
+
+    def __init__(self, GS_indices, N):
+        self.N = N
+        self.indices = np.asarray(GS_indices).astype(np.uint64).ravel()
+        g = len(self.indices)
+
+        # Position of the spin inversion of each ground state, -1 if absent
+        order = np.argsort(self.indices)
+        inverted = self.indices ^ np.uint64((1 << N) - 1)
+        found = np.minimum(np.searchsorted(self.indices[order], inverted), max(g - 1, 0))
+        self.partner = np.where(self.indices[order][found] == inverted, order[found], -1) if g > 0 else order
+
+        distances = tfim_hamming.pairwise_distances(self.indices)
+        rows, columns = np.triu_indices(g, 1)
+        distance = distances[rows, columns]
+        edges = np.argsort(distance, kind='stable')
+        rows, columns, distance = rows[edges], columns[edges], distance[edges]
+
+        # (order, labels) after merging every edge up to that order
+        sets = UnionFind(g)
+        self.levels = []
+        self.connecting_order = None
+        self.z2_order = None
+        self._record(0, sets)
+        levels, starts = np.unique(distance, return_index=True)
+        stops = np.append(starts[1:], len(distance))
+        for level, start, stop in zip(levels, starts, stops):
+            if self.connecting_order is not None:
+                break
+            for x, y in zip(rows[start:stop], columns[start:stop]):
+                sets.union(x, y)
+            self._record(int(level), sets)
+
+    def _record(self, order, sets):
+        labels = sets.roots()
+        self.levels.append((order, labels))
+        if self.z2_order is None:
+            inverse = self.partner >= 0
+            if sets.components <= 1 or (sets.components == 2 and np.all(inverse)
+                                        and np.all(labels[self.partner] != labels)):
+                self.z2_order = order
+        if self.connecting_order is None and sets.components <= 1:
+            self.connecting_order = order
+
+    def labels(self, order):
+        """Returns the component label of each ground state at order"""
+        for level, labels in reversed(self.levels):
+            if level <= order:
+                return labels
+
+    def components(self, order):
+        """Returns the ground state positions of each component at order,
+            largest first"""
+        labels = self.labels(order)
+        groups = [np.flatnonzero(labels == label) for label in np.unique(labels)]
+        return sorted(groups, key=len, reverse=True)
+
+    def component_sizes(self, order):
+        """Returns the component sizes at order, largest first"""
+        return [len(group) for group in self.components(order)]
+
+    def connected(self, order):
+        """Returns True if the ground manifold is connected at order"""
+        return len(np.unique(self.labels(order))) <= 1
+
+    def largest_component(self, order):
+        """Returns the sorted positions of the largest component at order"""
+        return list(self.components(order)[0])
@@ -4,14 +4,26 @@
     Chris Herdman
     06.07.2017
     --Exact diagonalization for transverse field Ising models
-    --Requires: tfim.py, numpy, scipy.sparse, scipy.linalg, progressbar
+    --with --profile, the time and memory of the matrix builds and of
+        each h (solve, observables) are written to <o>_profile.json
+    --matvecs, iterations, residuals and convergence of the Lanczos calls
+        are written to <o>_solver.dat
+    --the diagonalization (dense, sparse, matrix-free or spin flip
+        sectors) is planned by tfim_solver.plan from the memory and time
+        it needs, unless given with --solver or --full; the run stops
+        before building anything when no strategy fits in memory
+    --the ground state observables and entropies of each h are evaluated
+        in one pass over psi0 (tfim_observables)
+    --Requires: tfim.py, tfim_profile.py, tfim_solver.py,
+        tfim_observables.py, numpy, scipy.sparse, scipy.linalg, progressbar
 """
 
 import tfim
-import tfim_rdm
+import tfim_profile
+import tfim_solver
+import tfim_observables
 import numpy as np
 from scipy import sparse
-from scipy.sparse import linalg as spla
 from scipy import linalg
 import progressbar
 import argparse
@@ -46,6 +58,11 @@ def main():
     parser.add_argument('-o', default='output', help='output filename base')                                        
     parser.add_argument('--full',action='store_true',
                             help='Full (rather than Lanczos) diagonalization')
+    parser.add_argument('--solver', default='auto', 
+                            choices=['auto', 'dense', 'sparse', 'matrix_free', 'sectors'],
+                            help='Diagonalization strategy (default: planned)')
+    parser.add_argument('--memory', type=float, default=None,
+                            help='Memory available in GiB (default: physical)')
     parser.add_argument('--save_state',action='store_true',
                             help='Save ground state to file')
     parser.add_argument('--init_v0',action='store_true',
@@ -67,8 +84,10 @@ def main():
     parser.add_argument('--model', default=tfim.models[0], type=str,
             help=("Model type: " + 
                 "".join([ "{}, ".format(mod_i) for mod_i in tfim.models ]) ) )
+    tfim_profile.add_arguments(parser)
             
     args = parser.parse_args()
+    tfim_profile.from_arguments(args)
     ###################################
     
     # Load matricies from file
@@ -112,7 +131,7 @@ def main():
     # Digaonalization flags
     k = args.k
     init_v0 = args.init_v0
-    full_diag = args.full
+    solver = 'dense' if args.full else args.solver
     
     # Save state
     save_state = args.save_state
@@ -124,7 +143,6 @@ def main():
     if entropy_on:
         Svn_filename = args.o + '_Svn.dat'
         ells = range(1,L[0])
-        Svn = np.zeros(len(ells))
      
     # Fidelity
     fidelity_on = args.fidelity
@@ -160,6 +178,27 @@ def main():
     basis = tfim.IsingBasis(lattice)
     ###################################
     
+    # Plan the diagonalization
+    ###################################
+    # One solve per h, and N_F_steps more with fidelities
+    solves = len(h_arr)*(1 + (N_F_steps if fidelity_on else 0))
+    if load_matrices:
+        strategies = ['dense', 'sparse']
+    else:
+        strategies = ['dense', 'sparse', 'matrix_free', 'sectors']
+    memory = None if args.memory is None else args.memory*2**30
+    try:
+        solver_plan = tfim_solver.plan(N, k=k, solves=solves, h_max=h_arr[-1], 
+                            memory=memory, strategies=strategies, diagonals=4,
+                            strategy=None if solver == 'auto' else solver)
+    except (MemoryError, ValueError) as error:
+        print('\t' + str(error).replace('\n', '\n\t'))
+        exit(1)
+    print('\t' + solver_plan.report().replace('\n', '\n\t'))
+    strategy = solver_plan.strategy
+    full_diag = strategy == 'dense'
+    ###################################
+    
     # Setup output data files
     ##################################
     width = 25
@@ -213,22 +252,42 @@ def main():
     # Build Matricies
     ###################################
     if not load_matrices:
-        print( '\tBuilding matrices...' )
-        JZZ, ZZ = tfim.z_correlations_NN(lattice,basis,J)
-        Mz, Ms = tfim.z_magnetizations(lattice,basis)
-        Mx = tfim.build_Mx(lattice,basis)
+        with tfim_profile.stage('operators'):
+            print( '\tBuilding matrices...' )
+            JZZ, ZZ = tfim.z_correlations_NN(lattice,basis,J)
+            Mz, Ms = tfim.z_magnetizations(lattice,basis)
+            if strategy in ['dense', 'sparse']:
+                Mx = tfim.build_Mx(lattice,basis)
+            else:
+                # Applied without storing its N 2^N entries
+                Mx = tfim_solver.TransverseField(N)
         
-        # Infinite range J_{ij} models
-        if model in ["SK", "IR"]:
-            if model == "IR":
-                Jij = J*np.ones((N/2,N))/N
-            elif model == "SK":
-                Jij = tfim.Jij_instance(N,J)
-                print( "\tWriting Jij to {}".format(Jij_filename) )
-                np.savetxt(Jij_filename, Jij, 
-                                    header="N = {}, J = {}".format(N,J),
-                                    fmt='%{}.{}e'.format(width,precision-1) )
-            JZZ = tfim.JZZ_SK(basis,Jij)
+            # Infinite range J_{ij} models
+            if model in ["SK", "IR"]:
+                if model == "IR":
+                    Jij = J*np.ones((N/2,N))/N
+                elif model == "SK":
+                    Jij = tfim.Jij_instance(N,J)
+                    print( "\tWriting Jij to {}".format(Jij_filename) )
+                    np.savetxt(Jij_filename, Jij, 
+                                        header="N = {}, J = {}".format(N,J),
+                                        fmt='%{}.{}e'.format(width,precision-1) )
+                JZZ = tfim.JZZ_SK(basis,Jij)
+    
+    # Classical energies of the matrix-free operators
+    if strategy in ['matrix_free', 'sectors']:
+        diagonal = -JZZ.diagonal()
+    ###################################
+    
+    # Register ground state observables
+    ###################################
+    observables = tfim_observables.Observables(N)
+    observables.operator('Mx', Mx, scale=1./N)
+    observables.diagonal('Mz2', Mz.diagonal()**2, scale=1./N**2)
+    observables.diagonal('Cnn', ZZ.diagonal(), scale=1./lattice.N_links)
+    observables.diagonal('Ms2', Ms.diagonal()**2, scale=1./N**2)
+    if entropy_on:
+        observables.entropies('Svn', [(range(0, ell), range(ell, N)) for ell in ells])
     ###################################
     
     
@@ -238,19 +297,27 @@ def main():
         print("\tStarting full diagaonalization with h in ({},{}), "
                                 "dh = {}".format(h_arr[0], h_arr[-1],args.dh) )
     else:
-        print("\tStarting sparse diagaonalization with k={} and "
-                "h in ({},{}), dh ={}".format(k,h_arr[0], h_arr[-1],args.dh) )
+        print("\tStarting {} diagaonalization with k={} and "
+                "h in ({},{}), dh ={}".format(strategy,k,h_arr[0], h_arr[-1],args.dh) )
     bar = progressbar.ProgressBar()
     v0 = None
     for h in bar(h_arr):
         
-        H = -JZZ - h*Mx    
-        if full_diag:
-            # Full diagonalize
-            E,v = linalg.eigh(H.todense())
-        else:
-            # Sparse diagonalize
-            E,v = spla.eigsh(H, k=k, which='SA', v0=v0)
+        with tfim_profile.stage('solve', h=float(h)):
+            if full_diag:
+                # Full diagonalize
+                H = -JZZ - h*Mx    
+                E,v = linalg.eigh(H.todense())
+            elif strategy == 'sparse':
+                # Sparse diagonalize
+                H = -JZZ - h*Mx    
+                E,v = tfim_solver.eigsh(H, k=k, which='SA', v0=v0, stage='solve', h=h)
+            elif strategy == 'matrix_free':
+                H = tfim_solver.IsingOperator(diagonal, h)
+                E,v = tfim_solver.eigsh(H, k=k, which='SA', v0=v0, stage='solve', h=h)
+            else:
+                # k states in each spin flip sector
+                E,v = tfim_solver.sector_eigsh(diagonal, h, k=k, which='SA', v0=v0, stage='solve', h=h)
         
         # Sort eigenvalues/vectors
         sort_order = np.argsort(E)
@@ -266,53 +333,53 @@ def main():
         if not full_diag and init_v0:
             v0 = psi0
                 
-        # Compute expectation values
+        # Compute expectation values and entropies
         ###################################
-        Mx0 = np.real((psi0.conj().T).dot(Mx.dot(psi0)))/N
-        Mz20 = np.real((psi0.conj().T).dot((Mz.power(2)).dot(psi0)))/(N**2)
-        Cnn = np.real((psi0.conj().T).dot(ZZ.dot(psi0)))/lattice.N_links
-        Ms20 = np.real((psi0.conj().T).dot((Ms.power(2)).dot(psi0)))/(N**2)
+        with tfim_profile.stage('observables'):
+            values = observables.add(psi0)
+        if entropy_on:
+            Svn = values['Svn']
         ###################################
         
         # Compute fidelities
         ###################################
         if fidelity_on:            
-            for i, dhfi in enumerate(dhf):
-                H_F = H - dhfi*Mx 
-                E_F,v_F = spla.eigsh(H_F, k=1, which='SA', v0=psi0)
-                # Sort eigenvalues/vectors
-                sort_order_F = np.argsort(E_F)
-                E_F = E_F[sort_order_F]
-                v_F = v_F[:,sort_order_F]
-                F2[i] = (np.absolute(np.vdot(v_F[:,0], psi0)))**2
+            with tfim_profile.stage('fidelity'):
+                for i, dhfi in enumerate(dhf):
+                    if strategy == 'sectors':
+                        E_F,v_F = tfim_solver.sector_eigsh(diagonal, h + dhfi, k=1, which='SA', 
+                                                v0=psi0, stage='fidelity', h=h, dh=dhfi)
+                    else:
+                        if strategy == 'matrix_free':
+                            H_F = tfim_solver.IsingOperator(diagonal, h + dhfi)
+                        else:
+                            H_F = H - dhfi*Mx 
+                        E_F,v_F = tfim_solver.eigsh(H_F, k=1, which='SA', v0=psi0, 
+                                                stage='fidelity', h=h, dh=dhfi)
+                    # Sort eigenvalues/vectors
+                    sort_order_F = np.argsort(E_F)
+                    E_F = E_F[sort_order_F]
+                    v_F = v_F[:,sort_order_F]
+                    F2[i] = (np.absolute(np.vdot(v_F[:,0], psi0)))**2
         ###################################
     
         # Overlap distribution
         ###################################
         if overlap_on:
-            Pq,Pq_err,q = basis.sample_overlap_distribution(psi0,N_ovlp_samples)
+            with tfim_profile.stage('overlap'):
+                Pq,Pq_err,q = basis.sample_overlap_distribution(psi0,N_ovlp_samples)
         ###################################
        
-        # Entropy
-        ###################################
-        if entropy_on: 
-            for l,ell in enumerate(range(1,L[0])):
-                A = range(0, ell)
-                B = range(ell, L[0]) 
-                S = tfim_rdm.svd(basis, A, B, psi0, False)
-                Svn[l] = tfim_rdm.entropy(S)
-        ###################################
-         
         # Put physical values in phys dictionary
         ###################################
         phys['h'] = h
         phys['e0'] = e0
         phys['Delta_1'] = Delta[1]
         phys['Delta_2'] = Delta[2]
-        phys['Mx'] = Mx0
-        phys['Mz2'] = Mz20
-        phys['Cnn'] = Cnn
-        phys['Ms2'] = Ms20
+        phys['Mx'] = values['Mx']
+        phys['Mz2'] = values['Mz2']
+        phys['Cnn'] = values['Cnn']
+        phys['Ms2'] = values['Ms2']
         ###################################
         
         # Write data to output files
@@ -364,5 +431,24 @@ def main():
         Pq_file.close()
     ###################################
     
+    # Write solver telemetry
+    ###################################
+    if tfim_solver.TELEMETRY.records:
+        solver_filename = tfim_solver.TELEMETRY.write(args.o + '_solver.dat', 
+                                    header='tfim_diag parameters:\t' + parameter_string)
+        summary = tfim_solver.TELEMETRY.summary()
+        print( "\tSolver telemetry written to {}: {} calls, {} matvecs, "
+                "{} not converged".format(solver_filename, summary['calls'], 
+                                    summary['matvecs'], summary['failures']) )
+    ###################################
+    
+    # Write profile
+    ###################################
+    if tfim_profile.enabled():
+        profile_filename = tfim_profile.write(args.o + '_profile.json', 
+                                    parameters=parameter_string, solver=strategy)
+        print( "\tProfile written to {}".format(profile_filename) )
+    ###################################
+    
 if __name__ == "__main__":
     main()
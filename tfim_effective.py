@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+""""tfim_effective.py
+    --Arbitrary-order effective Hamiltonian for the degenerate classical
+        ground manifold of H = H_0 - h_x \sum_i \sigma^x_i
+    --Requires: tfim_matrices.py, tfim_hamming.py, numpy, scipy.sparse
+"""
+
+import tfim_matrices
+import tfim_hamming
+import numpy as np
+from scipy import sparse
+
+###############################################################################
+class EffectiveHamiltonian:
+    """Order-by-order effective Hamiltonian on the ground manifold P
+
+        --H_eff = \sum_k (-h_x)^k H_k, the convention of H_app_4th
+        --the Bloch wave operator Omega = P + chi is built recursively,
+            chi^(n) = R [ Q V Omega^(n-1) - \sum_k chi^(n-k) H_B^(k) ]
+            with R = Q/(E_0 - H_0) and H_B^(n) = P V Omega^(n-1)
+        --H_k is the hermitized (des Cloizeaux / Schrieffer-Wolff) form
+            eta^(1/2) H_B eta^(-1/2) with eta = P Omega^T Omega P
+        --Hamming shells Q_1, Q_2, ... are generated only when an order
+            needs them and every intermediate term is kept, so asking for
+            order k reuses all the work done for order k-1"""
+
+    def __init__(self, basis, Jij, GS_indices, GS_energy, N):
+        self.basis = basis
+        self.Jij = Jij
+        self.N = N
+        self.GS_energy = GS_energy
+        self.P = tfim_matrices.SubspaceIndex(GS_indices, N)
+        g = len(self.P)
+        self.PVP = tfim_matrices.V_block(self.P, self.P)
+        self.energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
+
+        # Excited shells, concatenated as Q = [Q_1, Q_2, ...]
+        self.shells = []
+        self.Q = tfim_matrices.SubspaceIndex([], N)
+        self.gaps = np.zeros(0)             # diagonal of R on Q
+        self.QVP = sparse.csr_matrix((0, g))
+        self.QVQ = sparse.csr_matrix((0, 0))
+
+        # Memoized series: wave operator, Bloch terms, norm and its roots
+        self.chi = [None]
+        self.bloch = [None]
+        self.eta = [np.identity(g), np.zeros((g, g))]
+        self.sqrt_eta = [np.identity(g)]
+        self.inv_sqrt_eta = [np.identity(g)]
+        self.H = [GS_energy*np.identity(g)]
+
+    def shell(self, k):
+        """Returns the indices of Q_k, the states at Hamming distance k
+            from the ground manifold"""
+        while len(self.shells) < k:
+            self._add_shell()
+        return self.shells[k-1].indices
+
+    def _add_shell(self):
+        # Q_{k+1} = neighbors of Q_k outside P, Q_{k-1} and Q_k
+        outer = self.shells[-1] if self.shells else self.P
+        new = tfim_hamming.neighbors(outer.indices, self.N)
+        new = new[~self.P.contains(new) & ~self.Q.contains(new)]
+        shell = tfim_matrices.SubspaceIndex(new, self.N)
+        self.shells.append(shell)
+
+        self.Q = tfim_matrices.SubspaceIndex(
+                    np.concatenate([self.Q.indices, shell.indices]), self.N)
+        self.gaps = np.concatenate([self.gaps, tfim_matrices.energy_gap(
+                    self.basis, self.Jij, shell.indices, self.GS_energy, 1, self.energy)])
+        self.QVP = tfim_matrices.V_block(self.Q, self.P)
+        self.QVQ = tfim_matrices.V_block(self.Q, self.Q)
+        for chi in self.chi[1:]:
+            chi.resize((len(self.Q), len(self.P)))
+
+    def _extend(self):
+        # Adds one order to the wave operator and the Bloch series
+        n = len(self.chi)
+        self.shell(n)
+        if n == 1:
+            self.bloch.append(self.PVP.toarray())
+            V_omega = self.QVP
+        else:
+            self.bloch.append((self.QVP.T @ self.chi[n-1]).toarray())
+            V_omega = self.QVQ @ self.chi[n-1]
+        for k in range(1, n):
+            V_omega = V_omega - self.chi[n-k] @ sparse.csr_matrix(self.bloch[k])
+        chi = sparse.csr_matrix(V_omega.multiply(self.gaps[:, np.newaxis]))
+        chi.eliminate_zeros()
+        self.chi.append(chi)
+
+    def _norm(self, n):
+        # eta_n = \sum_a chi^(a)^T chi^(n-a)
+        while len(self.eta) <= n:
+            m = len(self.eta)
+            while len(self.chi) < m:
+                self._extend()
+            self.eta.append(sum((self.chi[a].T @ self.chi[m-a]).toarray()
+                                                    for a in range(1, m)))
+        return self.eta[n]
+
+    def _roots(self, n):
+        # Series of eta^(1/2) and eta^(-1/2) from A^2 = eta and A C = 1
+        while len(self.sqrt_eta) <= n:
+            m = len(self.sqrt_eta)
+            A = self.sqrt_eta
+            A.append(0.5*(self._norm(m) - sum(A[a] @ A[m-a] for a in range(1, m))))
+            C = self.inv_sqrt_eta
+            C.append(-sum(A[a] @ C[m-a] for a in range(1, m+1)))
+
+    def term(self, k):
+        """Returns H_k, the coefficient of (-h_x)^k, as a dense g x g array"""
+        while len(self.H) <= k:
+            n = len(self.H)
+            while len(self.bloch) <= n:
+                self._extend()
+            self._roots(n - 1)
+            H_n = np.zeros(self.H[0].shape)
+            for b in range(1, n+1):
+                for a in range(n-b+1):
+                    H_n += self.sqrt_eta[a] @ self.bloch[b] @ self.inv_sqrt_eta[n-b-a]
+            self.H.append(0.5*(H_n + H_n.T))
+        return self.H[k]
+
+    def terms(self, order):
+        """Returns [H_0, H_1, ..., H_order]"""
+        self.term(order)
+        return self.H[:order+1]
+
+    def matrix(self, h_x, order):
+        """Returns the effective Hamiltonian at h_x truncated at order"""
+        return sum(H_k*(-h_x)**k for k, H_k in enumerate(self.terms(order)))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+""""tfim_hamming.py
+    --Hamming distances between basis states stored as packed integers,
+        in the bit order of basis.state
+    --Requires: numpy
+"""
+
+import numpy as np
+
+###############################################################################
+# Number of set bits of every byte value
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(x):
+    """Returns the number of set bits of each entry of x as uint8"""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return POPCOUNT_TABLE[x.view(np.uint8).reshape(x.shape + (8,))].sum(axis=-1, dtype=np.uint8)
+
+def pairwise_distances(indices):
+    """Returns the matrix of Hamming distances popcount(x ^ y) of indices"""
+    indices = np.asarray(indices).astype(np.uint64).ravel()
+    return popcount(indices[:, np.newaxis] ^ indices[np.newaxis, :])
+
+def flip_masks(N):
+    """Returns the XOR masks flipping each site, ordered as in basis.state"""
+    return np.left_shift(np.uint64(1), np.arange(N - 1, -1, -1, dtype=np.uint64))
+
+def flip_patterns(N, k):
+    """Returns the XOR masks flipping every set of at most k sites"""
+    masks = flip_masks(N)
+    patterns = [np.zeros(1, dtype=np.uint64)]
+    for weight in range(1, k + 1):
+        # extend each pattern of the previous weight by a bit below its lowest set bit
+        previous = patterns[-1]
+        lowest = previous & (~previous + np.uint64(1))
+        following = previous[:, np.newaxis] | masks[np.newaxis, :]
+        keep = (masks[np.newaxis, :] < lowest[:, np.newaxis]) | (previous[:, np.newaxis] == 0)
+        patterns.append(following[keep])
+    return np.concatenate(patterns)
+
+def distance_to_set(states, reference):
+    """Returns the Hamming distance from each of states to the nearest
+        state of reference"""
+    states = np.asarray(states).astype(np.uint64).ravel()
+    reference = np.asarray(reference).astype(np.uint64).ravel()
+    return popcount(states[:, np.newaxis] ^ reference[np.newaxis, :]).min(axis=1)
+
+def neighbors(indices, N):
+    """Returns the sorted states one spin flip away from any of indices"""
+    indices = np.asarray(indices).astype(np.uint64).ravel()
+    return np.unique(indices[:, np.newaxis] ^ flip_masks(N)[np.newaxis, :])
+
+def within_distance(indices, k, N):
+    """Returns the sorted states within Hamming distance k of indices"""
+    indices = np.asarray(indices).astype(np.uint64).ravel()
+    return np.unique(indices[:, np.newaxis] ^ flip_patterns(N, k)[np.newaxis, :])
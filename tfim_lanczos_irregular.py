@@ -1,15 +1,19 @@
 import tfim_lanczos
-import random
 import time
 import tfim_perturbation
 import numpy as np
 from scipy import sparse
 from scipy.sparse import linalg as spla
 import os
-from multiprocessing import Pool
+import argparse
+import tfim_parallel
+import tfim_profile
+import tfim_solver
+import tfim_system
+from tfim_campaign import Campaign
 
 num_iter = 100
-seed_list = [random.randrange(1, 1e3, 1) for i in range(num_iter)]
+seed_list = range(1, num_iter + 1)
 init = 0.1
 final = 4.
 num_steps = 50
@@ -101,24 +105,6 @@ def lanczos_entropy(GS_indices, A, B, overall_GS, perturbation_param_index):
 
     return entropy
 
-def Ising_energies(Jij):
-
-    Ising_energy_arr = np.zeros(2 ** N)
-    for index in range(2 ** N):
-        state_1 = tfim_lanczos.state(index, N)
-        # modify state from 0 and 1 base to -1, 1 base
-        for i in range(N):
-            if state_1[i] == 0:
-                state_1[i] -= 1
-        Ising_energy = 0
-        for i in range(N):
-            for j in range(i + 1, N, 1):
-                bond_energy = Jij[i, j] * state_1[i] * state_1[j]
-                Ising_energy += bond_energy
-        Ising_energy_arr[index] = Ising_energy
-
-    return Ising_energy_arr
-
 def lanczos_irregular(shape, seed, h_x_range, h_z, maxiter):
     start_time = time.time()
     if shape == 8:
@@ -129,18 +115,20 @@ def lanczos_irregular(shape, seed, h_x_range, h_z, maxiter):
         partition_set = partition_set_10
 
     Jij, N = Jij_func(seed, p=0.5)
+    # energies, ground states and operators of the seed, each built once on first use
+    system = tfim_system.TFIMSystem(Jij, N)
 
-    Ising_energy_arr = Ising_energies(Jij)
-    GS_energy, GS_indices = tfim_perturbation.GS(Ising_energy_arr)
+    with tfim_profile.stage('energies'):
+        Ising_energy_arr = system.energies
+    with tfim_profile.stage('ground_states'):
+        GS_energy, GS_indices = system.ground_manifold
 
-    # initialize Lanczos vector
-    v0 = np.zeros(2 ** N)
-    for i in GS_indices:
-        v0[i] = 1
+        # initialize Lanczos vector
+        v0 = system.v0
 
     # Calculate exact eigenvalues and eigenstates for range(h_x)
     V_exc_csr, H_0_exc_csr, exc_eigenvalues, first_excited__exc_energies, exc_eigenstates = tfim_lanczos.exc_eigensystem(
-        h_x_range, Ising_energy_arr, N, v0)
+        h_x_range, Ising_energy_arr, N, v0, system)
 
     print(
         "----{num_sec}s seconds ---- used for diagonalization for seed {seed}".format(num_sec=time.time() - start_time,
@@ -150,94 +138,61 @@ def lanczos_irregular(shape, seed, h_x_range, h_z, maxiter):
     second_derivative_exc_eigenvalues = np.gradient(first_derivative_exc_eigenvalues, (final - init) / float(num_steps))
 
     susceptibility_time = time.time()
-    chi_aa_matrix = np.zeros((len(h_x_range), N))
-    for i, h_x in enumerate(h_x_range):
-        for a in range(N):
-            sigma_z = np.zeros(2 ** N)
-            for ket in range(2 ** N):
-                state_1 = tfim_lanczos.state(ket, N)
-                if state_1[a] == 1:
-                    sigma_z[ket] += 1
-                else:
-                    sigma_z[ket] -= 1
-            #         H = - V_exc.multiply(h_x) - h_z*sparse.diags(sigma_z)
-            longitudinal_energy = \
-                spla.eigsh(H_0_exc_csr - V_exc_csr.multiply(h_x) - h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0,
-                           maxiter=maxiter,
-                           return_eigenvectors=False)[0]
-            chi_aa = 2. * abs(abs(exc_eigenvalues[i]) - abs(longitudinal_energy)) / (h_z ** 2)
-            chi_aa_matrix[i, a] += chi_aa
-
-    # In[18]:
-    chi_ab_matrix = np.zeros((len(h_x_range), N, N))
-    for n, h_x in enumerate(h_x_range):
-        for a in range(N):
-            sigma_z_a = np.zeros(2 ** N)
-            for ket in range(2 ** N):
-                state_1 = tfim_lanczos.state(ket, N)
-                if state_1[a] == 1:
-                    sigma_z_a[ket] += 1
-                else:
-                    sigma_z_a[ket] -= 1
-            for b in range(a + 1, N, 1):
-                sigma_z_b = np.zeros(2 ** N)
-                for ket in range(2 ** N):
-                    state_2 = tfim_lanczos.state(ket, N)
-                    if state_2[b] == 1:
-                        sigma_z_b[ket] += 1
-                    else:
-                        sigma_z_b[ket] -= 1
-                H = H_0_exc_csr - V_exc_csr.multiply(h_x) - (
-                            sparse.diags(sigma_z_a) + sparse.diags(sigma_z_b)).multiply(
-                    h_z)
-                longitudinal_energy = spla.eigsh(H, k=1, which='SA', v0=v0, maxiter=maxiter, return_eigenvectors=False)[
-                    0]
-                chi_ab = (exc_eigenvalues[n] - longitudinal_energy) / (h_z ** 2.) - 0.5 * (
-                        chi_aa_matrix[n, a] + chi_aa_matrix[n, b])
-                chi_ab_matrix[n, a, b] += chi_ab
-                chi_ab_matrix[n, b, a] += chi_ab
-                # adding the diagonal elements
-                for c in range(N):
-                    chi_ab_matrix[n, c, c] = chi_aa_matrix[n, c]
-    chi_arr = np.zeros(len(h_x_range))
-    for k, h_x in enumerate(h_x_range):
-        chi_arr[k] += np.sum(np.power(chi_ab_matrix[k],2.))
+    with tfim_profile.stage('susceptibility'):
+        chi_aa_matrix = np.zeros((len(h_x_range), N))
+        for i, h_x in enumerate(h_x_range):
+            for a in range(N):
+                #         H = - V_exc.multiply(h_x) - h_z*sparse.diags(sigma_z)
+                longitudinal_energy = \
+                    tfim_solver.eigsh(system.hamiltonian(h_x) - h_z * system.longitudinal(a), k=1, which='SA', v0=v0,
+                               maxiter=maxiter,
+                               return_eigenvectors=False, stage='chi_aa', h_x=h_x, a=a)[0]
+                chi_aa = 2. * abs(abs(exc_eigenvalues[i]) - abs(longitudinal_energy)) / (h_z ** 2)
+                chi_aa_matrix[i, a] += chi_aa
+
+        # In[18]:
+        chi_ab_matrix = np.zeros((len(h_x_range), N, N))
+        for n, h_x in enumerate(h_x_range):
+            for a in range(N):
+                for b in range(a + 1, N, 1):
+                    H = system.hamiltonian(h_x) - system.longitudinal(a, b).multiply(h_z)
+                    longitudinal_energy = tfim_solver.eigsh(H, k=1, which='SA', v0=v0, maxiter=maxiter, return_eigenvectors=False, stage='chi_ab', h_x=h_x, a=a, b=b)[
+                        0]
+                    chi_ab = (exc_eigenvalues[n] - longitudinal_energy) / (h_z ** 2.) - 0.5 * (
+                            chi_aa_matrix[n, a] + chi_aa_matrix[n, b])
+                    chi_ab_matrix[n, a, b] += chi_ab
+                    chi_ab_matrix[n, b, a] += chi_ab
+                    # adding the diagonal elements
+                    for c in range(N):
+                        chi_ab_matrix[n, c, c] = chi_aa_matrix[n, c]
+        chi_arr = np.zeros(len(h_x_range))
+        for k, h_x in enumerate(h_x_range):
+            chi_arr[k] += np.sum(np.power(chi_ab_matrix[k],2.))
     print("----{num_sec}s seconds ---- used for susceptibility for seed {seed}".format(
         num_sec=time.time() - susceptibility_time, seed=seed))
 
     structure_factor_time = time.time()
-    # compute structure factor
-    S_SG_arr = np.zeros(np.shape(h_x_range))
-    for m, h_x in enumerate(h_x_range):
-        psi0 = exc_eigenstates[m]
-        for a in range(N):
-            for b in range(N):
-                sigma_z_a = np.zeros(2 ** N)
-                sigma_z_b = np.zeros(2 ** N)
-                for ket in range(2 ** N):
-                    state_1 = tfim_lanczos.state(ket, N)
-                    if state_1[a] == 1:
-                        sigma_z_a[ket] += 1
-                    else:
-                        sigma_z_a[ket] -= 1
-                for ket in range(2 ** N):
-                    state_2 = tfim_lanczos.state(ket, N)
-                    if state_2[b] == 1:
-                        sigma_z_b[ket] += 1
-                    else:
-                        sigma_z_b[ket] -= 1
-                S_ab = psi0 @ sparse.diags(sigma_z_a) @ sparse.diags(sigma_z_b) @ psi0.T
-                S_SG_arr[m] += S_ab**2.
+    with tfim_profile.stage('structure_factor'):
+        # compute structure factor
+        sigma_z = system.sigma_z
+        S_SG_arr = np.zeros(np.shape(h_x_range))
+        for m, h_x in enumerate(h_x_range):
+            psi0 = exc_eigenstates[m]
+            for a in range(N):
+                for b in range(N):
+                    S_ab = np.dot(psi0 * sigma_z[a], sigma_z[b] * psi0)
+                    S_SG_arr[m] += S_ab**2.
     print("----{num_sec}s seconds ---- used for structure factor for seed {seed}".format(
         num_sec=time.time() - structure_factor_time, seed=seed))
 
     # calculate entanglement entropy
-    lanczos_entropy_par_arr = np.zeros((len(partition_set), len(h_x_range)))
-    for k, par in enumerate(partition_set):
-        [A, B] = par
-        for j in range(len(h_x_range)):
-            lanczos_entropy_par_arr[k, j] = lanczos_entropy([i for i in range(2 ** N)], A, B, exc_eigenstates, j)
-    lanczos_entropy_arr = np.mean(lanczos_entropy_par_arr, axis=0)
+    with tfim_profile.stage('entanglement'):
+        lanczos_entropy_par_arr = np.zeros((len(partition_set), len(h_x_range)))
+        for k, par in enumerate(partition_set):
+            [A, B] = par
+            for j in range(len(h_x_range)):
+                lanczos_entropy_par_arr[k, j] = lanczos_entropy([i for i in range(2 ** N)], A, B, exc_eigenstates, j)
+        lanczos_entropy_arr = np.mean(lanczos_entropy_par_arr, axis=0)
 
     return shape, h_x_range, exc_eigenvalues, first_excited__exc_energies, chi_arr, S_SG_arr, lanczos_entropy_arr
 
@@ -245,44 +200,23 @@ def lanczos_irregular_single_var(seed):
     return lanczos_irregular(N, seed, h_x_range, h_z, maxiter)
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Disorder averaged Lanczos campaign on irregular tiles')
+    tfim_parallel.add_arguments(parser)
+    tfim_profile.add_arguments(parser)
+    args = parser.parse_args()
+    # stages of every seed to the campaign directory/profile.json
+    tfim_profile.from_arguments(args)
 
     init = time.time()
-    p = Pool()
-
-    exc_eigenvalues_all = np.zeros((num_iter, len(h_x_range)))
-    first_excited__exc_energies_all = np.zeros((num_iter, len(h_x_range)))
-    chi_arr_all = np.zeros((num_iter, len(h_x_range)))
-    S_SG_arr_all= np.zeros((num_iter, len(h_x_range)))
-    EE_arr_all= np.zeros((num_iter, len(h_x_range)))
 
-    result_all = p.map(lanczos_irregular_single_var, seed_list, chunksize=10)
+    # each seed is saved as it completes, so an interrupted campaign resumes with the remaining seeds
+    output = "multiprocessing_test_output"
+    campaign = Campaign(os.path.join(output, 'seeds_irregular_{size}'.format(size = N)), seed_list)
+    # processes x BLAS threads from the system size, unless overridden by --workers/--threads
+    workers, threads = tfim_parallel.resolve(N, len(campaign.pending()), args.workers, args.threads)
+    campaign.run(lanczos_irregular_single_var, processes=workers, threads=threads)
     print('multiprocessing_time: ', time.time() - init)
 
-    for seed_index, seed in enumerate(seed_list):
-        shape, h_x_range, exc_eigenvalues, first_excited__exc_energies, chi_arr, S_SG_arr, lanczos_entropy_arr = result_all[seed_index]
-        exc_eigenvalues_all[seed_index] = exc_eigenvalues
-        first_excited__exc_energies_all[seed_index] = first_excited__exc_energies
-        chi_arr_all[seed_index] = chi_arr
-        S_SG_arr_all[seed_index] = S_SG_arr
-        EE_arr_all[seed_index] = lanczos_entropy_arr
-
-    # output files
-    # check to see whether the output file already exists
-    output = "multiprocessing_test_output"
-    if os.path.isdir(output):
-        os.chdir(output)
-    else:
-        os.mkdir(output)
-        os.chdir(output)
-    if os.path.exists('data_all_{size}.npy'.format(size = shape)):
-        os.remove('data_all_{size}.npy'.format(size = shape))
-
-    with open('data_all_{size}.npy'.format(size = shape), 'wb') as f:
-        # save comprehensive data
-        np.save(f, exc_eigenvalues_all)
-        np.save(f, first_excited__exc_energies_all)
-        np.save(f, chi_arr_all)
-        np.save(f, S_SG_arr_all)
-        np.save(f, EE_arr_all)
-
-    os.chdir('../')
+    # shape, h_x_range, exc_eigenvalues, first_excited__exc_energies, chi_arr, S_SG_arr, lanczos_entropy_arr
+    # save comprehensive data: exc_eigenvalues, first_excited__exc_energies, chi_arr, S_SG_arr, entropy
+    campaign.write(os.path.join(output, 'data_all_{size}.npy'.format(size = N)), [2, 3, 4, 5, 6])
@@ -8,6 +8,7 @@
 """
 import tfim
 import tfim_perturbation
+import tfim_hamming
 import numpy as np
 from scipy import sparse
 from scipy.sparse import linalg as spla
@@ -23,52 +24,63 @@ import os
 
 # For generalizing matrix approach to perturbation theory
 
+flip_masks = tfim_hamming.flip_masks
+
+class SubspaceIndex:
+    """Index of a subspace of basis states stored as a sorted uint64 array
+        --rows follow the order of the input indices
+        --membership and row lookup use np.searchsorted"""
+    def __init__(self, indices, N):
+        self.N = N
+        self.indices = np.asarray(indices).astype(np.uint64).ravel()
+        self.order = np.argsort(self.indices, kind='stable')
+        self.sorted = self.indices[self.order]
+        self.masks = flip_masks(N)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def lookup(self, states):
+        """Returns the rows of states in the subspace and a mask of which
+            states were found"""
+        states = np.asarray(states).astype(np.uint64)
+        if len(self.sorted) == 0:
+            return np.zeros(states.shape, dtype=int), np.zeros(states.shape, dtype=bool)
+        pos = np.searchsorted(self.sorted, states)
+        pos[pos == len(self.sorted)] = 0
+        found = self.sorted[pos] == states
+        return self.order[pos], found
+
+    def contains(self, states):
+        """Returns a boolean mask of which states are in the subspace"""
+        return self.lookup(states)[1]
+
+    def neighbors(self):
+        """Returns all single-flip neighbors as a (len, N) uint64 array"""
+        return self.indices[:, None] ^ self.masks[None, :]
+
+def V_block(row_space, col_space):
+    # Matrix elements of \sum_i \sigma^x_i from col_space to row_space, built
+    # from all single flips of col_space in one pass; returns a CSR matrix
+    rows, found = row_space.lookup(col_space.neighbors())
+    cols = np.broadcast_to(np.arange(len(col_space))[:, None], found.shape)
+    block = sparse.coo_matrix((np.ones(np.count_nonzero(found)), (rows[found], cols[found])),
+                              shape=(len(row_space), len(col_space)))
+    return block.tocsr()
+
 def PVP(basis, GS_indices, N):
     # PVP matrix
-    PVP = np.zeros((len(GS_indices), len(GS_indices)))
-    
-    for column, ket in enumerate(GS_indices):
-        state = basis.state(ket)
-        for i in range(N):
-            basis.flip(state,i)
-            bra = basis.index(state)
-            subspace_index = np.argwhere(GS_indices == bra)
-            if len(subspace_index) > 0:
-                row = subspace_index[0][0]
-                PVP[row, column] += 1
-            basis.flip(state,i)
-    return PVP
+    P = SubspaceIndex(GS_indices, N)
+    return V_block(P, P)
 
 def PVQ_1(basis, GS_indices, ES_1_indices, N):
     # Construct PVQ matrix
-    PVQ = np.zeros((len(GS_indices), len(ES_1_indices)))
-    for column, ES_ket_index in enumerate(ES_1_indices):
-        state = basis.state(ES_ket_index)
-        for i in range(N):
-            basis.flip(state, i)
-            state_flipped_index = basis.index(state)
-            if state_flipped_index in GS_indices:
-                GS_bra_index = np.argwhere(np.array(GS_indices) == state_flipped_index)
-                if len(GS_bra_index) > 0:
-                    row = GS_bra_index[0][0]
-                    PVQ[row, column] += 1
-            basis.flip(state, i)
-    return PVQ
+    return V_block(SubspaceIndex(GS_indices, N), SubspaceIndex(ES_1_indices, N))
 
 def Q_1VQ_1(basis, ES_1_indices, GS_indices, N):
     # QVQ matrix
-    QVQ = np.zeros((len(ES_1_indices), len(ES_1_indices)))
-    for column, ket in enumerate(ES_1_indices):
-        state = basis.state(ket)
-        for i in range(N):
-            basis.flip(state, i)
-            bra = basis.index(state)
-            subspace_index = np.argwhere(ES_1_indices == bra)
-            if len(subspace_index) > 0 and ES_1_indices[subspace_index] not in GS_indices:
-                row = subspace_index[0][0]
-                QVQ[row, column] += 1
-            basis.flip(state,i)
-    return QVQ
+    Q_1 = SubspaceIndex(ES_1_indices, N)
+    return V_block(Q_1, Q_1)
 
 # a function that take a state index as input and returns all the indices of 
 # excited states that are one hamming distance away from that state
@@ -76,42 +88,140 @@ def Q_1VQ_1(basis, ES_1_indices, GS_indices, N):
 def Q_1VQ_2(basis, ES_2_indices, ES_1_indices, GS_indices, N):
     #ES_2_indices denotes the indices of all the states that are one Hamming distance away from ES_1_indices
     # QVQ matrix
-    QVQ = np.zeros((len(ES_1_indices), len(ES_2_indices)))
-    for column, ket in enumerate(ES_2_indices):
-        state = basis.state(ket)
-        for i in range(N):
-            basis.flip(state, i)
-            bra = basis.index(state)
-            subspace_index = np.argwhere(ES_1_indices == bra)
-            if len(subspace_index) > 0 and ES_1_indices[subspace_index] not in GS_indices:
-                row = subspace_index[0][0]
-                QVQ[row, column] += 1
-            basis.flip(state,i)
-    return QVQ
+    return V_block(SubspaceIndex(ES_1_indices, N), SubspaceIndex(ES_2_indices, N))
 
 def Hamming_set(basis, input_state_indices, N, GS_indices):
-    Hamming_set = []
-    for i, state_index in enumerate(input_state_indices):
-        state = basis.state(state_index)
-        for j in range(N):
-            basis.flip(state, j)
-            state_flipped_index = basis.index(state)
-            if state_flipped_index not in GS_indices:
-                Hamming_set.append(state_flipped_index)
-            basis.flip(state, j)
-    Hamming_set = np.array(Hamming_set)
-    np.sort(Hamming_set)
-    return np.unique(Hamming_set)
-
-def energy_gap(basis, Jij, input_state_indices, GS_energy, exponent):
-    # Construct energy gap as a diagonal matrix
+    # Sorted uint64 array of all states one flip away from input_state_indices,
+    # excluding GS_indices
+    Hamming_set = tfim_hamming.neighbors(input_state_indices, N)
+    return Hamming_set[~SubspaceIndex(GS_indices, N).contains(Hamming_set)]
+
+def coupling_matrix(Jij, N):
+    # Symmetric N x N couplings for the shifted Jij format of tfim.JZZ_SK_ME,
+    # so that E = -1/2 s^T J s reproduces tfim_perturbation.state_energy
+    J = np.zeros((N, N))
+    sites = np.arange(N)
+    for shift in range(1, N//2 + 1):
+        weight = 0.5 if (N % 2 == 0) and (shift == N//2) else 1.
+        np.add.at(J, (sites, (sites - shift) % N), weight*Jij[shift-1, :])
+    return J + J.T
+
+class ShellEnergy:
+    """Classical energies of states near the ground manifold from local fields
+
+        --local fields h_i(s) = \sum_j J_ij s_j are precomputed for each
+            ground state s, so single and double flips cost O(1):
+            E(s ^ i) = E_GS + 2 s_i h_i
+            E(s ^ i ^ j) = E_GS + 2 s_i h_i + 2 s_j h_j - 4 J_ij s_i s_j
+        --energies of any other state are computed in vectorized form and
+            memoized in a sorted uint64 table
+        --field gives the longitudinal shift -\sum_a h_z^a s_a per state"""
+
+    def __init__(self, basis, Jij, GS_indices, GS_energy=None):
+        self.N = basis.N
+        self.J = coupling_matrix(Jij, self.N)
+        self.masks = flip_masks(self.N)
+        self.GS_indices = np.asarray(GS_indices).astype(np.uint64).ravel()
+        self.GS_spins = self.spins(self.GS_indices)
+        self.GS_fields = self.GS_spins @ self.J
+        self.GS_energies = self._direct(self.GS_indices)
+        if GS_energy is None and len(self.GS_indices) > 0:
+            GS_energy = self.GS_energies[0]
+        self.GS_energy = GS_energy
+
+        # memo of known energies, seeded lazily with single and double flips
+        self.known = None
+        self.known_energies = None
+
+    def spins(self, indices):
+        """Returns the +/-1 spin configurations of indices as a (n, N) array"""
+        indices = np.asarray(indices).astype(np.uint64).ravel()
+        bits = (indices[:, None] & self.masks[None, :]) != 0
+        return 2.*bits - 1.
+
+    def _direct(self, indices):
+        # E = -1/2 rowsum((S J) * S)
+        S = self.spins(indices)
+        return -0.5*np.sum((S @ self.J)*S, axis=1)
+
+    def single_flips(self):
+        """Returns the (g, N) states s ^ i and their energies"""
+        states = self.GS_indices[:, None] ^ self.masks[None, :]
+        energies = self.GS_energies[:, None] + 2.*self.GS_spins*self.GS_fields
+        return states, energies
+
+    def double_flips(self):
+        """Returns the (g, N, N) states s ^ i ^ j and their energies"""
+        states = self.GS_indices[:, None, None] ^ self.masks[None, :, None] ^ self.masks[None, None, :]
+        single = 2.*self.GS_spins*self.GS_fields
+        energies = (self.GS_energies[:, None, None] + single[:, :, None] + single[:, None, :]
+                    - 4.*self.J[None, :, :]*self.GS_spins[:, :, None]*self.GS_spins[:, None, :])
+        diagonal = np.arange(self.N)
+        energies[:, diagonal, diagonal] = self.GS_energies[:, None]
+        return states, energies
+
+    def _remember(self, states, energies):
+        states = np.concatenate([self.known, states.ravel()])
+        energies = np.concatenate([self.known_energies, energies.ravel()])
+        self.known, unique = np.unique(states, return_index=True)
+        self.known_energies = energies[unique]
+
+    def energies(self, indices):
+        """Returns the classical energies of indices"""
+        if self.known is None:
+            self.known = np.zeros(0, dtype=np.uint64)
+            self.known_energies = np.zeros(0)
+            if len(self.GS_indices) > 0:
+                self._remember(self.GS_indices, self.GS_energies)
+                self._remember(*self.single_flips())
+                self._remember(*self.double_flips())
+        indices = np.asarray(indices).astype(np.uint64).ravel()
+        pos = np.searchsorted(self.known, indices)
+        pos[pos == len(self.known)] = 0
+        found = self.known[pos] == indices if len(self.known) > 0 else np.zeros(len(indices), dtype=bool)
+        energies = np.empty(len(indices))
+        energies[found] = self.known_energies[pos[found]]
+        if not np.all(found):
+            missing = np.unique(indices[~found])
+            missing_energies = self._direct(missing)
+            self._remember(missing, missing_energies)
+            energies[~found] = missing_energies[np.searchsorted(missing, indices[~found])]
+        return energies
+
+    def field(self, indices, sites, h_z):
+        """Returns -h_z \sum_{a in sites} s_a for each of indices"""
+        return -h_z*np.sum(self.spins(indices)[:, sites], axis=1)
+
+    def gap(self, indices, exponent, h_z=0., sites=()):
+        """Returns 1/(E_GS - E)^exponent, optionally with a longitudinal
+            field h_z on sites added to E"""
+        energies = self.energies(indices)
+        if h_z != 0. and len(sites) > 0:
+            energies = energies + self.field(indices, sites, h_z)
+        return 1./(self.GS_energy - energies)**exponent
+
+def energy_gap(basis, Jij, input_state_indices, GS_energy, exponent, energy=None):
+    # Energy gaps 1/(E_0 - E)^exponent as a 1D array; this is the diagonal of
+    # the energy gap operator and is applied with gap_scale
     # Input_state_indices is a 1D NumPy array of state indices that are a certain number of Hamming distances away from GS_indices: Q_1, Q_2... etc
-    energy_gap_matrix = np.zeros((len(input_state_indices), len(input_state_indices)))
-    for i,  state_index in enumerate(input_state_indices):
-        energy_gap = GS_energy - tfim_perturbation.state_energy(basis, Jij, state_index)
-        energy_gap_matrix[i, i] += 1/(energy_gap**exponent)
-    return energy_gap_matrix
+    if energy is None:
+        energy = ShellEnergy(basis, Jij, [])
+    return 1./(GS_energy - energy.energies(input_state_indices))**exponent
+
+def gap_scale(matrix, gaps):
+    # matrix @ diag(gaps) for a sparse matrix, applied as a column scaling
+    scaled = sparse.csr_matrix(matrix, copy=True)
+    scaled.data *= np.asarray(gaps)[scaled.indices]
+    return scaled
+
+def pair_scale(matrix, gaps):
+    # Elementwise product of a sparse matrix with a dense array of the same
+    # shape, evaluated on the nonzero entries only
+    scaled = sparse.csr_matrix(matrix, copy=True)
+    rows = np.repeat(np.arange(scaled.shape[0]), np.diff(scaled.indptr))
+    scaled.data *= np.asarray(gaps)[rows, scaled.indices]
+    return scaled
 
 def hc(matrix):
     # helper function for summation between the original matrix and its hermitian conjugate
-    return matrix + np.transpose(matrix)
\ No newline at end of file
+    return matrix + matrix.T
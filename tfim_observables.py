@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+""""tfim_observables.py
+    --Ground state observables evaluated in one pass per h: the caller
+        registers the quantities it needs, then hands each psi0 to add()
+    --|psi|^2 is computed once for every diagonal observable and the
+        sigma^z correlations of the structure factor, each off-diagonal
+        operator (e.g. Mx) is applied once for all of its moments, and psi
+        is reshaped once into a tensor of sites for every bipartition
+    --psi0 is dropped after add() unless archive is set, so a sweep keeps
+        n_h values per quantity instead of n_h states of 2^N amplitudes
+    --Requires: tfim_rdm.py, numpy
+"""
+
+import numpy as np
+import tfim_rdm
+
+###############################################################################
+class Observables:
+    """Registered observables of the ground states of N spins
+
+        --add(psi) evaluates them all on psi and returns their values
+        --results(name) returns the values of name for every state added,
+            one row per state for the entropies
+        --states() returns the archived states (archive=True), one row
+            per state"""
+
+    def __init__(self, N, archive=False, chunk=2**14):
+        self.N = N
+        self.archive = archive
+        self.chunk = chunk
+        self.values = {}
+        self._states = []
+        self._diagonals = []
+        self._correlations = []
+        self._operators = []
+        self._partitions = []
+
+    def _register(self, name):
+        if name in self.values:
+            raise ValueError('Observable {} is already registered'.format(name))
+        self.values[name] = []
+
+    def diagonal(self, name, values, scale=1.):
+        """scale <psi| diag(values) |psi>, e.g. Mz.diagonal()**2 for Mz^2"""
+        self._register(name)
+        self._diagonals.append((name, np.asarray(values, dtype=float), scale))
+
+    def structure_factor(self, name, sigma_z, scale=1.):
+        """scale \sum_ab <sigma^z_a sigma^z_b>^2 from the (N, 2^N) table of
+            sigma^z_a"""
+        self._register(name)
+        self._correlations.append((name, sigma_z, scale))
+
+    def operator(self, name, operator, moment=1, scale=1.):
+        """scale <psi| X^moment |psi> for moment 1 or 2 of a hermitian X,
+            from the one product X psi shared by every moment of X"""
+        if moment not in (1, 2):
+            raise ValueError('Only the first and second moments of an operator are supported')
+        self._register(name)
+        self._operators.append((name, operator, moment, scale))
+
+    def entropies(self, name, partitions):
+        """Von Neumann entropies of the bipartitions [A, B] of the sites"""
+        partitions = [(list(A), list(B)) for A, B in partitions]
+        for A, B in partitions:
+            if sorted(A + B) != list(range(self.N)):
+                raise ValueError('Bipartition {} | {} does not cover the {} sites'.format(A, B, self.N))
+        self._register(name)
+        self._partitions.append((name, partitions))
+
+    def add(self, psi):
+        """Evaluates every registered observable on psi"""
+        values = {}
+        if self._diagonals or self._correlations:
+            weights = np.abs(psi)**2
+            for name, diagonal, scale in self._diagonals:
+                values[name] = scale*np.dot(weights, diagonal)
+            for name, sigma_z, scale in self._correlations:
+                values[name] = scale*np.sum(self._correlation(sigma_z, weights)**2)
+
+        products = {}
+        for name, operator, moment, scale in self._operators:
+            if id(operator) not in products:
+                products[id(operator)] = operator @ psi
+            product = products[id(operator)]
+            if moment == 1:
+                values[name] = scale*np.real(np.vdot(psi, product))
+            else:
+                values[name] = scale*np.real(np.vdot(product, product))
+
+        if self._partitions:
+            tensor = psi.reshape((2,)*self.N)
+            for name, partitions in self._partitions:
+                entropies = np.zeros(len(partitions))
+                for k, (A, B) in enumerate(partitions):
+                    matrix = tensor.transpose(A + B).reshape(2**len(A), 2**len(B))
+                    entropies[k] = tfim_rdm.entropy(np.linalg.svd(matrix, compute_uv=False))
+                values[name] = entropies
+
+        for name, value in values.items():
+            self.values[name].append(value)
+        if self.archive:
+            self._states.append(np.array(psi))
+        return values
+
+    def _correlation(self, sigma_z, weights):
+        # <sigma^z_a sigma^z_b> as one N x N product per chunk of states
+        C = np.zeros((len(sigma_z), len(sigma_z)))
+        for start in range(0, len(weights), self.chunk):
+            Z = np.asarray(sigma_z[:, start:start + self.chunk], dtype=float)
+            C += (Z*weights[start:start + self.chunk]) @ Z.T
+        return C
+
+    def results(self, name):
+        return np.array(self.values[name])
+
+    def states(self):
+        return np.array(self._states) if self.archive else None
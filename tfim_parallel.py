@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+""""tfim_parallel.py
+    --Process pools whose workers are limited to a set number of BLAS and
+        OpenMP threads, so that processes x threads does not oversubscribe
+        the cores when every worker runs eigsh, eigh or svd
+    --the processes x threads split is chosen from the number of spins:
+        many single threaded workers for small systems, fewer workers with
+        more threads (and within memory) for large ones
+    --with threadpoolctl the limits are applied in forked workers; without
+        it the workers are spawned with the thread variables set, so the
+        BLAS libraries they load read them; the variables of this process
+        are restored once the workers are started
+    --thread_limits() limits the threads of this process within a block,
+        which needs threadpoolctl once BLAS is loaded
+    --Requires: numpy, threadpoolctl (optional)
+"""
+
+import contextlib
+import os
+import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Environment variables read by the BLAS and OpenMP runtimes when they load
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+###############################################################################
+def limit_threads(threads):
+    """Limits the BLAS/OpenMP threads of this process and of the processes
+        it starts"""
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=threads)
+
+@contextlib.contextmanager
+def thread_limits(threads):
+    """Limits the BLAS/OpenMP threads of this process within the block;
+        without threadpoolctl the BLAS libraries already read their
+        variables, so a limit below the cores only warns"""
+    if threadpool_limits is not None:
+        with threadpool_limits(limits=threads):
+            yield
+        return
+    if threads < (os.cpu_count() or 1):
+        warnings.warn('threadpoolctl is not installed, {} BLAS threads are not enforced in this process'.format(threads))
+    yield
+
+def physical_memory():
+    # Total memory in bytes, None where sysconf does not report it
+    try:
+        return os.sysconf('SC_PHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def worker_memory(N):
+    # Sparse H with N + 1 entries per row and a Lanczos basis of ~24 vectors, in bytes
+    return 2**N*(12*(N + 1) + 8*24)
+
+def split(N, tasks=None, cores=None):
+    """Returns (workers, threads) for tasks on N spins
+
+        --one thread per worker up to N = 16, doubling every two spins
+            above, since BLAS threads only pay off on large blocks
+        --workers are limited by the tasks available and by the memory a
+            worker needs for 2^N states; leftover cores go to threads"""
+    cores = cores or os.cpu_count() or 1
+    threads = 1 if N <= 16 else min(cores, 2**((N - 15)//2))
+    workers = max(1, cores//threads)
+    if tasks is not None:
+        workers = max(1, min(workers, tasks))
+    memory = physical_memory()
+    if memory is not None:
+        workers = max(1, min(workers, memory//worker_memory(N)))
+    return workers, max(threads, cores//workers)
+
+def resolve(N, tasks=None, workers=None, threads=None, cores=None):
+    """Returns (workers, threads), taking the --workers and --threads
+        overrides and filling the other from the cores"""
+    cores = cores or os.cpu_count() or 1
+    if workers is None and threads is None:
+        return split(N, tasks, cores)
+    if workers is None:
+        workers = max(1, cores//threads)
+        if tasks is not None:
+            workers = max(1, min(workers, tasks))
+    if threads is None:
+        threads = max(1, cores//workers)
+    return workers, threads
+
+def add_arguments(parser):
+    """Adds the --workers and --threads overrides to an argparse parser"""
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--threads', type=int, default=None, help='BLAS/OpenMP threads per worker')
+
+###############################################################################
+# Pools
+
+class _Initializer:
+    # Picklable worker initializer: limits the threads, then runs initializer
+    def __init__(self, threads, initializer=None, initargs=()):
+        self.threads = threads
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def __call__(self):
+        limit_threads(self.threads)
+        if self.initializer is not None:
+            self.initializer(*self.initargs)
+
+def _context():
+    # Forked workers keep the BLAS thread pools of this process, which only
+    # threadpoolctl can resize; spawned ones load BLAS with the variables set
+    if threadpool_limits is not None:
+        return multiprocessing.get_context()
+    return multiprocessing.get_context('spawn')
+
+@contextlib.contextmanager
+def _spawn_variables(threads):
+    # Sets the thread variables for the workers spawned within the block and
+    # restores those of this process after it
+    if threadpool_limits is not None:
+        yield
+        return
+    saved = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    try:
+        yield
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+def pool(workers, threads, initializer=None, initargs=()):
+    """Returns a multiprocessing Pool of workers limited to threads each"""
+    # the Pool starts its workers here
+    with _spawn_variables(threads):
+        return _context().Pool(workers, initializer=_Initializer(threads, initializer, initargs))
+
+@contextlib.contextmanager
+def executor(workers, threads, initializer=None, initargs=()):
+    """Opens a ProcessPoolExecutor of workers limited to threads each
+
+        --the executor starts its workers as tasks are submitted, so the
+            thread variables of spawned workers stay set within the block"""
+    with _spawn_variables(threads):
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_context(),
+                                 initializer=_Initializer(threads, initializer, initargs)) as e:
+            yield e
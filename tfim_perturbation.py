@@ -7,12 +7,20 @@
     --Requires: numpy, scipy.sparse, scipy.linalg, progressbar
 """
 import tfim_matrices as tfim_matrices
+import tfim_effective
+import tfim_susceptibility
+import tfim_connectivity
+import tfim_hamming
+import tfim_compare
+import tfim_profile
+import tfim_solver
+import tfim_system
 import tfim
+import warnings
 import numpy as np
 from scipy.linalg import eigh
 from scipy import sparse
 from scipy.sparse import linalg as spla
-import networkx as nx
 
 
 ###############################################################################
@@ -24,18 +32,15 @@ def Hamming_distance(state_1, state_2):
     return len(np.nonzero(state_1 - state_2)[0])
 
 def Hamming_array(GS_indices, basis):
-    # Calculate Hamming distance array
-    Hamming = np.zeros((len(GS_indices), len(GS_indices)-1))
-    for i, n in enumerate(GS_indices):
-        basis_n = basis.state(n)
-        for j, m in enumerate(np.delete(GS_indices, i)):
-            basis_m = basis.state(m)
-            Hamming[i, j] = Hamming_distance(basis_n, basis_m)
-    return Hamming
+    # Calculate Hamming distance array, without the zero distance of each state to itself
+    g = len(GS_indices)
+    Hamming = tfim_hamming.pairwise_distances(GS_indices)
+    return Hamming[~np.eye(g, dtype=bool)].reshape(g, g - 1).astype(float)
 
 def judge(order, array, N):
-    if array[np.nonzero(array <= N/2.0)] != []:
-        return np.max(array[np.nonzero(array <= N/2.0)]) <= order
+    close = array[array <= N/2.0]
+    if len(close) > 0:
+        return np.max(close) <= order
 
 # def minOrder(order, array, N):
 #     # if this function returns true, then this instance is a threshold instance for which our perturbation expansion is non-trivial
@@ -51,26 +56,7 @@ def min_order(basis, GS_indices):
     construct the equal superposition in the wavefunction. Thus the minimum order needed is the one such that the ground
     manifold is reduced to two spin-inversion components of each other.
     '''
-
-    def order_GS_graph(basis, GS_indices, order):
-        Hamming_matrix = np.zeros((len(GS_indices), len(GS_indices)))
-        for i in range(len(GS_indices)):
-            for j in range(i + 1, len(GS_indices)):
-                GS_index_1 = GS_indices[i]
-                GS_index_2 = GS_indices[j]
-                if Hamming_distance(basis.state(GS_index_1), basis.state(GS_index_2)) <= order:
-                    Hamming_matrix[i, j] += 1
-        Hamming_matrix += Hamming_matrix.T
-        return nx.from_numpy_matrix(Hamming_matrix)
-
-    # Construct graph
-    order = 0
-    G = order_GS_graph(basis, GS_indices, order)
-    while nx.number_connected_components(G) > 2:
-        order += 1
-        G = order_GS_graph(basis, GS_indices, order)
-
-    return order
+    return tfim_connectivity.GroundConnectivity(GS_indices, basis.N).z2_order
     
 ###############################################################################
 
@@ -101,115 +87,32 @@ def H_app_0(GS_energy, GS_indices):
 def H_app_1(basis, GS_indices, N):
     
     # First-Order term in perturbation theory
-    V = np.zeros((len(GS_indices), len(GS_indices)))
-    
-    for column, ket in enumerate(GS_indices):
-        state = basis.state(ket)
-        for i in range(N):
-            basis.flip(state,i)
-            bra = basis.index(state)
-            subspace_index = np.argwhere(GS_indices == bra)
-            if len(subspace_index) > 0:
-                row = subspace_index[0][0]
-                V[row, column] += 1
-            basis.flip(state,i)
-    return V
+    return tfim_matrices.PVP(basis, GS_indices, N).toarray()
 
 def H_app_2(basis, Jij, GS_indices, N, GS_energy):
     # Second-Order term in perturbation theory
-    H_app_2 = np.zeros((len(GS_indices), len(GS_indices)))
-    
-    for column, GS_ket_1 in enumerate(GS_indices):
-        state_1 = basis.state(GS_ket_1)
-        for i in range(N):
-            basis.flip(state_1, i)
-            state_1_flipped_index = basis.index(state_1)
-            if state_1_flipped_index not in GS_indices:
-                energy_gap = state_energy(basis, Jij, state_1_flipped_index) - GS_energy
-                for j in range(N):
-                    basis.flip(state_1,j)
-                    ES_2_flipped_index = basis.index(state_1)
-                    GS_2_index = np.argwhere(np.array(GS_indices) == ES_2_flipped_index)
-                    if len(GS_2_index) > 0:
-                        row = GS_2_index[0][0]
-                        H_app_2[row, column] -= 1./energy_gap
-                    basis.flip(state_1, j)
-            basis.flip(state_1, i)
-    return H_app_2
+    ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
+    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+    EG_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1, energy)
+    return (tfim_matrices.gap_scale(PVQ1, EG_11) @ PVQ1.T).toarray()
 
 def H_app_3(basis, Jij, GS_indices, N, GS_energy):
     # 3rd order approximation term
-    H_app_3 = np.zeros((len(GS_indices), len(GS_indices)))
-    
-    for column, GS_bra_1 in enumerate(GS_indices):
-        state_0 = basis.state(GS_bra_1)
-        for i in range(N):
-            basis.flip(state_0, i)
-            state_1_index = basis.index(state_0)
-            if state_1_index in GS_indices:
-                for j in range(N):
-                    basis.flip(state_0, j)
-                    state_2_index = basis.index(state_0)
-                    if state_2_index not in GS_indices:
-                        energy_gap = GS_energy - state_energy(basis, Jij, state_2_index)
-                        for k in range(N):
-                            basis.flip(state_0, k)
-                            state_3_index = basis.index(state_0)
-                            GS_3_index = np.argwhere(np.array(GS_indices) == state_3_index)
-                            if len(GS_3_index) > 0:
-                                row = GS_3_index[0][0]
-                                H_app_3[row, column] += -0.5/(energy_gap**2)
-                            basis.flip(state_0, k)
-                    basis.flip(state_0, j)
-            basis.flip(state_0, i)
-    term_2 = np.transpose(H_app_3)
-    H_app_3 += term_2
-    
-#     for column, GS_bra_1 in enumerate(GS_indices):        
-#         state_0 = basis.state(GS_bra_1)
-#         for i in range(N):
-#             basis.flip(state_0, i)
-#             state_1_index = basis.index(state_0)
-#             if state_1_index not in GS_indices:
-#                 energy_gap = state_energy(basis, Jij, state_1_index) - GS_energy
-#                 for j in range(N):
-#                     basis.flip(state_0, j)
-#                     state_2_index = basis.index(state_0)
-#                     if state_2_index in GS_indices:
-#                         for k in range(N):
-#                             basis.flip(state_0, k)
-#                             state_3_index = basis.index(state_0)
-#                             GS_3_index = np.argwhere(np.array(GS_indices) == state_3_index)
-#                             if len(GS_3_index) > 0:
-#                                 row = GS_3_index[0][0]
-#                                 H_app_3[row, column] += -0.5/(energy_gap**2)
-#                             basis.flip(state_0, k)
-#                     basis.flip(state_0, j)
-#             basis.flip(state_0, i)
+    ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
+    PVP = tfim_matrices.PVP(basis, GS_indices, N)
+    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+    Q1VQ1 = tfim_matrices.Q_1VQ_1(basis, ES_1_indices, GS_indices, N)
+    S_11 = tfim_matrices.gap_scale(PVQ1, tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1, energy))
+    S_12 = tfim_matrices.gap_scale(PVQ1, tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 2, energy))
 
-    for column, GS_bra_1 in enumerate(GS_indices):
-        state_0 = basis.state(GS_bra_1)
-        for i in range(N):
-            basis.flip(state_0, i)
-            state_1_index = basis.index(state_0)
-            if state_1_index not in GS_indices:
-                energy_gap_1 = GS_energy - state_energy(basis, Jij, state_1_index)
-                for j in range(N):
-                    basis.flip(state_0, j)
-                    state_2_index = basis.index(state_0)
-                    if state_2_index not in GS_indices:
-                        energy_gap_2 = GS_energy - state_energy(basis, Jij, state_2_index)
-                        for k in range(N):
-                            basis.flip(state_0, k)
-                            state_3_index = basis.index(state_0)
-                            GS_3_index = np.argwhere(np.array(GS_indices) == state_3_index)
-                            if len(GS_3_index) > 0:
-                                row = GS_3_index[0][0]
-                                H_app_3[row, column] += 1.0/(energy_gap_1*energy_gap_2)
-                            basis.flip(state_0, k)
-                    basis.flip(state_0, j)
-            basis.flip(state_0, i)
-    return H_app_3
+    # GS -> GS -> Q1 -> GS paths and their transpose
+    H_app_3 = tfim_matrices.hc(-0.5*(S_12 @ PVQ1.T @ PVP))
+
+    # GS -> Q1 -> Q1 -> GS paths
+    H_app_3 += S_11 @ Q1VQ1 @ S_11.T
+    return H_app_3.toarray()
 
 def H_app_1st(h_x, H_0, V):
     # Calculate final 1st order
@@ -233,6 +136,10 @@ def H_app_4th(h_x, H_0, V, H_2, H_3, H_4):
     c_4 = h_x**4
     return H_0 - h_x*V + H_2*c_2 - H_3*c_3 + H_4*c_4
 
+def H_app_kth(h_x, H_terms):
+    # Calculate final approximated matrix from [H_0, H_1, ..., H_k]
+    return sum(H_k*(-h_x)**k for k, H_k in enumerate(H_terms))
+
 def V_exact(basis, lattice):
     V_exact = np.zeros((basis.M, basis.M))
     for ket in range(basis.M):
@@ -253,6 +160,33 @@ def H_exact(h_x, V_exact, H_0_exact):
 
 ###############################################################################
 
+def H_app_blocks(basis, Jij, GS_energy, ES_1_indices, ES_2_indices, PVP, PVQ1, Q1VQ1, Q1VQ2, energy=None):
+    # 1st to 4th order terms from the sparse building blocks; energy gaps are
+    # 1D arrays applied as column scalings, e.g. S_11 = PVQ1 @ diag(EG_11)
+    Q1VP = PVQ1.T
+    if energy is None:
+        energy = tfim_matrices.ShellEnergy(basis, Jij, [])
+    EG_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1, energy)
+    EG_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 2, energy)
+    EG_13 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 3, energy)
+    EG_21 = tfim_matrices.energy_gap(basis, Jij, ES_2_indices, GS_energy, 1, energy)
+    S_11 = tfim_matrices.gap_scale(PVQ1, EG_11)
+    S_12 = tfim_matrices.gap_scale(PVQ1, EG_12)
+    S_13 = tfim_matrices.gap_scale(PVQ1, EG_13)
+
+    # PVQ1 @ EGM_11 @ Q1VQ2, so the last 4th order term never forms a |Q2| x |Q2| matrix
+    S_112 = S_11 @ Q1VQ2
+
+    H_app_1 = PVP
+
+    H_app_2 = S_11 @ Q1VP
+
+    H_app_3 = -0.5*tfim_matrices.hc(PVP @ S_12 @ Q1VP) + S_11 @ Q1VQ1 @ S_11.T
+
+    H_app_4 = 0.5*(tfim_matrices.hc(S_13 @ Q1VP @ PVP @ PVP)) - 0.5*(tfim_matrices.hc(S_12 @ Q1VP @ S_11 @ Q1VP)) - 1.*(tfim_matrices.hc(S_11 @ Q1VQ1 @ S_12.T @ PVP)) + 1.*(tfim_matrices.gap_scale(S_112, EG_21) @ S_112.T)
+
+    return H_app_1.toarray(), H_app_2.toarray(), H_app_3.toarray(), H_app_4.toarray()
+
 def app_1_eigensystem(GS_indices, GS_energy, h_x_range, J, N, basis, Jij):
     # Calculate approximated eigenvalues and eigenstates for range(h_x)
     app_eigenvalues = np.zeros((len(GS_indices), len(h_x_range)))
@@ -292,22 +226,23 @@ def app_2_eigensystem_general_matrices(GS_indices, GS_energy, h_x_range, J, N, b
     app_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
     
     ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
     PVP = tfim_matrices.PVP(basis, GS_indices, N)
-    PVQ = tfim_matrices.PVQ_1(basis, Jij, GS_indices, ES_1_indices, N, GS_energy)
-    QVP = np.transpose(PVQ)
-    energy_gap_matrix = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 1)
+    PVQ = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+    QVP = PVQ.T
+    EG_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1, energy)
     
     # Build 0th order approximated matrix
     H_0 = H_app_0(GS_energy, GS_indices)
 
     # Start building the 1st order Hamiltonian
-    H_app_1 = PVP
+    H_app_1 = PVP.toarray()
 
     # Start building the 2nd Hamiltonian
-    H_app_2 = PVQ @ energy_gap_matrix @ QVP
+    H_app_2 = (tfim_matrices.gap_scale(PVQ, EG_11) @ QVP).toarray()
     
     for j, h_x in enumerate(h_x_range):
-        app_eigenvalue, app_eigenstate = np.linalg.eigh(H_app_2nd(h_x, H_0, H_app_1, H_app_2, J));
+        app_eigenvalue, app_eigenstate = np.linalg.eigh(H_app_2nd(h_x, H_0, H_app_1, H_app_2));
         for i in range(len(GS_indices)):
             app_eigenvalues[i][j] = app_eigenvalue[i]
             for k in range(len(GS_indices)):
@@ -337,29 +272,31 @@ def app_3_eigensystem_general_matrices(GS_indices, GS_energy, h_x_range, J, N, b
     app_eigenvalues = np.zeros((len(GS_indices), len(h_x_range)))
     app_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
     
-        # Building blocks matrices
+    # Building blocks matrices
     ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
     PVP = tfim_matrices.PVP(basis, GS_indices, N)
-    PVQ1 = tfim_matrices.PVQ_1(basis, Jij, GS_indices, ES_1_indices, N, GS_energy)
-    Q1VP = np.transpose(PVQ1)
+    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+    Q1VP = PVQ1.T
     Q1VQ1 = tfim_matrices.Q_1VQ_1(basis, ES_1_indices, GS_indices, N)
 
-    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-    EGM_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 2)
-    EGM_13 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 3)
-    EGM_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 1)
+    # energy gaps EG_12 denote the diagonal of 1/(E_0-QH_0Q)^2 on Q1; S_12 = PVQ1 @ diag(EG_12)
+    EG_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 2, energy)
+    EG_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1, energy)
+    S_12 = tfim_matrices.gap_scale(PVQ1, EG_12)
+    S_11 = tfim_matrices.gap_scale(PVQ1, EG_11)
 
     # Start building Hamiltonians
     H_0 = H_app_0(GS_energy, GS_indices)
 
-    H_app_1 = PVP
+    H_app_1 = PVP.toarray()
 
-    H_app_2 = PVQ1 @ EGM_11 @ Q1VP
+    H_app_2 = (S_11 @ Q1VP).toarray()
 
-    H_app_3 = -0.5*(PVP @ PVQ1 @ EGM_12 @ Q1VP + np.transpose(PVP @ PVQ1 @ EGM_12 @ Q1VP)) + PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_11 @ Q1VP
+    H_app_3 = (-0.5*tfim_matrices.hc(PVP @ S_12 @ Q1VP) + S_11 @ Q1VQ1 @ S_11.T).toarray()
     
     for j, h_x in enumerate(h_x_range):
-        app_eigenvalue, app_eigenstate = eigh(H_app_3rd(h_x, H_0, H_app_1, H_app_2, H_app_3, J));
+        app_eigenvalue, app_eigenstate = eigh(H_app_3rd(h_x, H_0, H_app_1, H_app_2, H_app_3));
         for i in range(len(GS_indices)):
             app_eigenvalues[i][j] = app_eigenvalue[i]
             for k in range(len(GS_indices)):
@@ -373,33 +310,18 @@ def app_4_eigensystem_general_matrices(GS_indices, GS_energy, h_x_range, J, N, b
     
     # Building blocks matrices
     ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices, GS_energy)
     ES_2_indices = tfim_matrices.Hamming_set(basis, ES_1_indices, N, GS_indices)
     
     # Building blocks matrices
     PVP = tfim_matrices.PVP(basis, GS_indices, N)
-    PVQ1 = tfim_matrices.PVQ_1(basis, Jij, GS_indices, ES_1_indices, N, GS_energy)
-    Q1VP = np.transpose(PVQ1)
+    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
+    Q1VP = PVQ1.T
     Q1VQ1 = tfim_matrices.Q_1VQ_1(basis, ES_1_indices, GS_indices, N)
     Q1VQ2 = tfim_matrices.Q_1VQ_2(basis, ES_2_indices, ES_1_indices, GS_indices, N)
-    Q2VQ1 = np.transpose(Q1VQ2)
-
-    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-    EGM_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 2)
-    EGM_13 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 3)
-    EGM_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, N, GS_energy, 1)
-    EGM_21 = tfim_matrices.energy_gap(basis, Jij, ES_2_indices, N, GS_energy, 1)
-    
-    # Start building Hamiltonians
 
     H_0 = H_app_0(GS_energy, GS_indices)
-
-    H_app_1 = PVP
-
-    H_app_2 = PVQ1 @ EGM_11 @ Q1VP
-
-    H_app_3 = -0.5*(PVP @ PVQ1 @ EGM_12 @ Q1VP + np.transpose(PVP @ PVQ1 @ EGM_12 @ Q1VP)) + PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_11 @ Q1VP
-    
-    H_app_4 = 0.5*(tfim_matrices.hc(PVQ1 @ EGM_13 @ Q1VP @ PVP @ PVP)) - 0.5*(tfim_matrices.hc(PVQ1 @ EGM_12 @ Q1VP @ PVQ1 @ EGM_11 @ Q1VP)) - 1.*(tfim_matrices.hc(PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_12 @ Q1VP @ PVP)) + 1.*(PVQ1 @ EGM_11 @ Q1VQ2 @ EGM_21 @ Q2VQ1 @ EGM_11 @ Q1VP)
+    H_app_1, H_app_2, H_app_3, H_app_4 = H_app_blocks(basis, Jij, GS_energy, ES_1_indices, ES_2_indices, PVP, PVQ1, Q1VQ1, Q1VQ2, energy)
 
     for j, h_x in enumerate(h_x_range):
         app_eigenvalue, app_eigenstate = eigh(H_app_4th(h_x, H_0, H_app_1, H_app_2, H_app_3, H_app_4));
@@ -409,6 +331,17 @@ def app_4_eigensystem_general_matrices(GS_indices, GS_energy, h_x_range, J, N, b
                 app_eigenstates[j][i][k] = app_eigenstate[i][k]
     return app_eigenvalues, app_eigenstates, H_app_4
 
+def app_k_eigensystem(GS_indices, GS_energy, h_x_range, J, N, basis, Jij, order):
+    # Calculate approximated eigenvalues and eigenstates for range(h_x) at any order
+    app_eigenvalues = np.zeros((len(GS_indices), len(h_x_range)))
+    app_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
+
+    H_terms = tfim_effective.EffectiveHamiltonian(basis, Jij, GS_indices, GS_energy, N).terms(order)
+
+    for j, h_x in enumerate(h_x_range):
+        app_eigenvalues[:, j], app_eigenstates[j] = eigh(H_app_kth(h_x, H_terms))
+    return app_eigenvalues, app_eigenstates, H_terms[-1]
+
 def exc_eigensystem(basis, h_x_range, lattice, Energies):
     # Calculate exact eigenvalues and eigenstates for range(h_x)
     exc_eigenvalues = np.zeros((basis.M, len(h_x_range)))
@@ -423,21 +356,90 @@ def exc_eigensystem(basis, h_x_range, lattice, Energies):
                 exc_eigenstates[j][i][k] = exc_eigenstate[i][k]
     return exc_eigenvalues, exc_eigenstates
 
+def exc_GS_eigensystem(basis, h_x_range, lattice, Energies, GS_indices, tol=1e-8, maxiter=500):
+    """Exact eigenvalues of the len(GS_indices) lowest states for range(h_x)
+        and their components on the ground manifold
+
+        --the sparse Hamiltonian is diagonalized by block iteration (lobpcg)
+            started from the states of the previous h_x, so only (2^N, g)
+            eigenvectors are held at a time; a single vector Lanczos (eigsh)
+            returns one state per numerically degenerate pair, which the
+            ground manifold has at small h_x
+        --tol bounds the residuals; eigenvalue errors go as tol^2
+        --when lobpcg stops above tol, or its block misses a lower state
+            of H (e.g. one crossing in from above along h_x), the h_x is
+            solved again by eigsh for the g lowest states, and
+            ArpackNoConvergence is raised if that fails the same checks
+        --returns exc_eigenvalues (g, len(h_x_range)) and exc_GS_eigenstates
+            (len(h_x_range), g, g), which are the rows GS_indices of the
+            eigenvectors"""
+    g = len(GS_indices)
+    exc_eigenvalues = np.zeros((g, len(h_x_range)))
+    exc_GS_eigenstates = np.zeros((len(h_x_range), g, g))
+    V_exc = V_exact_csr(basis, lattice)
+    H_0_exc = H_0_exact_csr(Energies)
+
+    # the classical ground states are the eigenstates at h_x = 0
+    exc_eigenstate = np.zeros((basis.M, g))
+    exc_eigenstate[GS_indices, np.arange(g)] = 1.
+    for j, h_x in enumerate(h_x_range):
+        if h_x == 0:
+            exc_eigenvalue = np.asarray(Energies)[GS_indices]
+            exc_eigenstate = np.zeros((basis.M, g))
+            exc_eigenstate[GS_indices, np.arange(g)] = 1.
+        elif basis.M < 5*g:
+            exc_eigenvalue, exc_eigenstate = np.linalg.eigh((H_0_exc - h_x*V_exc).toarray())
+            exc_eigenvalue, exc_eigenstate = exc_eigenvalue[:g], exc_eigenstate[:, :g]
+        else:
+            H = (H_0_exc - h_x*V_exc).tocsr()
+            with warnings.catch_warnings():
+                # convergence is checked on the residuals below
+                warnings.simplefilter('ignore', UserWarning)
+                exc_eigenvalue, exc_eigenstate = spla.lobpcg(H, exc_eigenstate, largest=False, tol=tol,
+                                                             maxiter=maxiter)
+            if not _lowest(H, exc_eigenvalue, exc_eigenstate, tol, h_x):
+                # lobpcg stalled, or settled on a block that misses a state
+                # crossing in from above: solve again by Lanczos
+                exc_eigenvalue, exc_eigenstate = tfim_solver.eigsh(H, k=g, which='SA', stage='exc_GS_eigensystem',
+                                                                   h_x=h_x)
+                if not _lowest(H, exc_eigenvalue, exc_eigenstate, tol, h_x):
+                    raise spla.ArpackNoConvergence('exc_GS_eigensystem: no convergence at h_x = {}'.format(h_x),
+                                                   exc_eigenvalue, exc_eigenstate)
+            order = np.argsort(exc_eigenvalue)
+            exc_eigenvalue, exc_eigenstate = exc_eigenvalue[order], exc_eigenstate[:, order]
+        exc_eigenvalues[:, j] = exc_eigenvalue
+        exc_GS_eigenstates[j] = exc_eigenstate[GS_indices, :]
+    return exc_eigenvalues, exc_GS_eigenstates
+
+def _lowest(H, eigenvalues, eigenvectors, tol, h_x):
+    # Whether the orthonormal eigenpairs have residuals ||H v - E v|| within
+    # tol and are the lowest states of H: H restricted to their complement,
+    # with their span shifted above them, has no eigenvalue below max(E)
+    if np.max(np.linalg.norm(H @ eigenvectors - eigenvectors*eigenvalues, axis=0)) > tol:
+        return False
+    X = eigenvectors
+    shift = np.max(eigenvalues) + 1.
+
+    def matvec(x):
+        x = np.ravel(x)
+        p = X.T @ x
+        y = H @ (x - X @ p)
+        return y - X @ (X.T @ y) + shift*(X @ p)
+
+    complement = spla.LinearOperator(H.shape, matvec=matvec, dtype=H.dtype)
+    lowest = tfim_solver.eigsh(complement, k=1, which='SA', return_eigenvectors=False,
+                               stage='exc_GS_complement', h_x=h_x)[0]
+    return lowest >= np.max(eigenvalues) - tol
+
 # modified exact Hamiltonians using compressed sparse row matrices
 def V_exact_csr(basis, lattice):
-    row = []
-    col = []
+    # every ket connects to the N states one spin flip away
     N = lattice.N
-    for ket in range(basis.M):
-        state = basis.state(ket)
-        for i in range(lattice.N):
-            basis.flip(state, i)
-            bra = basis.index(state)
-            row.append(bra)
-            col.append(ket)
-            basis.flip(state, i)
+    kets = np.arange(basis.M, dtype=np.uint64)
+    bras = kets[:, np.newaxis] ^ tfim_hamming.flip_masks(N)[np.newaxis, :]
+    col = np.repeat(np.arange(basis.M), N)
     data = np.ones(len(col))
-    V_exact = sparse.csr_matrix((data, (np.array(row), np.array(col))), shape=(2 ** N, 2 ** N))
+    V_exact = sparse.csr_matrix((data, (bras.ravel().astype(np.int64), col)), shape=(2 ** N, 2 ** N))
     return V_exact
 
 def H_0_exact_csr(Energies):
@@ -467,39 +469,19 @@ def prob(eigenstate):
 
 def prob_app(GS_indices, h_x_range, app_eigenstates):
     # Calculate probabilities for approximated eigenstates
-    prob_app = np.zeros((len(GS_indices), len(h_x_range),))
-    for j, h_x in enumerate(h_x_range):
-        GS_prob_vector = prob(app_eigenstates[j][:, 0])
-        for i in range(len(GS_indices)):
-            prob_app[i][j] = GS_prob_vector[i]
-    return prob_app
+    return tfim_compare.probabilities(np.asarray(app_eigenstates)[:, :, :1])[:, :len(GS_indices), 0].T
 
 def prob_exc(GS_indices, h_x_range, exc_eigenstates, index):
     # Calculate probabilities for exact eigenstates
-    prob_exc = np.zeros((len(GS_indices), len(h_x_range)))
-    for j, h_x in enumerate(h_x_range):
-        GS_prob_vector = prob(exc_eigenstates[j][:, index])
-        for i in range(len(GS_indices)):
-            prob_exc[i][j] = GS_prob_vector[i]
-    return prob_exc
+    return tfim_compare.probabilities(np.asarray(exc_eigenstates)[:, :, index:index+1])[:, :len(GS_indices), 0].T
 
 def prob_exc_total(GS_indices, h_x_range, exc_eigenstates):
     # Probability of finding the system to be in each of the ground states
-    prob_exc_total = np.zeros((len(GS_indices), len(GS_indices), len(h_x_range),))
-    for n in range(len(GS_indices)):
-        for j, h_x in enumerate(h_x_range):
-            GS_prob_vector = prob(np.transpose(exc_eigenstates[j])[n])
-            for k, i in enumerate(GS_indices):
-                prob_exc_total[n][k][j] = GS_prob_vector[i]
-    return prob_exc_total
+    return tfim_compare.ground_probabilities(GS_indices, exc_eigenstates)
 
 def prob_excited_sum(GS_indices, h_x_range, prob_exc_total):
     # Probability of finding the system to be in excited states
-    prob_excited_sum = np.zeros((len(GS_indices), len(h_x_range)))
-    for n in range(len(GS_indices)):
-        for i, h_x in enumerate(h_x_range):
-            prob_excited_sum[n][i] = 1 - np.sum(prob_exc_total[n][:, i])
-    return prob_excited_sum
+    return tfim_compare.excited_probability(prob_exc_total)
 
 def normalize(eigenstate):
     # Normalize
@@ -507,23 +489,11 @@ def normalize(eigenstate):
     return eigenstate/norm
 
 def GS_exc_eigenstates(GS_indices, h_x_range, exc_eigenstates):
-    GS_exc_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
-    for j in range(len(h_x_range)):
-        for n, m in enumerate(GS_indices):
-            for i, k in enumerate(GS_indices):
-                GS_exc_eigenstates[j, n, i] = exc_eigenstates[j, m, i]
-    return GS_exc_eigenstates
+    return tfim_compare.ground_components(GS_indices, exc_eigenstates)
 
 def norm_GS_exc_eigenstates(GS_indices, h_x_range, exc_eigenstates):
     # Renormalize
-    normalized_GS_exc_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
-    GS_exc_ES = GS_exc_eigenstates(GS_indices, h_x_range, exc_eigenstates)
-    for j in range(len(h_x_range)):
-        for n in range(len(GS_indices)):
-            normed_vector = normalize(GS_exc_ES[j, :, n])
-            for i in range(len(GS_indices)):
-                normalized_GS_exc_eigenstates[j, i, n] = normed_vector[i]
-    return normalized_GS_exc_eigenstates
+    return tfim_compare.ground_components(GS_indices, exc_eigenstates, normalize=True)
 
 def fidelity(exc_eigenstate, app_eigenstate):
     # Calculate fidelity
@@ -532,33 +502,12 @@ def fidelity(exc_eigenstate, app_eigenstate):
 
 def sort(lst):
     # identify degenerate energy level and resort
-    epsilon = 1*10**(-12)
-    order = [];
-    floor = np.array([0]);
-    for i in range(1, len(lst)):
-        if abs(lst[i-1] - lst[i]) <= epsilon:
-            floor = np.append(floor, i)
-        else:  
-            order.append(floor)
-            floor = np.array([i]);
-    order.append(floor)
-    return list(order) 
+    return tfim_compare.level_groups(lst, 1*10**(-12))
 
 def fidelity_array(GS_indices, h_x_range, GS_exc_eigenvalues, app_eigenvalues, exc_eigenstates, app_eigenstates):
     # Produce an array of fidelities between exc and app to be plotted
-    fidelity_array = np.zeros((len(GS_indices), len(h_x_range)))
-    GS_exc_ES = GS_exc_eigenstates(GS_indices, h_x_range, exc_eigenstates)
-    for i in range(len(h_x_range)):
-        sorted_exc_energy_indices = sort(GS_exc_eigenvalues[:, i])
-        sorted_app_energy_indices = sort(app_eigenvalues[:, i])
-        for l, app_level in enumerate(sorted_app_energy_indices):
-            for j in app_level:
-                fidel_sum = 0;
-                for k in sorted_exc_energy_indices[l]:
-                    fidel = fidelity(GS_exc_ES[i, :, k], app_eigenstates[i, :, j])
-                    fidel_sum += fidel
-                fidelity_array[j, i] = fidel_sum
-    return fidelity_array
+    GS_exc_ES = tfim_compare.ground_components(GS_indices, exc_eigenstates)
+    return tfim_compare.subspace_fidelity(GS_exc_ES, GS_exc_eigenvalues, app_eigenstates, app_eigenvalues)
 
 def infidelity_array(fidelity_array):
     return 1 - fidelity_array
@@ -682,24 +631,21 @@ def sigma_z_0(a, input_state_indices, basis):
     return sigma_z_a
 
 
+@tfim_profile.profiled()
 def susceptibility(h_x_range, lattice, basis, exc_eigenvalues, H_0_exc, V_exc, v0, h_z):
     order_param_matrix = np.zeros((len(h_x_range), lattice.N))
     chi_aa_matrix = np.zeros((len(h_x_range), lattice.N))
     E1_arr = np.zeros(len(h_x_range))
+    # sigma^z_a of every site and state, built once for all h_x, a and b
+    sigma_z_table = tfim_system.sigma_z_table(lattice.N).astype(float)
     for i, h_x in enumerate(h_x_range):
         for a in range(lattice.N):
-            sigma_z = np.zeros(basis.M)
-            for ket in range(basis.M):
-                state = basis.state(ket)
-                if state[a] == 1:
-                    sigma_z[ket] += 1
-                else:
-                    sigma_z[ket] -= 1
+            sigma_z = sigma_z_table[a]
             E0 = exc_eigenvalues[i]
-            E1 = spla.eigsh(H_0_exc - V_exc.multiply(h_x) - h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0, maxiter=200,
-                       return_eigenvectors=False)[0]
-            E2 = spla.eigsh(H_0_exc - V_exc.multiply(h_x) - 2. * h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0,
-                            maxiter=200, return_eigenvectors=False)[0]
+            E1 = tfim_solver.eigsh(H_0_exc - V_exc.multiply(h_x) - h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0, maxiter=200,
+                       return_eigenvectors=False, stage='chi_aa', h_x=h_x, a=a)[0]
+            E2 = tfim_solver.eigsh(H_0_exc - V_exc.multiply(h_x) - 2. * h_z * sparse.diags(sigma_z), k=1, which='SA', v0=v0,
+                            maxiter=200, return_eigenvectors=False, stage='chi_aa_2', h_x=h_x, a=a)[0]
             E1_arr[i] = E1
             order_param_matrix[i, a] = (E2 - 4. * E1 + 3. * E0) / (-2. * h_z)
             chi_aa = 2 * (E2 - 2. * E1 + E0) / (2 * h_z ** 2.)
@@ -708,29 +654,17 @@ def susceptibility(h_x_range, lattice, basis, exc_eigenvalues, H_0_exc, V_exc, v
     chi_ab_matrix = np.zeros((len(h_x_range), basis.N, basis.N))
     for i, h_x in enumerate(h_x_range):
         for a in range(lattice.N):
-            sigma_z_a = np.zeros(basis.M)
-            for ket in range(basis.M):
-                state = basis.state(ket)
-                if state[a] == 1:
-                    sigma_z_a[ket] += 1
-                else:
-                    sigma_z_a[ket] -= 1
+            sigma_z_a = sigma_z_table[a]
             for b in range(a + 1, lattice.N, 1):
-                sigma_z_b = np.zeros(basis.M)
-                for ket in range(basis.M):
-                    state = basis.state(ket)
-                    if state[b] == 1:
-                        sigma_z_b[ket] = 1
-                    else:
-                        sigma_z_b[ket] = 1
+                sigma_z_b = sigma_z_table[b]
                 H1 = H_0_exc - V_exc.multiply(h_x) - (sparse.diags(sigma_z_a) + sparse.diags(sigma_z_b)).multiply(h_z)
                 H2 = H_0_exc - V_exc.multiply(h_x) - (sparse.diags(sigma_z_a) + sparse.diags(sigma_z_b)).multiply(
                     2. * h_z)
                 E0 = exc_eigenvalues[i]
-                E1 = spla.eigsh(H1, k=1, which='SA', v0=v0,
-                                maxiter=200, return_eigenvectors=False)[0]
-                E2 = spla.eigsh(H2, k=1, which='SA', v0=v0,
-                           maxiter=200, return_eigenvectors=False)[0]
+                E1 = tfim_solver.eigsh(H1, k=1, which='SA', v0=v0,
+                                maxiter=200, return_eigenvectors=False, stage='chi_ab', h_x=h_x, a=a, b=b)[0]
+                E2 = tfim_solver.eigsh(H2, k=1, which='SA', v0=v0,
+                           maxiter=200, return_eigenvectors=False, stage='chi_ab_2', h_x=h_x, a=a, b=b)[0]
                 chi_ab = (E2 - 2. * E1 + E0) / (2 * (h_z ** 2.)) - 0.5 * (chi_aa_matrix[i, a] + chi_aa_matrix[i, b])
                 chi_ab_matrix[i, a, b] = chi_ab
                 chi_ab_matrix[i, b, a] = chi_ab
@@ -748,101 +682,55 @@ def susceptibility(h_x_range, lattice, basis, exc_eigenvalues, H_0_exc, V_exc, v
 
     return chi_arr, order_param_arr
 
-def energy_gap_longitudinal_1(a, basis, Jij, lower_excitation_states, higher_excitation_states, exponent, h_z):
-    energy_gap = np.zeros((len(lower_excitation_states), len(higher_excitation_states)))
-    sigma_high = sigma_z_0(a, higher_excitation_states, basis)
-    sigma_low = sigma_z_0(a, lower_excitation_states, basis)
-    for i, lower_state_index in enumerate(lower_excitation_states):
-        for j, higher_state_index in enumerate(higher_excitation_states):
-            longitudinal_field_lower = - h_z * sigma_low[i]
-            longitudinal_field_higher = - h_z * sigma_high[j]
-            ground_energy = state_energy(basis, Jij, lower_state_index) + longitudinal_field_lower
-            excited_energy = state_energy(basis, Jij, higher_state_index) + longitudinal_field_higher
-            energy_gap[i, j] = 1./(ground_energy - excited_energy) ** exponent
-    return energy_gap
-
-def energy_gap_longitudinal_2(a, b, basis, Jij, lower_excitation_states, higher_excitation_states, exponent, h_z):
-    energy_gap = np.zeros((len(lower_excitation_states), len(higher_excitation_states)))
-    sigma_high_a = sigma_z_0(a, higher_excitation_states, basis)
-    sigma_low_a = sigma_z_0(a, lower_excitation_states, basis)
-    sigma_high_b = sigma_z_0(b, higher_excitation_states, basis)
-    sigma_low_b = sigma_z_0(b, lower_excitation_states, basis)
-    for i, lower_state_index in enumerate(lower_excitation_states):
-        for j, higher_state_index in enumerate(higher_excitation_states):
-            longitudinal_field_lower = - h_z * (sigma_low_a[i] + sigma_low_b[i])
-            longitudinal_field_higher = - h_z * (sigma_high_a[j] + sigma_high_b[j])
-            ground_energy = state_energy(basis, Jij, lower_state_index) + longitudinal_field_lower
-            excited_energy = state_energy(basis, Jij, higher_state_index) + longitudinal_field_higher
-            energy_gap[i, j] = 1./(ground_energy - excited_energy) ** exponent
-    return energy_gap
-
-def fourth_order_last_term_single(a, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z):
-    H = np.zeros((len(GS_indices), len(GS_indices)))
-    for column, GS_bra_1 in enumerate(GS_indices):
-        state_0 = basis.state(GS_bra_1)
-        sigma_0 = sigma_z_0(a, GS_indices, basis)
-        LE = state_energy(basis, Jij, GS_bra_1) - h_z * sigma_0[column]
-        for i in range(N):
-            basis.flip(state_0, i)
-            state_1_index = basis.index(state_0)
-            if state_1_index in ES_1_indices:
-                sigma_1 = sigma_z_0(a, ES_1_indices, basis)
-                HE = state_energy(basis, Jij, state_1_index) - h_z * sigma_1[np.argwhere(ES_1_indices == state_1_index)]
-                EG_1 = LE - HE
-                for j in range(N):
-                    basis.flip(state_0, j)
-                    state_2_index = basis.index(state_0)
-                    if state_2_index in ES_2_indices:
-                        sigma_2 = sigma_z_0(a, ES_2_indices, basis)
-                        HE = state_energy(basis, Jij, state_2_index) - h_z * sigma_2[np.argwhere(ES_2_indices == state_2_index)]
-                        EG_2 = LE - HE
-                        for k in range(N):
-                            basis.flip(state_0, k)
-                            state_3_index = basis.index(state_0)
-                            if state_3_index in ES_1_indices:
-                                HE = state_energy(basis, Jij, state_3_index) - h_z * sigma_1[np.argwhere(ES_1_indices == state_3_index)]
-                                EG_3 = LE - HE
-                                for l in range(N):
-                                    basis.flip(state_0, l)
-                                    state_4_index = basis.index(state_0)
-                                    if state_4_index in GS_indices:
-                                        row = np.argwhere(np.array(GS_indices) == state_4_index)[0][0]
-                                        H[row, column] += 1./(EG_1 * EG_2 * EG_3)
-                                    basis.flip(state_0, l)
-                            basis.flip(state_0, k)
-                    basis.flip(state_0, j)
-            basis.flip(state_0, i)
-    return H
+def energy_gap_longitudinal_1(a, basis, Jij, lower_excitation_states, higher_excitation_states, exponent, h_z, energy=None):
+    # 1/(E_low - E_high)^exponent with a longitudinal field h_z on site a
+    if energy is None:
+        energy = tfim_matrices.ShellEnergy(basis, Jij, lower_excitation_states)
+    lower_energy = energy.energies(lower_excitation_states) + energy.field(lower_excitation_states, [a], h_z)
+    higher_energy = energy.energies(higher_excitation_states) + energy.field(higher_excitation_states, [a], h_z)
+    return 1./np.subtract.outer(lower_energy, higher_energy) ** exponent
+
+def energy_gap_longitudinal_2(a, b, basis, Jij, lower_excitation_states, higher_excitation_states, exponent, h_z, energy=None):
+    # 1/(E_low - E_high)^exponent with a longitudinal field h_z on sites a and b
+    if energy is None:
+        energy = tfim_matrices.ShellEnergy(basis, Jij, lower_excitation_states)
+    lower_energy = energy.energies(lower_excitation_states) + energy.field(lower_excitation_states, [a, b], h_z)
+    higher_energy = energy.energies(higher_excitation_states) + energy.field(higher_excitation_states, [a, b], h_z)
+    return 1./np.subtract.outer(lower_energy, higher_energy) ** exponent
+
+def fourth_order_last_term_single(a, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z, energy=None):
+    return fourth_order_last_term(basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z, [a], energy)
+
+def fourth_order_last_term_double(a, b, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z, energy=None):
+    return fourth_order_last_term(basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z, [a, b], energy)
+
+def fourth_order_last_term(basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z, sites, energy=None):
+    # GS -> Q1 -> Q2 -> Q1 -> GS paths with a longitudinal field h_z on sites
+    if energy is None:
+        energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices)
+
+    def level(state_index):
+        return energy.energies([state_index])[0] + energy.field([state_index], sites, h_z)[0]
 
-def fourth_order_last_term_double(a, b, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z):
     H = np.zeros((len(GS_indices), len(GS_indices)))
     for column, GS_bra_1 in enumerate(GS_indices):
         state_0 = basis.state(GS_bra_1)
-        sigma_0_a = sigma_z_0(a, GS_indices, basis)
-        sigma_0_b = sigma_z_0(b, GS_indices, basis)
-        LE = state_energy(basis, Jij, GS_bra_1) - h_z * (sigma_0_a + sigma_0_b)[column]
+        LE = level(GS_bra_1)
         for i in range(N):
             basis.flip(state_0, i)
             state_1_index = basis.index(state_0)
             if state_1_index in ES_1_indices:
-                sigma_1_a = sigma_z_0(a, ES_1_indices, basis)
-                sigma_1_b = sigma_z_0(b, ES_1_indices, basis)
-                HE = state_energy(basis, Jij, state_1_index) - h_z * (sigma_1_a + sigma_1_b)[np.argwhere(ES_1_indices == state_1_index)]
-                EG_1 = LE - HE
+                EG_1 = LE - level(state_1_index)
                 for j in range(N):
                     basis.flip(state_0, j)
                     state_2_index = basis.index(state_0)
                     if state_2_index in ES_2_indices:
-                        sigma_2_a = sigma_z_0(a, ES_2_indices, basis)
-                        sigma_2_b = sigma_z_0(b, ES_2_indices, basis)
-                        HE = state_energy(basis, Jij, state_2_index) - h_z * (sigma_2_a + sigma_2_b)[np.argwhere(ES_2_indices == state_2_index)]
-                        EG_2 = LE - HE
+                        EG_2 = LE - level(state_2_index)
                         for k in range(N):
                             basis.flip(state_0, k)
                             state_3_index = basis.index(state_0)
                             if state_3_index in ES_1_indices:
-                                HE = state_energy(basis, Jij, state_3_index) - h_z * (sigma_1_a + sigma_1_b)[np.argwhere(ES_1_indices == state_3_index)]
-                                EG_3 = LE - HE
+                                EG_3 = LE - level(state_3_index)
                                 for l in range(N):
                                     basis.flip(state_0, l)
                                     state_4_index = basis.index(state_0)
@@ -855,10 +743,13 @@ def fourth_order_last_term_double(a, b, basis, Jij, GS_indices, ES_1_indices, ES
             basis.flip(state_0, i)
     return H
 
-def perturb_susceptibility(h_x_range, L, PBC, Jij, GS_indices, h_z):
+def perturb_susceptibility(h_x_range, L, PBC, Jij, GS_indices, h_z, analytic = False, workers = None, threads = None):
     '''
     calculates spin glass susceptibility at low perturbation using perturbation theory, projected fast algorithm but lacking benchmark; like entanglement entropy,
     this algorithm should only be used for low perturbations.
+    with analytic = True, chi and the order parameter come from exact h_z derivatives of the effective Hamiltonian; h_z is then only used
+    where the ground state of the effective Hamiltonian is degenerate
+    with workers set, the finite difference sites and pairs are spread over that many processes, each using threads BLAS threads
     '''
     # initiating output array
     chi_arr_all = []
@@ -867,262 +758,35 @@ def perturb_susceptibility(h_x_range, L, PBC, Jij, GS_indices, h_z):
     lattice = tfim.Lattice(L, PBC)
     N = lattice.N
     basis = tfim.IsingBasis(lattice)
-    GS_energy = state_energy(basis, Jij, GS_indices[0])
+    energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices)
 
-    #########################################################################
-
-    # construct building blocks
-    ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
-    ES_2_indices = tfim_matrices.Hamming_set(basis, ES_1_indices, N, GS_indices)
-
-    # Building blocks matrices
-    PVP = tfim_matrices.PVP(basis, GS_indices, N)
-    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
-    Q1VP = np.transpose(PVQ1)
-    Q1VQ1 = tfim_matrices.Q_1VQ_1(basis, ES_1_indices, GS_indices, N)
-    Q1VQ2 = tfim_matrices.Q_1VQ_2(basis, ES_2_indices, ES_1_indices, GS_indices, N)
-    Q2VQ1 = np.transpose(Q1VQ2)
-
-    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-    EGM_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 2)
-    EGM_13 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 3)
-    EGM_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1)
-    EGM_21 = tfim_matrices.energy_gap(basis, Jij, ES_2_indices, GS_energy, 1)
-
-    # Start building Hamiltonians
-
-    H_0 = H_app_0(GS_energy, GS_indices)
-    H_app_1 = PVP
-    H_app_2 = PVQ1 @ EGM_11 @ Q1VP
-    H_app_3 = -0.5 * (PVP @ PVQ1 @ EGM_12 @ Q1VP + np.transpose(
-        PVP @ PVQ1 @ EGM_12 @ Q1VP)) + PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_11 @ Q1VP
-    H_app_4 = 0.5 * (tfim_matrices.hc(PVQ1 @ EGM_13 @ Q1VP @ PVP @ PVP)) - 0.5 * (
-        tfim_matrices.hc(PVQ1 @ EGM_12 @ Q1VP @ PVQ1 @ EGM_11 @ Q1VP)) - 1. * (
-                  tfim_matrices.hc(PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_12 @ Q1VP @ PVP)) + 1. * (
-                          PVQ1 @ EGM_11 @ Q1VQ2 @ EGM_21 @ Q2VQ1 @ EGM_11 @ Q1VP)
+    # h_z independent skeleton of the 4th order effective Hamiltonian; the
+    # field on each site and pair is applied as a correction to it
+    engine = tfim_susceptibility.Susceptibility(basis, Jij, GS_indices, N, energy)
 
 ##############################################################################
     # construct connectivity matrix
-    conn_matrix = H_0 + H_app_1 + H_app_2 + H_app_3 + H_app_4
-    adj_matrix = np.zeros(np.shape(conn_matrix))
-    for m in range(len(GS_indices)):
-        for n in range(len(GS_indices)):
-            if conn_matrix[m, n] != 0.:
-                adj_matrix[m, n] = 1
-    G = nx.from_numpy_matrix(adj_matrix)
-    connectivity = nx.is_connected(G)
-    print("number of ground states: ", len(GS_indices), 'connected:', connectivity)
+    # ground states are coupled at 4th order within Hamming distance 4
+    components = tfim_connectivity.GroundConnectivity(GS_indices, N)
+    connectivity = components.connected(4)
+    tfim_susceptibility.logger.info('number of ground states: %d connected: %s', len(GS_indices), connectivity)
 ##############################################################################
 
-    chi_arr = np.zeros(len(h_x_range))
-    order_param_arr = np.zeros(len(h_x_range))
     if connectivity:
-        for l, h_x in enumerate(h_x_range):
-            # E0 is the original ground energy without applying the longitudinal field
-            E0 = eigh(H_app_4th(h_x, H_0, H_app_1, H_app_2, H_app_3, H_app_4), eigvals_only = True)[0]
-
-            # calculate chi_aa
-            chi_aa_matrix = np.zeros(lattice.N)
-            order_param_matrix = np.zeros(lattice.N)
-            for a in range(N):
-                '''
-                recalculate effective Hamiltonian as the longitudinal field has caused Ising energy splitting
-                '''
-
-                # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-                EGM_12 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 2, h_z)
-                EGM_13 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 3, h_z)
-                EGM_11 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 1, h_z)
-                EGM_21 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_2_indices, 1, h_z)
-
-                # Start building Hamiltonians
-
-                H_0 = H_app_0(GS_energy, GS_indices)
-                H_app_1 = PVP
-                H_app_2 = (PVQ1 * EGM_11) @ Q1VP
-                H_app_3 = -0.5 * (PVP @ (PVQ1 * EGM_12) @ Q1VP + np.transpose(
-                    PVP @ (PVQ1 * EGM_12) @ Q1VP)) + (PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_11.T * Q1VP)
-                H_app_4 = 0.5 * (tfim_matrices.hc((PVQ1 * EGM_13) @ Q1VP @ PVP @ PVP)) - 0.5 * (
-                    tfim_matrices.hc((PVQ1 * EGM_12) @ Q1VP @ (PVQ1 * EGM_11) @ Q1VP)) - 1. * (tfim_matrices.hc((PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_12.T * Q1VP) @ PVP)) + fourth_order_last_term_single(a, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N)
-
-                # build Pauli matrices
-                sigma_z_a = sigma_z_0(a, GS_indices, basis)
-
-                # calculating susceptibility
-                E1 = eigh(H_app_4th(h_x, H_0 - h_z * sigma_z_a, H_app_1, H_app_2, H_app_3, H_app_4), eigvals_only = True)[0]
-                E2 = eigh(H_app_4th(h_x, H_0 - 2. * h_z * sigma_z_a, H_app_1, H_app_2, H_app_3, H_app_4), eigvals_only = True)[0]
-                order_param = (E2 - 4. * E1 + 3. * E0) / (-2. * h_z)
-                order_param_matrix[a] = order_param
-                chi_aa = 2 * (E2 - 2. * E1 + E0) / (2 * h_z ** 2.)
-                chi_aa_matrix[a] = chi_aa
-                print('chi_aa_matrix ', a, 'completed')
-            # calculate chi_ab
-            chi_ab_matrix = np.zeros((lattice.N, lattice.N))
-            for a in range(lattice.N):
-                for b in range(a + 1, lattice.N, 1):
-                    '''
-                    recalculate effective Hamiltonian as the longitudinal field has caused Ising energy splitting
-                    '''
-                    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-                    EGM_12 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 2, h_z)
-                    EGM_13 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 3, h_z)
-                    EGM_11 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 1, h_z)
-                    EGM_21 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_2_indices, 1, h_z)
-
-                    # Start building Hamiltonians
-
-                    H_0 = H_app_0(GS_energy, GS_indices)
-                    H_app_1 = PVP
-                    H_app_2 = (PVQ1 * EGM_11) @ Q1VP
-                    H_app_3 = -0.5 * (PVP @ (PVQ1 * EGM_12) @ Q1VP + np.transpose(
-                    PVP @ (PVQ1 * EGM_12) @ Q1VP)) + (PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_11.T * Q1VP)
-                    H_app_4 = 0.5 * (tfim_matrices.hc((PVQ1 * EGM_13) @ Q1VP @ PVP @ PVP)) - 0.5 * (
-                        tfim_matrices.hc((PVQ1 * EGM_12) @ Q1VP @ (PVQ1 * EGM_11) @ Q1VP)) - 1. * (tfim_matrices.hc((PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_12.T * Q1VP) @ PVP)) + fourth_order_last_term_double(a, b, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z)
-
-                    # build Pauli matrices
-                    sigma_z_a = sigma_z_0(a, GS_indices, basis)
-                    sigma_z_b = sigma_z_0(b, GS_indices, basis)
-
-                    # calculating suscepbility
-                    H1 = H_app_4th(h_x, H_0 - h_z * (np.diag(sigma_z_a + sigma_z_b)), H_app_1, H_app_2, H_app_3, H_app_4)
-                    H2 = H_app_4th(h_x, H_0 - 2. * h_z * (np.diag(sigma_z_a + sigma_z_b)), H_app_1, H_app_2, H_app_3, H_app_4)
-                    E1 = eigh(H1, eigvals_only = True)[0]
-                    E2 = eigh(H2, eigvals_only = True)[0]
-                    chi_ab = (E2 - 2. * E1 + E0) / (2 * (h_z ** 2.)) - 0.5 * (chi_aa_matrix[a] + chi_aa_matrix[b])
-                    chi_ab_matrix[a, b] = chi_ab
-                    chi_ab_matrix[b, a] = chi_ab
-
-                    print('chi_ab ', a, b, 'completed')
-
-            # adding the diagonal elements
-            for c in range(lattice.N):
-                chi_ab_matrix[c, c] = chi_aa_matrix[c]
-
-            print('h_x = ', h_x, 'completed')
-
-            chi, order_param = np.sum(np.power(chi_ab_matrix, 2.)), abs(np.sum(order_param_matrix))
-            chi_arr[l] = chi
-            order_param_arr[l] = order_param
-
+        nodes = None
+    else:
+        # decoupled GS manifold: work in its largest connected component
+        nodes = components.largest_component(4)
+    if analytic:
+        chi_arr, order_param_arr = engine.analytic_susceptibility(h_x_range, nodes, h_z)
+    elif workers is not None:
+        chi_arr, order_param_arr = tfim_susceptibility.parallel_susceptibility(engine, h_x_range, h_z, nodes, workers,
+                                                                                threads=threads)
     else:
-        C = max(nx.connected_components(G))
-        S = G.subgraph(C)
-        for l, h_x in enumerate(h_x_range):
-            # E0 is the original ground energy without applying the longitudinal field
-            E0 = eigh(H_app_4th(h_x, H_0, H_app_1, H_app_2, H_app_3, H_app_4), eigvals_only = True)[0]
-            # calculate chi_aa
-            chi_aa_matrix = np.zeros(lattice.N)
-            order_param_matrix = np.zeros(lattice.N)
-            for a in range(N):
-                '''
-                recalculate effective Hamiltonian as the longitudinal field has caused Ising energy splitting
-                '''
-                # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-                EGM_12 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 2, h_z)
-                EGM_13 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 3, h_z)
-                EGM_11 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_1_indices, 1, h_z)
-                EGM_21 = energy_gap_longitudinal_1(a, basis, Jij, GS_indices, ES_2_indices, 1, h_z)
-
-                # Start building Hamiltonians
-
-                H_0 = H_app_0(GS_energy, GS_indices)
-                H_app_1 = PVP
-                H_app_2 = (PVQ1 * EGM_11) @ Q1VP
-                H_app_3 = -0.5 * (PVP @ (PVQ1 * EGM_12) @ Q1VP + np.transpose(
-                    PVP @ (PVQ1 * EGM_12) @ Q1VP)) + (PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_11.T * Q1VP)
-                H_app_4 = 0.5 * (tfim_matrices.hc((PVQ1 * EGM_13) @ Q1VP @ PVP @ PVP)) - 0.5 * (
-                        tfim_matrices.hc((PVQ1 * EGM_12) @ Q1VP @ (PVQ1 * EGM_11) @ Q1VP)) - 1. * (tfim_matrices.hc((PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_12.T * Q1VP) @ PVP)) + fourth_order_last_term_single(a, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z)
-
-                # build Pauli matrices
-                sigma_z_a = sigma_z_0(a, GS_indices, basis)
-
-                # effective Hamiltonian under longitudinal field
-
-                H1 = H_app_4th(h_x, H_0 - h_z * sigma_z_a, H_app_1, H_app_2, H_app_3, H_app_4)
-                H2 = H_app_4th(h_x, H_0 - 2. * h_z * sigma_z_a, H_app_1, H_app_2, H_app_3, H_app_4)
-                # create new weighted adj_matrix (decoupled GS manifold)
-                nodes = S.nodes()
-                num_nodes = len(nodes)
-                decoupled1 = np.zeros((num_nodes, num_nodes))
-                decoupled2 = np.zeros((num_nodes, num_nodes))
-                for p, node_index_1 in enumerate(nodes):
-                    for q, node_index_2 in enumerate(nodes):
-                        decoupled1[p, q] = H1[node_index_1, node_index_2]
-                        decoupled2[p, q] = H2[node_index_1, node_index_2]
-
-                # calculating susceptibility
-                E1 = eigh(decoupled1, eigvals_only = True)[0]
-                E2 = eigh(decoupled2, eigvals_only = True)[0]
-                order_param = (E2 - 4. * E1 + 3. * E0) / (-2. * h_z)
-                order_param_matrix[a] = order_param
-                chi_aa = 2 * (E2 - 2. * E1 + E0) / (2 * h_z ** 2.)
-                chi_aa_matrix[a] = chi_aa
-
-                print('chi_aa ', a, 'completed')
-
-
-            # calculate chi_ab
-            chi_ab_matrix = np.zeros((lattice.N, lattice.N))
-            for a in range(lattice.N):
-                for b in range(a + 1, lattice.N, 1):
-                    '''
-                    recalculate effective Hamiltonian as the longitudinal field has caused Ising energy splitting
-                    '''
-                    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-                    EGM_12 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 2, h_z)
-                    EGM_13 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 3, h_z)
-                    EGM_11 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_1_indices, 1, h_z)
-                    EGM_21 = energy_gap_longitudinal_2(a, b, basis, Jij, GS_indices, ES_2_indices, 1, h_z)
-
-                    # Start building Hamiltonians
-
-                    H_0 = H_app_0(GS_energy, GS_indices)
-
-                    H_app_1 = PVP
-
-                    H_app_2 = (PVQ1 * EGM_11) @ Q1VP
-
-                    H_app_3 = -0.5 * (PVP @ (PVQ1 * EGM_12) @ Q1VP + np.transpose(
-                    PVP @ (PVQ1 * EGM_12) @ Q1VP)) + (PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_11.T * Q1VP)
-
-                    H_app_4 = 0.5 * (tfim_matrices.hc((PVQ1 * EGM_13) @ Q1VP @ PVP @ PVP)) - 0.5 * (
-                        tfim_matrices.hc((PVQ1 * EGM_12) @ Q1VP @ (PVQ1 * EGM_11) @ Q1VP)) - 1. * (tfim_matrices.hc((PVQ1 * EGM_11) @ Q1VQ1 @ (EGM_12.T * Q1VP) @ PVP)) + fourth_order_last_term_double(a, b, basis, Jij, GS_indices, ES_1_indices, ES_2_indices, N, h_z)
-                    # build Pauli matrices
-                    sigma_z_a = sigma_z_0(a, GS_indices, basis)
-                    sigma_z_b = sigma_z_0(b, GS_indices, basis)
-
-                    # calculating suscepbility
-                    H1 = H_app_4th(h_x, H_0 - h_z * (np.diag(sigma_z_a + sigma_z_b)), H_app_1, H_app_2, H_app_3, H_app_4)
-                    H2 = H_app_4th(h_x, H_0 - 2. * h_z * (np.diag(sigma_z_a + sigma_z_b)), H_app_1, H_app_2, H_app_3, H_app_4)
-
-                    # create new weighted adj_matrix (decoupled GS manifold)
-                    nodes = S.nodes()
-                    num_nodes = len(nodes)
-                    decoupled1 = np.zeros((num_nodes, num_nodes))
-                    decoupled2 = np.zeros((num_nodes, num_nodes))
-                    for p, node_index_1 in enumerate(nodes):
-                        for q, node_index_2 in enumerate(nodes):
-                            decoupled1[p, q] = H1[node_index_1, node_index_2]
-                            decoupled2[p, q] = H2[node_index_1, node_index_2]
-                    E1 = eigh(H1, eigvals_only = True)[0]
-                    E2 = eigh(H2, eigvals_only = True)[0]
-                    chi_ab = (E2 - 2. * E1 + E0) / (2 * (h_z ** 2.)) - 0.5 * (chi_aa_matrix[a] + chi_aa_matrix[b])
-                    chi_ab_matrix[a, b] = chi_ab
-                    chi_ab_matrix[b, a] = chi_ab
-
-                    print('chi_ab ',  a, b, 'completed')
-            # adding the diagonal elements
-            for c in range(lattice.N):
-                chi_ab_matrix[c, c] = chi_aa_matrix[c]
-
-            print('h_x = ', h_x, 'completed')
-
-            chi, order_param = np.sum(np.power(chi_ab_matrix, 2.)), abs(np.sum(order_param_matrix))
-            chi_arr[l] = chi
-            order_param_arr[l] = order_param
-
-        chi_arr_all.append(chi_arr)
-        order_param_all.append(order_param_arr)
+        chi_arr, order_param_arr = engine.susceptibility(h_x_range, h_z, nodes)
+
+    chi_arr_all.append(chi_arr)
+    order_param_all.append(order_param_arr)
 
     chi_arr_ave = np.mean(chi_arr_all, axis = 0)
     order_param_ave = np.mean(order_param_all, axis = 0)
@@ -1131,51 +795,10 @@ def perturb_susceptibility(h_x_range, L, PBC, Jij, GS_indices, h_z):
 
 def is_connected(basis, Jij, GS_indices, GS_energy, N):
     '''
-    draft function: lacking computational efficiency, but checks if the ground manifold is connected at fourth order perturbation theory
+    checks if the ground manifold is connected at fourth order perturbation theory, i.e. by chains of ground states
+    at Hamming distance 4 or less
     '''
-    # Building block matrices
-    ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
-    ES_2_indices = tfim_matrices.Hamming_set(basis, ES_1_indices, N, GS_indices)
-
-    # Building blocks matrices
-    PVP = tfim_matrices.PVP(basis, GS_indices, N)
-    PVQ1 = tfim_matrices.PVQ_1(basis, GS_indices, ES_1_indices, N)
-    Q1VP = np.transpose(PVQ1)
-    Q1VQ1 = tfim_matrices.Q_1VQ_1(basis, ES_1_indices, GS_indices, N)
-    Q1VQ2 = tfim_matrices.Q_1VQ_2(basis, ES_2_indices, ES_1_indices, GS_indices, N)
-    Q2VQ1 = np.transpose(Q1VQ2)
-
-    # energy_gap_matrix_12 (EGM) denotes 1/(E_0-QH_0Q)^2 from Q1 to Q1
-    EGM_12 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 2)
-    EGM_13 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 3)
-    EGM_11 = tfim_matrices.energy_gap(basis, Jij, ES_1_indices, GS_energy, 1)
-    EGM_21 = tfim_matrices.energy_gap(basis, Jij, ES_2_indices, GS_energy, 1)
-
-    # Start building Hamiltonians
-
-    H_0 = H_app_0(GS_energy, GS_indices)
-
-    H_app_1 = PVP
-
-    H_app_2 = PVQ1 @ EGM_11 @ Q1VP
-
-    H_app_3 = -0.5 * (PVP @ PVQ1 @ EGM_12 @ Q1VP + np.transpose(
-        PVP @ PVQ1 @ EGM_12 @ Q1VP)) + PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_11 @ Q1VP
-
-    H_app_4 = 0.5 * (tfim_matrices.hc(PVQ1 @ EGM_13 @ Q1VP @ PVP @ PVP)) - 0.5 * (
-        tfim_matrices.hc(PVQ1 @ EGM_12 @ Q1VP @ PVQ1 @ EGM_11 @ Q1VP)) - 1. * (
-                  tfim_matrices.hc(PVQ1 @ EGM_11 @ Q1VQ1 @ EGM_12 @ Q1VP @ PVP)) + 1. * (
-                          PVQ1 @ EGM_11 @ Q1VQ2 @ EGM_21 @ Q2VQ1 @ EGM_11 @ Q1VP)
-
-    # construct connectivity matrix
-    conn_matrix = H_0 + H_app_1 + H_app_2 + H_app_3 + H_app_4
-    adj_matrix = np.zeros(np.shape(conn_matrix))
-    for m in range(len(GS_indices)):
-        for n in range(len(GS_indices)):
-            if conn_matrix[m, n] != 0.:
-                adj_matrix[m, n] = 1
-    G = nx.from_numpy_matrix(adj_matrix)
-    connectivity = nx.is_connected(G)
+    connectivity = tfim_connectivity.GroundConnectivity(GS_indices, N).connected(4)
     print("number of ground states: ", len(GS_indices), 'connected:', connectivity)
 
     return connectivity
\ No newline at end of file
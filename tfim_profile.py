@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+""""tfim_profile.py
+    --Stage timers for the drivers: "with tfim_profile.stage('solve',
+        h_x=h_x):" records the calls, time and memory of the stage under
+        its path, e.g. 'operators' or 'susceptibility/solve'
+    --off by default, where stage() returns one shared no-op context; on
+        with TFIM_PROFILE=1 in the environment (TFIM_PROFILE=memory adds
+        tracemalloc peaks) or --profile / --profile-memory on the drivers
+    --rss is the peak resident memory of the process (ru_maxrss) at the
+        end of a stage and rss_growth how far the stage raised it; traced
+        is the tracemalloc peak of a stage above its start
+    --profiles are written as JSON next to the outputs of a run:
+        {metadata, stages: {path: totals}, calls: [labelled calls]}
+    --Requires: resource (optional)
+"""
+
+import contextlib
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variable switching the profiler on: 1 (time and RSS) or memory
+ENVIRONMENT = 'TFIM_PROFILE'
+
+_NULL = contextlib.nullcontext()
+
+###############################################################################
+def peak_rss():
+    # Peak resident memory of this process in bytes, 0 without resource
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else 1024*peak
+
+class _Stage:
+    # One open stage of a Profiler
+
+    def __init__(self, profiler, name, labels):
+        self.profiler = profiler
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        profiler = self.profiler
+        profiler._fold()
+        self.path = '/'.join([stage.name for stage in profiler._open] + [self.name])
+        self.traced = tracemalloc.get_traced_memory()[0] if profiler.memory else 0
+        self.peak = self.traced
+        self.rss = peak_rss()
+        profiler._open.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler._fold()
+        profiler._open.pop()
+        rss = peak_rss()
+        entry = profiler.stages.setdefault(self.path, {'calls': 0, 'time': 0., 'max_time': 0., 'rss': 0,
+                                                       'rss_growth': 0, 'traced': 0})
+        entry['calls'] += 1
+        entry['time'] += elapsed
+        entry['max_time'] = max(entry['max_time'], elapsed)
+        entry['rss'] = max(entry['rss'], rss)
+        entry['rss_growth'] += rss - self.rss
+        entry['traced'] = max(entry['traced'], self.peak - self.traced)
+        if self.labels:
+            call = {'stage': self.path, 'time': elapsed}
+            call.update(self.labels)
+            profiler.calls.append(call)
+        return False
+
+class Profiler:
+    """Totals per stage path and the labelled calls of one process
+
+        --stage(name, **labels) is a no-op context unless enabled
+        --capture() collects the stages of a block (e.g. one seed) as a
+            separate snapshot and folds them back into this profiler"""
+
+    def __init__(self, enabled=False, memory=False):
+        self.enabled = False
+        self.memory = False
+        self.reset()
+        if enabled:
+            self.enable(memory)
+
+    def reset(self):
+        self.stages = {}
+        self.calls = []
+        self._open = []
+
+    def enable(self, memory=False):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+        self.memory = False
+
+    def stage(self, name, **labels):
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name, labels)
+
+    def _fold(self):
+        # Passes the tracemalloc peak since the last fold to the open stages
+        if not self.memory or not self._open:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage in self._open:
+            stage.peak = max(stage.peak, peak)
+        tracemalloc.reset_peak()
+
+    def snapshot(self):
+        return {'stages': {path: dict(entry) for path, entry in self.stages.items()},
+                'calls': list(self.calls)}
+
+    def merge(self, snapshot):
+        """Adds the stages and calls of a snapshot, e.g. from a worker"""
+        for path, entry in snapshot['stages'].items():
+            total = self.stages.setdefault(path, {'calls': 0, 'time': 0., 'max_time': 0., 'rss': 0,
+                                                  'rss_growth': 0, 'traced': 0})
+            for key in ('calls', 'time', 'rss_growth'):
+                total[key] += entry[key]
+            for key in ('max_time', 'rss', 'traced'):
+                total[key] = max(total[key], entry[key])
+        self.calls.extend(snapshot['calls'])
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Yields a dict that holds the snapshot of the block on exit"""
+        captured = {}
+        if not self.enabled:
+            yield captured
+            return
+        stages, calls = self.stages, self.calls
+        self.stages, self.calls = {}, []
+        try:
+            yield captured
+        finally:
+            captured.update(self.snapshot())
+            self.stages, self.calls = stages, calls
+            self.merge(captured)
+
+    def write(self, filename, metadata=None, **sections):
+        """Writes the profile as JSON, with the metadata and any further
+            top level sections given"""
+        metadata = dict(metadata or {}, python=platform.python_version(), host=platform.node(), pid=os.getpid(),
+                        date=time.strftime('%Y-%m-%d %H:%M:%S'))
+        profile = {'metadata': metadata}
+        profile.update(self.snapshot())
+        profile.update(sections)
+        with open(filename, 'w') as f:
+            json.dump(profile, f, indent=1)
+        return filename
+
+###############################################################################
+# Profiler of this process, configured from the environment
+
+PROFILER = Profiler(os.environ.get(ENVIRONMENT, '') not in ('', '0'),
+                    os.environ.get(ENVIRONMENT, '') == 'memory')
+
+def stage(name, **labels):
+    """Context timing stage name of the process profiler"""
+    return PROFILER.stage(name, **labels)
+
+def profiled(name=None):
+    """Decorator running the function as a stage (its name by default)"""
+    def decorate(function):
+        stage_name = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def enabled():
+    return PROFILER.enabled
+
+def enable(memory=False):
+    """Switches on the process profiler and, through the environment, that
+        of the worker processes started afterwards"""
+    os.environ[ENVIRONMENT] = 'memory' if memory else '1'
+    PROFILER.enable(memory)
+
+def add_arguments(parser):
+    """Adds --profile and --profile-memory to an argparse parser"""
+    parser.add_argument('--profile', action='store_true', help='Write a JSON profile of the stages next to the output')
+    parser.add_argument('--profile-memory', action='store_true', help='Profile with tracemalloc peaks (slower)')
+
+def from_arguments(args):
+    """Enables the profiler if --profile or --profile-memory is given"""
+    if args.profile or args.profile_memory:
+        enable(args.profile_memory)
+    return PROFILER.enabled
+
+def write(filename, **metadata):
+    """Writes the process profile to filename if profiling is on"""
+    if PROFILER.enabled:
+        return PROFILER.write(filename, metadata)
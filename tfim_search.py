@@ -4,12 +4,13 @@
     Tao You
     07.02/2020
     --Search for second order perturbation theory approximable Jij matrices
-    --Requires: tfim.py, numpy, scipy.sparse, scipy.linalg, progressbar
+    --Requires: tfim.py, tfim_classical.py, numpy, scipy.sparse, scipy.linalg, progressbar
 """
 
 import tfim
 import tfim_perturbation
 import tfim_rdm
+import tfim_classical
 import numpy as np
 from scipy import sparse
 from scipy.sparse import linalg as spla
@@ -57,17 +58,11 @@ def main():
     Jij_array = [];
 
     for i in seed_range:
-        Jij = tfim.Jij_instance(N,J,"bimodal",i) 
+        Jij = tfim.Jij_instance(N,J,"bimodal",i,False) 
         Jij_array.append(Jij)
         
-    # Calculate energy array:
-    indices_array = []
-
-    for Jij in Jij_array:
-        Energies = -tfim.JZZ_SK_ME(basis,Jij)
-        GS_energy = np.min(Energies)
-        GS_indices = np.nonzero(Energies == GS_energy)[0]
-        indices_array.append(GS_indices)
+    # Ground states of every seed from one batched energy table
+    GS_energies, indices_array = tfim_classical.ground_states(Jij_array, N)
     
     # Search for Hamming distance 2
     seed_list = []
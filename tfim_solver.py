@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+""""tfim_solver.py
+    --eigsh with telemetry: every call records its matvecs (counted
+        through a LinearOperator shim), the ARPACK restart iterations, the
+        largest residual norm ||H v - E v|| of the returned pairs and
+        whether it converged, with the labels the caller gives (stage,
+        h_x, site, ...)
+    --records go to the process Telemetry (TELEMETRY) and are written as
+        a sidecar table next to the outputs, e.g. <o>_solver.dat, so the
+        seeds and h points that need tighter settings can be found
+    --the iteration count comes from scipy's ARPACK driver
+        (_SymmetricArpackParams), which gives results identical to
+        spla.eigsh; where it is unavailable or does not take the
+        keywords of scipy 1.x, the calls go through spla.eigsh and the
+        iterations are not recorded
+    --IsingOperator applies diag(E) - h_x sum_i sigma^x_i without storing
+        it, in the full basis or in a spin flip sector (sector_eigsh)
+    --plan() estimates the memory and time of dense eigh, CSR eigsh, the
+        matrix-free operator, the spin flip sectors and the perturbative
+        effective Hamiltonian, picks the fastest that fits in memory and
+        raises MemoryError with its report before anything is allocated
+        when none does
+    --Requires: tfim_parallel.py, numpy, scipy
+"""
+
+import contextlib
+import importlib
+import os
+import time
+import numpy as np
+from scipy.sparse import linalg as spla
+import tfim_parallel
+
+try:
+    _arpack = importlib.import_module('scipy.sparse.linalg._eigen.arpack.arpack')
+    _SymmetricArpackParams = _arpack._SymmetricArpackParams
+except (ImportError, AttributeError):
+    _SymmetricArpackParams = None
+
+# Columns of the telemetry tables after the labels
+COLUMNS = ('k', 'which', 'tol', 'maxiter', 'ncv', 'matvecs', 'iterations', 'nconv', 'converged', 'residual', 'time')
+
+###############################################################################
+class Telemetry:
+    """The eigsh records of one process
+
+        --residuals computes ||H v - E v|| of every returned pair, asking
+            ARPACK for the eigenvector of k = 1 calls that do not return it
+            (for k > 1 that would change the order of the eigenvalues)
+        --capture() moves the records of a block (e.g. one seed) out of
+            the process log, so long campaigns do not accumulate them"""
+
+    def __init__(self, residuals=True):
+        self.residuals = residuals
+        self.records = []
+
+    def reset(self):
+        self.records = []
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Yields a list that holds the records of the block on exit"""
+        captured = []
+        records = self.records
+        self.records = captured
+        try:
+            yield captured
+        finally:
+            self.records = records
+
+    def failures(self):
+        return [record for record in self.records if not record['converged']]
+
+    def summary(self, records=None):
+        """Returns the calls, total matvecs and iterations, failures and the
+            largest residual of the records"""
+        records = self.records if records is None else records
+        iterations = [record['iterations'] for record in records if record['iterations'] is not None]
+        residuals = [record['residual'] for record in records if record['residual'] is not None]
+        return {'calls': len(records), 'matvecs': sum(record['matvecs'] for record in records),
+                'iterations': sum(iterations) if iterations else None,
+                'failures': sum(not record['converged'] for record in records),
+                'max_residual': max(residuals) if residuals else None}
+
+    def write(self, filename, records=None, header=''):
+        """Writes the records as a whitespace table with a # header line of
+            column names, readable with np.genfromtxt(filename, names=True,
+            dtype=None, encoding=None)"""
+        records = self.records if records is None else records
+        labels = []
+        for record in records:
+            for key in record:
+                if key not in COLUMNS and key not in labels:
+                    labels.append(key)
+        columns = labels + list(COLUMNS)
+        with open(filename, 'w') as f:
+            if header:
+                f.write('# {}\n'.format(header))
+            f.write('# ' + ' '.join(columns) + '\n')
+            for record in records:
+                f.write(' '.join(_format(record.get(column)) for column in columns) + '\n')
+        return filename
+
+def _format(value):
+    if value is None:
+        return 'nan'
+    if isinstance(value, (bool, np.bool_)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return '{:.6e}'.format(value)
+    return str(value)
+
+# Telemetry of this process
+TELEMETRY = Telemetry()
+
+###############################################################################
+def _arpack_params(n, k, dtype, matvec, ncv, v0, maxiter, which, tol):
+    # The ARPACK driver of spla.eigsh in mode 1, None where this scipy does
+    # not provide it with these keywords, so that eigsh falls back to
+    # spla.eigsh instead of binding the wrong parameters
+    if _SymmetricArpackParams is None:
+        return None
+    try:
+        return _SymmetricArpackParams(n, k, dtype.char, matvec, mode=1, ncv=ncv, v0=v0, maxiter=maxiter,
+                                      which=which, tol=tol)
+    except TypeError:
+        return None
+
+def eigsh(A, k=6, which='LM', v0=None, ncv=None, maxiter=None, tol=0, return_eigenvectors=True, **labels):
+    """spla.eigsh(A, k, which, v0, ncv, maxiter, tol, return_eigenvectors)
+        that records its telemetry with the labels given
+
+        --raises ArpackNoConvergence as spla.eigsh does, after recording
+            the failure"""
+    n = A.shape[0]
+    record = dict(labels)
+    record.update(k=k, which=which, tol=tol, maxiter=maxiter, ncv=None, matvecs=0, iterations=None, nconv=None,
+                  converged=True, residual=None)
+    TELEMETRY.records.append(record)
+    vectors = return_eigenvectors or (TELEMETRY.residuals and k == 1)
+
+    def matvec(x):
+        record['matvecs'] += 1
+        return A @ x
+
+    start = time.perf_counter()
+    try:
+        params = _arpack_params(n, k, A.dtype, matvec, ncv, v0, maxiter, which, tol) if k < n - 1 else None
+        if params is None:
+            # spla.eigsh, which solves small problems densely
+            result = spla.eigsh(spla.LinearOperator(A.shape, matvec=matvec, dtype=A.dtype), k=k, which=which,
+                                v0=v0, ncv=ncv, maxiter=maxiter, tol=tol, return_eigenvectors=vectors)
+        else:
+            record['ncv'] = params.ncv
+            try:
+                while not params.converged:
+                    params.iterate()
+            finally:
+                record['iterations'] = params.arpack_dict['iter']
+                record['nconv'] = params.arpack_dict['nconv']
+            result = params.extract(vectors)
+    except spla.ArpackNoConvergence:
+        record['converged'] = False
+        raise
+    finally:
+        record['time'] = time.perf_counter() - start
+
+    if not vectors:
+        return result
+    E, v = result
+    if TELEMETRY.residuals:
+        record['residual'] = float(np.max(np.linalg.norm(A @ v - v*E, axis=0)))
+    return result if return_eigenvectors else E
+
+###############################################################################
+# Matrix-free operators
+
+class TransverseField(spla.LinearOperator):
+    """sum_i sigma^x_i on N spins (site i is bit N-1-i of the state index),
+        applied by flipping axes of the state vector instead of storing the
+        N 2^N entries of tfim.build_Mx
+
+        --with parity = +1 or -1 it acts on the spin flip sector of that
+            parity, whose 2^(N-1) states are (|r> + parity |~r>)/sqrt(2)
+            for the indices r with site 0 down"""
+
+    def __init__(self, N, parity=None):
+        self.N = N
+        self.parity = parity
+        M = 2**N if parity is None else 2**(N - 1)
+        super().__init__(np.dtype(np.float64), (M, M))
+
+    def _matvec(self, x):
+        x = np.asarray(x, dtype=np.float64).reshape(-1)
+        y = np.zeros_like(x)
+        first = 0 if self.parity is None else 1
+        for i in range(first, self.N):
+            y.reshape(2**(i - first), 2, -1)[:] += x.reshape(2**(i - first), 2, -1)[:, ::-1, :]
+        if self.parity is not None:
+            # flipping site 0 maps r to the complement of 2^(N-1) - 1 - r
+            y += self.parity*x[::-1]
+        return y
+
+    def _adjoint(self):
+        return self
+
+    def expand(self, x):
+        """Returns the states of the sector (columns of x) in the full basis"""
+        if self.parity is None:
+            return x
+        return np.concatenate((x, self.parity*x[::-1]), axis=0)/np.sqrt(2)
+
+    def restrict(self, x):
+        """Returns the projection of the full basis state x on the sector,
+            None if it has no weight there"""
+        if self.parity is None:
+            return x
+        half = x.shape[0]//2
+        y = (x[:half] + self.parity*x[::-1][:half])/np.sqrt(2)
+        return y if np.linalg.norm(y) > 1e-8 else None
+
+class IsingOperator(spla.LinearOperator):
+    """H = diag(diagonal) - h_x sum_i sigma^x_i without storing H, where
+        the diagonal holds the 2^N classical energies (e.g. -JZZ)
+
+        --with parity, H in that spin flip sector; the diagonal must then
+            be symmetric under flipping all spins (no longitudinal field)"""
+
+    def __init__(self, diagonal, h_x, parity=None):
+        N = int(np.log2(len(diagonal)))
+        self.field = TransverseField(N, parity)
+        self.diagonal = diagonal if parity is None else diagonal[:len(diagonal)//2]
+        self.h_x = h_x
+        super().__init__(np.dtype(np.float64), self.field.shape)
+
+    def _matvec(self, x):
+        x = np.asarray(x, dtype=np.float64).reshape(-1)
+        return self.diagonal*x - self.h_x*self.field._matvec(x)
+
+    def _adjoint(self):
+        return self
+
+def sector_eigsh(diagonal, h_x, k=6, which='SA', v0=None, ncv=None, maxiter=None, tol=0, **labels):
+    """The k lowest eigenpairs of IsingOperator(diagonal, h_x) from k in each
+        spin flip sector, with the eigenvectors in the full basis
+
+        --v0 is a full basis vector, projected on each sector"""
+    pairs = []
+    for parity in (1, -1):
+        H = IsingOperator(diagonal, h_x, parity)
+        v0_sector = None if v0 is None else H.field.restrict(v0)
+        E, v = eigsh(H, k=min(k, H.shape[0] - 1), which=which, v0=v0_sector, ncv=ncv, maxiter=maxiter, tol=tol,
+                     parity=parity, **labels)
+        pairs.extend((E[j], H.field.expand(v[:, j])) for j in range(len(E)))
+    pairs.sort(key=lambda pair: pair[0])
+    pairs = pairs[:k]
+    return np.array([E for E, _ in pairs]), np.column_stack([v for _, v in pairs])
+
+###############################################################################
+# Planner
+
+# Strategies of the planner, in order of preference at equal cost
+STRATEGIES = ('dense', 'sparse', 'matrix_free', 'sectors', 'perturbative')
+
+# Rough costs on one core in seconds; the planner only needs their order of
+# magnitude
+COSTS = {'diagonal': 1e-5,      # per state, one python loop diagonal (tfim.z_correlations_NN)
+         'build': 4e-6,         # per state and site, tfim.build_Mx
+         'convert': 2e-8,       # per state and site, -JZZ - h*Mx as CSR for each h
+         'eigh': 1.3e-10,       # per M^3, linalg.eigh
+         'csr': 6e-10,          # per stored entry, one CSR matvec
+         'flip': 4e-10,         # per state and site, one matrix-free matvec
+         'call': 1.5e-6}        # per numpy call of a matvec
+
+# Typical matvecs of one eigsh solve
+MATVECS = 150
+
+# Fraction of the memory a plan may use
+MEMORY_FRACTION = 0.8
+
+# Largest h_x / J where the perturbative effective Hamiltonian is trusted
+PERTURBATIVE_H = 0.1
+
+# Reason of the strategies above the memory; the others cannot be used at all
+DOES_NOT_FIT = 'does not fit'
+
+class Estimate:
+    """Memory (bytes) and time (seconds) of one strategy, with the reason it
+        cannot be used (None if it can)"""
+
+    def __init__(self, strategy, memory, time, reason=None):
+        self.strategy = strategy
+        self.memory = memory
+        self.time = time
+        self.reason = reason
+
+def estimate(strategy, N, k=3, solves=1, diagonals=1, cores=1):
+    """Returns the Estimate of strategy for solves eigensolves of k states
+        on N spins, keeping diagonals python-built diagonal matrices"""
+    # floats, as 2^(2N) overflows integers for the dense estimate
+    M = 2.**N
+    ncv = max(2*k + 1, 20)
+    base_memory = 16*M*diagonals
+    base_time = COSTS['diagonal']*M*diagonals
+    # CSR of -JZZ - h Mx and the COO arrays of tfim.build_Mx
+    csr_memory = 70*M*N
+    csr_time = COSTS['build']*M*N + solves*COSTS['convert']*M*N
+    if strategy == 'dense':
+        return Estimate(strategy, base_memory + csr_memory + 24*M**2,
+                        base_time + csr_time + solves*COSTS['eigh']*M**3/cores)
+    if strategy == 'sparse':
+        return Estimate(strategy, base_memory + csr_memory + 8*M*(ncv + 4),
+                        base_time + csr_time + solves*MATVECS*(COSTS['csr']*M*(N + 1) + COSTS['call']))
+    if strategy == 'matrix_free':
+        return Estimate(strategy, base_memory + 8*M*(ncv + 7),
+                        base_time + solves*MATVECS*(COSTS['flip']*M*N + COSTS['call']*N))
+    if strategy == 'sectors':
+        # k states in each sector, expanded to the full basis
+        return Estimate(strategy, base_memory + 8*M*(ncv/2 + 5 + 2*k),
+                        base_time + 2*solves*MATVECS*(COSTS['flip']*M*N/2 + COSTS['call']*N))
+    if strategy == 'perturbative':
+        return Estimate(strategy, base_memory + 16*M, base_time)
+    raise ValueError('Unknown strategy {}'.format(strategy))
+
+class Plan:
+    """The estimates of every strategy and the one chosen"""
+
+    def __init__(self, N, k, solves, memory, estimates, strategy, why):
+        self.N = N
+        self.k = k
+        self.solves = solves
+        self.memory = memory
+        self.estimates = estimates
+        self.strategy = strategy
+        self.why = why
+
+    def report(self):
+        memory = 'unknown memory' if self.memory is None else '{} memory ({:.0f}% usable)'.format(
+            _bytes(self.memory), 100*MEMORY_FRACTION)
+        lines = ['Solver plan for N = {}, k = {}, {} solves, {}:'.format(self.N, self.k, self.solves, memory)]
+        for e in self.estimates:
+            lines.append('  {} {:<13} memory {:>10}  time {:>10}  {}'.format(
+                '*' if e.strategy == self.strategy else ' ', e.strategy, _bytes(e.memory),
+                '{:.2g} s'.format(e.time), e.reason or 'ok'))
+        lines.append('Chosen: {} ({})'.format(self.strategy, self.why) if self.strategy else
+                     'No strategy: {}'.format(self.why))
+        return '\n'.join(lines)
+
+def _bytes(n):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if n < 1024 or unit == 'TiB':
+            return '{:.3g} {}'.format(n, unit)
+        n /= 1024.
+
+def plan(N, k=3, solves=1, h_max=None, h_z=0., memory=None, cores=None, strategies=STRATEGIES, diagonals=1,
+         strategy=None, perturbative_h=PERTURBATIVE_H):
+    """Estimates every strategy and returns the Plan with the fastest one
+        that fits in MEMORY_FRACTION of memory (physical memory by default)
+
+        --strategies are those the caller can run; strategy forces one
+        --sectors need h_z = 0 and perturbative needs h_max <= perturbative_h
+        --raises MemoryError with the report when the chosen or forced
+            strategy does not fit, before anything 2^N is allocated, and
+            ValueError when the forced strategy is unknown or cannot be
+            used here"""
+    if strategy is not None and strategy not in STRATEGIES:
+        raise ValueError('Unknown strategy {}, expected one of {}'.format(strategy, ', '.join(STRATEGIES)))
+    if memory is None:
+        memory = tfim_parallel.physical_memory()
+    cores = cores or os.cpu_count() or 1
+    usable = None if memory is None else MEMORY_FRACTION*memory
+    estimates = []
+    for name in STRATEGIES:
+        e = estimate(name, N, k, solves, diagonals, cores)
+        if name not in strategies:
+            e.reason = 'not supported here'
+        elif name == 'sectors' and h_z != 0:
+            e.reason = 'h_z = {} breaks the spin flip symmetry'.format(h_z)
+        elif name == 'perturbative' and (h_max is None or h_max > perturbative_h):
+            e.reason = 'h_max = {} above the perturbative range {}'.format(h_max, perturbative_h)
+        elif usable is not None and e.memory > usable:
+            e.reason = DOES_NOT_FIT
+        estimates.append(e)
+
+    if strategy is not None:
+        chosen = [e for e in estimates if e.strategy == strategy]
+        why = 'requested'
+    else:
+        chosen = sorted([e for e in estimates if e.reason is None], key=lambda e: e.time)[:1]
+        why = 'fastest that fits'
+    if not chosen or chosen[0].reason is not None:
+        if chosen:
+            why = '{} {}'.format(strategy, chosen[0].reason)
+        else:
+            why = 'none fits in {}'.format(_bytes(usable)) if usable is not None else 'none can be used'
+        result = Plan(N, k, solves, memory, estimates, None, why)
+        if chosen and chosen[0].reason != DOES_NOT_FIT:
+            raise ValueError(result.report())
+        raise MemoryError(result.report())
+    return Plan(N, k, solves, memory, estimates, chosen[0].strategy, why)
@@ -24,7 +24,7 @@ import tfim_perturbation.tfim as tfim
 import tfim_perturbation.tfim_perturbation as perturbation
 import numpy as np
 from scipy.optimize import curve_fit
-import networkx as nx
+import tfim_perturbation.tfim_connectivity as connectivity
 
 # range of J_ij seeds
 seed_range = range(10)
@@ -41,11 +41,13 @@ def power_law(x, A, b):
     return A*np.power(x, b)
 
 # define analysis function
-def tfim_analysis(L, Jij_seed, perturbation_order, h_x_range = np.arange(0, 0.005, 0.0001), PBC = True, J = 1):
+def tfim_analysis(L, Jij_seed, perturbation_order, h_x_range = np.arange(0, 0.005, 0.0001), PBC = True, J = 1,
+                  exact = 'sparse'):
     #Initialize the output dictionary containing all the information that we want to know about a specific instance
     #   - isEmpty
     #   - isWorking
     #   both of which contains logical True or False values
+    # exact = 'sparse' keeps only the lowest len(GS_indices) exact states (lobpcg), 'dense' diagonalizes all of them
 
     #Initial set up
     info = {}
@@ -60,7 +62,7 @@ def tfim_analysis(L, Jij_seed, perturbation_order, h_x_range = np.arange(0, 0.00
     ###################################
 
     # construct random J matrix
-    Jij = tfim.Jij_instance(N, J, "bimodal", Jij_seed)
+    Jij = tfim.Jij_instance(N, J, "bimodal", Jij_seed, False)
 
     # List out all the spin_states, corresponding indices and energies
     Energies = -tfim.JZZ_SK_ME(basis, Jij)
@@ -68,64 +70,15 @@ def tfim_analysis(L, Jij_seed, perturbation_order, h_x_range = np.arange(0, 0.00
     #     print(index, basis.state(index), Energies[index])
     GS_energy, GS_indices = perturbation.GS(Energies)
 
-    # determine analysis function according to perturbation order
-    analysis_func_dict = {1: perturbation.app_1_eigensystem, 2: perturbation.app_2_eigensystem, 3: perturbation.app_3_eigensystem_general_matrices, 4: perturbation.app_4_eigensystem_general_matrices}
-    analysis_func = analysis_func_dict[perturbation_order]
-
-    # Calculate approximated eigenvalues and eigenstates for range(h_x)
-    app_eigenvalues, app_eigenstates, highest_order_Hamiltonian = analysis_func(GS_indices, GS_energy, h_x_range, J, N,
-                                                                           basis, Jij)
-    # Calculate exact eigenvalues and eigenstates for range(h_x)
-    exc_eigenvalues, exc_eigenstates = perturbation.exc_eigensystem(basis, h_x_range, lattice, Energies)
-
-    # Extract exact ground states
-    exc_GS_eigenstates = np.zeros((len(h_x_range), len(GS_indices), len(GS_indices)))
-
-    for i in range(len(h_x_range)):
-        for m, j in enumerate(GS_indices):
-            for n, k in enumerate(GS_indices):
-                exc_GS_eigenstates[i, m, n] = exc_eigenstates[i, j, n]
-
-    # Extract exact ground energy
-    reordered_app_eigenstates = np.zeros([len(h_x_range), len(GS_indices), len(GS_indices)])
-    epsilon = 1 * 10 ** (-6)
-
-    for h_x_index in range(len(h_x_range)):
-        if h_x_index < 2:
-            reordered_app_eigenstates[h_x_index] = app_eigenstates[h_x_index]
-        else:
-            for k in range(len(GS_indices) // 2):
-                fidelity_array = []
-                for v1 in [reordered_app_eigenstates[h_x_index - 1, :, 2 * k],
-                           reordered_app_eigenstates[h_x_index - 1, :, 2 * k + 1]]:
-                    for v2 in [app_eigenstates[h_x_index, :, 2 * k], app_eigenstates[h_x_index, :, 2 * k + 1]]:
-                        fidelity_array = np.append(fidelity_array, perturbation.fidelity(v1, v2))
-                if abs(fidelity_array[0] - max(fidelity_array)) < epsilon:
-                    reordered_app_eigenstates[h_x_index, :, 2 * k] = app_eigenstates[h_x_index, :, 2 * k]
-                    reordered_app_eigenstates[h_x_index, :, 2 * k + 1] = app_eigenstates[h_x_index, :, 2 * k + 1]
-                else:
-                    reordered_app_eigenstates[h_x_index, :, 2 * k] = app_eigenstates[h_x_index, :, 2 * k + 1]
-                    reordered_app_eigenstates[h_x_index, :, 2 * k + 1] = app_eigenstates[h_x_index, :, 2 * k]
-
-    reordered_exc_GS_eigenstates = np.zeros([len(h_x_range), len(GS_indices), len(GS_indices)])
-    epsilon = 1 * 10 ** (-12)
-
-    for h_x_index in range(len(h_x_range)):
-        if h_x_index < 2:
-            reordered_exc_GS_eigenstates[h_x_index] = exc_GS_eigenstates[h_x_index]
-        else:
-            for k in range(len(GS_indices) // 2):
-                fidelity_array = []
-                for v1 in [reordered_exc_GS_eigenstates[h_x_index - 1, :, 2 * k],
-                           reordered_exc_GS_eigenstates[h_x_index - 1, :, 2 * k + 1]]:
-                    for v2 in [exc_GS_eigenstates[h_x_index, :, 2 * k], exc_GS_eigenstates[h_x_index, :, 2 * k + 1]]:
-                        fidelity_array = np.append(fidelity_array, perturbation.fidelity(v1, v2))
-                if abs(fidelity_array[0] - max(fidelity_array)) < epsilon:
-                    reordered_exc_GS_eigenstates[h_x_index, :, 2 * k] = exc_GS_eigenstates[h_x_index, :, 2 * k]
-                    reordered_exc_GS_eigenstates[h_x_index, :, 2 * k + 1] = exc_GS_eigenstates[h_x_index, :, 2 * k + 1]
-                else:
-                    reordered_exc_GS_eigenstates[h_x_index, :, 2 * k] = exc_GS_eigenstates[h_x_index, :, 2 * k + 1]
-                    reordered_exc_GS_eigenstates[h_x_index, :, 2 * k + 1] = exc_GS_eigenstates[h_x_index, :, 2 * k]
+    # Calculate approximated eigenvalues and eigenstates for range(h_x) at the requested order
+    app_eigenvalues, app_eigenstates, highest_order_Hamiltonian = perturbation.app_k_eigensystem(GS_indices, GS_energy,
+                                                                        h_x_range, J, N, basis, Jij, perturbation_order)
+    # Calculate exact eigenvalues for range(h_x); the survey compares the sorted energies only
+    if exact == 'sparse':
+        exc_eigenvalues = perturbation.exc_GS_eigensystem(basis, h_x_range, lattice, Energies, GS_indices)[0]
+    else:
+        exc_eigenvalues = perturbation.exc_eigensystem(basis, h_x_range, lattice, Energies)[0]
+
     # Calculate and plot energy errors
     corrected_exc_eigenvalues = np.zeros((len(GS_indices), len(h_x_range)))
 
@@ -201,45 +154,16 @@ work flow:
     all the spins are connected at this order. If any zero entries are found, then that means that we need to go to higher order
     (max order is ceiling(N/2))
     
-graph theory approach -- counting components of transition graphs (using networkx, number_connected_components)
+graph theory approach -- counting components of transition graphs (union-find over Hamming distances, tfim_connectivity)
 
 work flow:
     1. calculate the expansion of transition graphs -- each node is a ground state and the edges are coupled ground states
-    2. use networkx to count components of each graph -- if the number is less than 2, then it is fully connected;
+    2. count components of each graph -- if the number is less than 2, then it is fully connected;
     if not, then keep going up to certain order.
     
     or we can use the same graph object and we can add more edges and nodes at each order to the same graph. 
 '''
 
 def min_perturbation_order(GS_indices, basis):
-
-    # getting the coupling coordinates to be the correct format
-    def lst2tuples(coupling_coord):
-        # the coupling coord must be len(GS_indices)by 2
-        output = []
-        for i, coord in enumerate(coupling_coord):
-            coord = tuple(coord)
-            output.append(coord)
-        return output
-
-    # Calculate its Hamming_matrix
-    Hamming_matrix = perturbation.Hamming_array(GS_indices, basis)
-
-    # Construct graph
-    G = nx.Graph()
-    G.add_nodes_from(GS_indices)
-
-    # initiate counter
-    order = 0
-    number_connected_components = 3
-
-    while number_connected_components > 2:
-        coupling_coord = np.argwhere(Hamming_matrix == order)
-        # add edges indicating coupling between ground states
-        G.add_edges_from(lst2tuples(GS_indices[coupling_coord]))
-        number_connected_components = nx.number_connected_components(G)
-        print(number_connected_components)
-        print(order)
-        order += 1
-
-    return order
\ No newline at end of file
+    # lowest order at which the ground manifold is connected up to spin inversion
+    return connectivity.GroundConnectivity(GS_indices, basis.N).z2_order
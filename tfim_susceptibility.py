@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+""""tfim_susceptibility.py
+    --Fourth order perturbative spin glass susceptibility of the classical
+        ground manifold, with a longitudinal field h_z on a site or a pair
+    --Requires: tfim_matrices.py, numpy, scipy.sparse
+"""
+
+import tfim_matrices
+import tfim_parallel
+import logging
+import numpy as np
+from scipy import sparse
+from concurrent.futures import as_completed
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# Terms of H_2, H_3 and H_4 written as walks x_0 = row, x_1, ..., x_n = column
+# through P, Q1 (Q) and Q2 (R). A gap (i, j, k) is the factor
+# 1/(E(x_i) - E(x_j))^k with the longitudinal field included in both energies;
+# the transposed half of each hc() term is listed as the reversed walk
+TERMS = [
+    # (order, coefficient, walk, gaps)
+    (2, 1., 'PQP', [(0, 1, 1)]),
+    (3, -0.5, 'PPQP', [(1, 2, 2)]),
+    (3, -0.5, 'PQPP', [(2, 1, 2)]),
+    (3, 1., 'PQQP', [(0, 1, 1), (3, 2, 1)]),
+    (4, 0.5, 'PQPPP', [(0, 1, 3)]),
+    (4, 0.5, 'PPPQP', [(4, 3, 3)]),
+    (4, -0.5, 'PQPQP', [(0, 1, 2), (2, 3, 1)]),
+    (4, -0.5, 'PQPQP', [(4, 3, 2), (2, 1, 1)]),
+    (4, -1., 'PQQPP', [(0, 1, 1), (3, 2, 2)]),
+    (4, -1., 'PPQQP', [(4, 3, 1), (1, 2, 2)]),
+    # GS -> Q1 -> Q2 -> Q1 -> GS, gaps taken from the column state as in
+    # tfim_perturbation.fourth_order_last_term
+    (4, 1., 'PQRQP', [(4, 3, 1), (4, 2, 1), (4, 1, 1)]),
+]
+
+class Walks:
+    """All walks of one term, with the h_z = 0 contribution of each"""
+
+    def __init__(self, order, coefficient, flat, factors, touched, base):
+        self.order = order
+        self.coefficient = coefficient
+        self.flat = flat            # row*g + column of each walk
+        self.factors = factors      # [(gap, anchor, diff, power), ...]
+        self.touched = touched      # sites whose field changes a gap
+        self.base = base
+
+class Susceptibility:
+    """Perturbative chi_aa, chi_ab and order parameter of the ground manifold
+
+        --H_eff(h_x, h_z) = H_0 - h_z \sum_a sigma^z_a - h_x H_1
+            + h_x^2 H_2 - h_x^3 H_3 + h_x^4 H_4
+        --every term of H_2..H_4 is enumerated once as a list of walks; a
+            field on sites A only changes the gaps of walks flipping a site
+            of A, so H_k(A, h_z) is the h_z = 0 skeleton plus a correction
+            summed over those walks alone
+        --nothing here depends on h_x, so for each h_x the N(N+1)/2 shifted
+            g x g problems are solved as one batched eigvalsh
+        --analytic_susceptibility differentiates every walk in h_z instead,
+            and gets chi_ab from one diagonalization per h_x"""
+
+    def __init__(self, basis, Jij, GS_indices, N, energy=None):
+        self.N = N
+        if energy is None:
+            energy = tfim_matrices.ShellEnergy(basis, Jij, GS_indices)
+        self.energy = energy
+        self.GS_energy = energy.GS_energy
+        self.masks = tfim_matrices.flip_masks(N)
+
+        ES_1_indices = tfim_matrices.Hamming_set(basis, GS_indices, N, GS_indices)
+        ES_2_indices = tfim_matrices.Hamming_set(basis, ES_1_indices, N, GS_indices)
+        self.P = tfim_matrices.SubspaceIndex(GS_indices, N)
+        self.spaces = {'P': self.P,
+                       'Q': tfim_matrices.SubspaceIndex(ES_1_indices, N),
+                       'R': tfim_matrices.SubspaceIndex(ES_2_indices, N)}
+        self.GS_spins = energy.spins(self.P.indices)
+
+        g = len(self.P)
+        self.H_0 = self.GS_energy*np.identity(g)
+        self.H_1 = tfim_matrices.V_block(self.P, self.P).toarray()
+        self.walks = [self._walks(*term) for term in TERMS]
+        self.slopes = None
+        self.stacks = {}
+        self.site_sets = [(a,) for a in range(N)] + [(a, b) for a in range(N) for b in range(a+1, N)]
+        self.skeleton = {order: np.zeros((g, g)) for order in (2, 3, 4)}
+        for walks in self.walks:
+            self.skeleton[walks.order] += np.bincount(walks.flat, walks.base, g*g).reshape(g, g)
+
+    def _walks(self, order, coefficient, kinds, gaps):
+        # Enumerates the walks of one term by flipping one site per step
+        states = self.P.indices[:, np.newaxis]
+        for kind in kinds[1:]:
+            following = (states[:, -1:] ^ self.masks[np.newaxis, :]).ravel()
+            found = self.spaces[kind].contains(following)
+            states = np.column_stack([np.repeat(states, self.N, axis=0)[found], following[found]])
+        g = len(self.P)
+        flat = self.P.lookup(states[:, 0])[0]*g + self.P.lookup(states[:, -1])[0]
+
+        energies = [self.energy.energies(states[:, i]) for i in range(len(kinds))]
+        factors = []
+        touched = np.zeros(len(states), dtype=np.uint64)
+        base = coefficient*np.ones(len(states))
+        for i, j, power in gaps:
+            gap = energies[i] - energies[j]
+            diff = states[:, i] ^ states[:, j]
+            factors.append((gap, states[:, i], diff, power))
+            touched |= diff
+            base /= gap**power
+        return Walks(order, coefficient, flat, factors, touched, base)
+
+    def _values(self, walks, sites, h_z, select):
+        # Contribution of the selected walks with h_z on sites; a flipped
+        # site a shifts the gap by -h_z (sigma_a(anchor) - sigma_a(state))
+        value = walks.coefficient*np.ones(len(select))
+        for gap, anchor, diff, power in walks.factors:
+            shift = np.zeros(len(select))
+            for a in sites:
+                flipped = (diff[select] & self.masks[a]) != 0
+                spin = np.where(anchor[select] & self.masks[a], 2., -2.)
+                shift += flipped*spin
+            value /= (gap[select] - h_z*shift)**power
+        return value
+
+    def terms(self, sites, h_z):
+        """Returns [H_2, H_3, H_4] with a longitudinal field h_z on sites"""
+        g = len(self.P)
+        H = {order: self.skeleton[order].copy() for order in (2, 3, 4)}
+        sites_mask = np.bitwise_or.reduce(self.masks[list(sites)])
+        for walks in self.walks:
+            select = np.flatnonzero(walks.touched & sites_mask)
+            if len(select) == 0:
+                continue
+            delta = self._values(walks, sites, h_z, select) - walks.base[select]
+            H[walks.order] += np.bincount(walks.flat[select], delta, g*g).reshape(g, g)
+        return [H[2], H[3], H[4]]
+
+    def connectivity_matrix(self):
+        """Returns H_0 + H_1 + H_2 + H_3 + H_4, whose nonzeros connect the
+            ground states at fourth order"""
+        return self.H_0 + self.H_1 + sum(self.skeleton.values())
+
+    def ground_energies(self, h_x, H_terms, field, nodes=None):
+        # Lowest eigenvalue of each H_eff in a stack of field shifted terms
+        H_2, H_3, H_4 = H_terms
+        H = (self.H_0 - h_x*self.H_1 + h_x**2*H_2 - h_x**3*H_3 + h_x**4*H_4
+             - field[..., np.newaxis]*np.identity(len(self.P)))
+        H = 0.5*(H + np.swapaxes(H, -1, -2))
+        if nodes is not None:
+            H = H[..., nodes, :][..., nodes]
+        return np.linalg.eigvalsh(H)[..., 0]
+
+    def _stack(self, site_sets, strength):
+        # Field shifted terms and diagonal fields, stacked over site sets
+        terms = [self.terms(sites, strength) for sites in site_sets]
+        H_terms = [np.array([t[k] for t in terms]) for k in range(3)]
+        field = strength*np.array([self.GS_spins[:, list(sites)].sum(axis=1) for sites in site_sets])
+        return H_terms, field
+
+    def _stacks(self, h_z):
+        # Stacks over all site sets for h_z and 2 h_z
+        if h_z not in self.stacks:
+            self.stacks[h_z] = [self._stack(self.site_sets, strength) for strength in (h_z, 2.*h_z)]
+        return self.stacks[h_z]
+
+    def _assemble(self, E0, E1, E2, h_z):
+        # chi_ab and m_a from E(0), E(h_z), E(2 h_z) of every site and pair,
+        # with E1 and E2 ordered as self.site_sets
+        N = self.N
+        second = (E2 - 2.*E1 + E0)/(2.*h_z**2)
+
+        chi_aa = 2.*second[:N]
+        chi_ab = np.diag(chi_aa)
+        a, b = np.array(self.site_sets[N:]).T.reshape(2, -1)
+        chi_ab[a, b] = chi_ab[b, a] = second[N:] - 0.5*(chi_aa[a] + chi_aa[b])
+
+        order_param = (E2[:N] - 4.*E1[:N] + 3.*E0)/(-2.*h_z)
+        return chi_ab, order_param
+
+    def unperturbed_energy(self, h_x, nodes=None):
+        """Returns the ground energy of H_eff at h_z = 0"""
+        return self.ground_energies(h_x, self.skeleton.values(), np.zeros(len(self.P)), nodes)
+
+    def _finite_difference(self, h_x, h_z, nodes):
+        E0 = self.unperturbed_energy(h_x, nodes)
+        E1, E2 = [self.ground_energies(h_x, H_terms, field, nodes) for H_terms, field in self._stacks(h_z)]
+        return self._assemble(E0, E1, E2, h_z)
+
+    def susceptibility(self, h_x_range, h_z, nodes=None):
+        """Returns the spin glass susceptibility \sum_ab chi_ab^2 and the order
+            parameter |\sum_a m_a| for each h_x; nodes restricts the
+            eigenproblems to one connected part of the ground manifold"""
+        chi_arr = np.zeros(len(h_x_range))
+        order_param_arr = np.zeros(len(h_x_range))
+        for l, h_x in enumerate(h_x_range):
+            chi_ab, order_param = self._finite_difference(h_x, h_z, nodes)
+            chi_arr[l] = np.sum(np.power(chi_ab, 2.))
+            order_param_arr[l] = abs(np.sum(order_param))
+        return chi_arr, order_param_arr
+
+    def _derivatives(self):
+        # d/dh_a of a walk is value*U_a with U = \sum_f k_f Delta_f/gap_f, where
+        # Delta_f,a = sigma_a(anchor) - sigma_a(state); d^2/dh_a dh_b adds
+        # value*\sum_f k_f Delta_f,a Delta_f,b/gap_f^2 = value*(W^T W)_ab
+        if self.slopes is not None:
+            return
+        g, N = len(self.P), self.N
+        self.slopes = {order: np.zeros((N, g, g)) for order in (2, 3, 4)}
+        for walks in self.walks:
+            U = sparse.csr_matrix((len(walks.flat), N))
+            walks.W = []
+            for gap, anchor, diff, power in walks.factors:
+                flipped = (diff[:, np.newaxis] & self.masks[np.newaxis, :]) != 0
+                delta = sparse.csr_matrix(2.*self.energy.spins(anchor)*flipped)
+                U = U + sparse.diags(power/gap) @ delta
+                walks.W.append(sparse.diags(np.sqrt(power)/gap) @ delta)
+            walks.U = sparse.csr_matrix(U)
+            U = U.tocoo()
+            self.slopes[walks.order] += np.bincount(U.col*g*g + walks.flat[U.row],
+                            walks.base[U.row]*U.data, N*g*g).reshape(N, g, g)
+
+    def _analytic(self, h_x, nodes):
+        # chi_ab = <0|d_a d_b H|0> + 2 \sum_n <0|d_a H|n><n|d_b H|0>/(E_0 - E_n)
+        # and m_a = -<0|d_a H|0>; None if the ground state is degenerate
+        self._derivatives()
+        g = len(self.P)
+        nodes = np.arange(g) if nodes is None else np.asarray(nodes)
+        coefficient = {2: h_x**2, 3: -h_x**3, 4: h_x**4}
+        H = self.H_0 - h_x*self.H_1 + sum(coefficient[k]*self.skeleton[k] for k in (2, 3, 4))
+        D = -self.GS_spins.T[:, :, np.newaxis]*np.identity(g) + sum(coefficient[k]*self.slopes[k] for k in (2, 3, 4))
+        H = 0.5*(H + H.T)
+        D = 0.5*(D + np.swapaxes(D, 1, 2))
+
+        energies, states = np.linalg.eigh(H[np.ix_(nodes, nodes)])
+        if len(energies) > 1 and energies[1] - energies[0] < 1e-10*max(1., abs(energies[0])):
+            return None
+        M = np.einsum('i,aij,jn->an', states[:, 0], D[:, nodes][:, :, nodes], states)
+        chi_ab = 2.*(M[:, 1:]/(energies[0] - energies[1:])) @ M[:, 1:].T
+
+        amplitude = np.zeros(g)
+        amplitude[nodes] = states[:, 0]
+        for walks in self.walks:
+            omega = sparse.diags(coefficient[walks.order]*walks.base
+                                 *amplitude[walks.flat//g]*amplitude[walks.flat % g])
+            chi_ab += (walks.U.T @ omega @ walks.U).toarray()
+            for W in walks.W:
+                chi_ab += (W.T @ omega @ W).toarray()
+        return chi_ab, -M[:, 0]
+
+    def analytic_susceptibility(self, h_x_range, nodes=None, h_z=None):
+        """Returns the same quantities as susceptibility in the limit
+            h_z -> 0, from exact h_z derivatives of H_eff and second order
+            eigenvalue perturbation theory: one g x g diagonalization per h_x.
+            Where the ground state of H_eff is degenerate this falls back to
+            finite differences with h_z, or gives nan if h_z is None"""
+        chi_arr = np.zeros(len(h_x_range))
+        order_param_arr = np.zeros(len(h_x_range))
+        for l, h_x in enumerate(h_x_range):
+            result = self._analytic(h_x, nodes)
+            if result is None and h_z is not None:
+                result = self._finite_difference(h_x, h_z, nodes)
+            if result is None:
+                chi_arr[l] = order_param_arr[l] = np.nan
+                continue
+            chi_ab, order_param = result
+            chi_arr[l] = np.sum(np.power(chi_ab, 2.))
+            order_param_arr[l] = abs(np.sum(order_param))
+        return chi_arr, order_param_arr
+
+###############################################################################
+# Process parallel finite differences: the engine is shipped to each worker
+# once by the initializer and tasks are (site a, block of h_x), covering the
+# site set (a,) and every pair (a, b > a)
+
+_engine = None
+
+def _initialize(engine):
+    global _engine
+    _engine = engine
+
+def _site_block(a, h_x_block, h_z, nodes):
+    # E(h_z) and E(2 h_z) of site a and its pairs for each h_x of the block
+    site_sets = [(a,)] + [(a, b) for b in range(a+1, _engine.N)]
+    E1, E2 = [np.array([_engine.ground_energies(h_x, H_terms, field, nodes) for h_x in h_x_block])
+              for H_terms, field in (_engine._stack(site_sets, strength) for strength in (h_z, 2.*h_z))]
+    return E1, E2
+
+def parallel_susceptibility(engine, h_x_range, h_z, nodes=None, workers=None, h_x_block=None, threads=None):
+    """Susceptibility.susceptibility on a ProcessPoolExecutor
+
+        --workers and threads (BLAS threads per worker) default to the split
+            of tfim_parallel.resolve, h_x_block (number of h_x values per
+            task) to the whole h_x_range
+        --results are reduced by position, so they do not depend on the
+            order in which tasks finish; progress goes to the module logger"""
+    N = engine.N
+    h_x_range = np.asarray(h_x_range)
+    if h_x_block is None:
+        h_x_block = max(len(h_x_range), 1)
+    blocks = [np.arange(start, min(start + h_x_block, len(h_x_range)))
+              for start in range(0, len(h_x_range), h_x_block)]
+    position = {sites: k for k, sites in enumerate(engine.site_sets)}
+
+    E1 = np.zeros((len(h_x_range), len(engine.site_sets)))
+    E2 = np.zeros((len(h_x_range), len(engine.site_sets)))
+    workers, threads = tfim_parallel.resolve(N, len(blocks)*N, workers, threads)
+    with tfim_parallel.executor(workers, threads, _initialize, (engine,)) as executor:
+        futures = {}
+        for block in blocks:
+            for a in range(N):
+                future = executor.submit(_site_block, a, h_x_range[block], h_z, nodes)
+                futures[future] = (a, block)
+        for done, future in enumerate(as_completed(futures), 1):
+            a, block = futures[future]
+            columns = [position[(a,)]] + [position[(a, b)] for b in range(a+1, N)]
+            E1[np.ix_(block, columns)], E2[np.ix_(block, columns)] = future.result()
+            logger.info('site %d, h_x %g to %g completed (%d/%d)', a, h_x_range[block[0]],
+                        h_x_range[block[-1]], done, len(futures))
+
+    chi_arr = np.zeros(len(h_x_range))
+    order_param_arr = np.zeros(len(h_x_range))
+    for l, h_x in enumerate(h_x_range):
+        chi_ab, order_param = engine._assemble(engine.unperturbed_energy(h_x, nodes), E1[l], E2[l], h_z)
+        chi_arr[l] = np.sum(np.power(chi_ab, 2.))
+        order_param_arr[l] = abs(np.sum(order_param))
+    return chi_arr, order_param_arr
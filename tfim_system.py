@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+""""tfim_system.py
+    --TFIMSystem: one disorder instance of H = \sum_{i<j} J_ij s^z_i s^z_j
+        - h_x \sum_i s^x_i, holding the objects the Lanczos drivers share
+        (lattice, basis, classical energies, ground manifold, sigma^x
+        operator, sigma^z sign table, starting vector)
+    --each object is built on first use and kept for the instance, so a
+        sweep over h_x and the sites a, b builds it once
+    --energies use the convention of the Lanczos drivers, E = +\sum_{i<j}
+        J_ij s_i s_j with s = basis.spin_state(index), i.e. the couplings
+        -J_ij in the convention of tfim_classical
+    --Requires: tfim.py, tfim_classical.py, tfim_hamming.py,
+        tfim_perturbation.py, numpy, scipy.sparse
+"""
+
+from functools import cached_property
+import numpy as np
+from scipy import sparse
+import tfim
+import tfim_classical
+import tfim_hamming
+import tfim_perturbation
+
+###############################################################################
+def sigma_x_csr(N):
+    """Returns \sum_i \sigma^x_i on N spins as a CSR matrix, built from the
+        flip masks instead of a loop over the 2^N states"""
+    M = 2**N
+    kets = np.arange(M, dtype=np.uint64)
+    bras = (kets[:, np.newaxis] ^ tfim_hamming.flip_masks(N)[np.newaxis, :]).ravel()
+    cols = np.repeat(np.arange(M), N)
+    return sparse.csr_matrix((np.ones(M*N), (bras.astype(np.int64), cols)), shape=(M, M))
+
+def sigma_z_table(N):
+    """Returns the (N, 2^N) int8 table of \sigma^z_a for every site and state"""
+    kets = np.arange(2**N, dtype=np.uint64)
+    bits = (kets[np.newaxis, :] & tfim_hamming.flip_masks(N)[:, np.newaxis]) != 0
+    return (2*bits.astype(np.int8) - 1).astype(np.int8)
+
+###############################################################################
+class TFIMSystem:
+    """Shared prerequisites of one instance, built once on first use
+
+        --Jij is the N x N coupling matrix, or a function of the lattice
+            returning it (e.g. a random bond instance)
+        --give L (and PBC) for a lattice, or only N for irregular tiles
+        --hamiltonian(h_x) keeps the CSR of the last h_x, so the sites of
+            one h_x share it"""
+
+    def __init__(self, Jij, N=None, L=None, PBC=True):
+        self.L = L
+        self.PBC = PBC
+        self.N = N if N is not None else int(np.prod(L))
+        self._Jij = Jij
+        self._hamiltonian = (None, None)
+
+    @cached_property
+    def lattice(self):
+        return tfim.Lattice(self.L, self.PBC)
+
+    @cached_property
+    def basis(self):
+        return tfim.IsingBasis(self.lattice)
+
+    @cached_property
+    def Jij(self):
+        if callable(self._Jij):
+            return self._Jij(self.lattice)
+        return np.asarray(self._Jij)
+
+    @cached_property
+    def states(self):
+        """Basis state indices packed as uint64"""
+        return np.arange(2**self.N, dtype=np.uint64)
+
+    @cached_property
+    def energies(self):
+        return tfim_classical.energy_table([-self.Jij], self.N)[0]
+
+    @cached_property
+    def ground_manifold(self):
+        """Classical ground state energy and indices"""
+        return tfim_perturbation.GS(self.energies)
+
+    @cached_property
+    def v0(self):
+        """Starting vector: the sum of the classical ground states"""
+        v0 = np.zeros(2**self.N)
+        v0[self.ground_manifold[1]] = 1
+        return v0
+
+    @cached_property
+    def V(self):
+        """\sum_i \sigma^x_i as CSR"""
+        return sigma_x_csr(self.N)
+
+    @cached_property
+    def H_0(self):
+        return sparse.diags(self.energies)
+
+    @cached_property
+    def sigma_z(self):
+        """(N, 2^N) table of \sigma^z_a"""
+        return sigma_z_table(self.N)
+
+    def hamiltonian(self, h_x):
+        """H_0 - h_x V as CSR"""
+        if self._hamiltonian[0] != h_x:
+            self._hamiltonian = (h_x, (self.H_0 - self.V.multiply(h_x)).tocsr())
+        return self._hamiltonian[1]
+
+    def longitudinal(self, *sites):
+        """\sum_{a in sites} \sigma^z_a as a sparse diagonal"""
+        return sparse.diags(np.sum(self.sigma_z[list(sites)], axis=0, dtype=float))